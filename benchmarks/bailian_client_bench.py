@@ -0,0 +1,125 @@
+"""
+百炼client基准测试：对比每次新建client + SDK异步方法（改造前）与共享client + 线程池（改造后）的单请求延迟。
+
+本地起一个HTTP服务模拟百炼Retrieve接口，不需要真实AK&SK和数据库：
+    python benchmarks/bailian_client_bench.py --requests 50 --indexes 5 --latency 0.01
+
+本地是明文HTTP，不包含TLS握手；线上走HTTPS，复用连接省下的握手耗时比这里测出来的更多。
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from alibabacloud_bailian20231229.client import Client as bailian20231229Client
+from alibabacloud_bailian20231229 import models as bailian_20231229_models
+from alibabacloud_tea_openapi import models as open_api_models
+from alibabacloud_tea_util import models as util_models
+from utils.security import encrypt, decrypt
+
+BENCH_KEY = 'needle_bench'
+WORKSPACE_ID = 'llm-bench'
+RESPONSE = json.dumps({
+    'Success': True,
+    'Code': 'Success',
+    'RequestId': 'bench',
+    'Data': {'Nodes': [{'Score': 0.9, 'Text': '测试片段' * 50, 'Metadata': {'doc_name': 'bench'}}] * 5}
+}).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_client(ak, sk, endpoint, pool_size=None):
+    client_config = open_api_models.Config(access_key_id=ak, access_key_secret=sk, protocol='http',
+                                           max_idle_conns=pool_size)
+    client_config.endpoint = endpoint
+    return bailian20231229Client(client_config)
+
+
+def retrieve_request(index_id):
+    return bailian_20231229_models.RetrieveRequest(query='签证材料', index_id=index_id, enable_reranking=True)
+
+
+async def before(enc_ak, enc_sk, endpoint, indexes):
+    async def one(index_id):
+        client = make_client(decrypt(enc_ak, BENCH_KEY), decrypt(enc_sk, BENCH_KEY), endpoint)
+        return await client.retrieve_with_options_async(WORKSPACE_ID, retrieve_request(index_id), {},
+                                                        util_models.RuntimeOptions())
+    return await asyncio.gather(*[one(i) for i in indexes])
+
+
+async def after(client, executor, runtime, indexes):
+    loop = asyncio.get_running_loop()
+
+    async def one(index_id):
+        func = functools.partial(client.retrieve_with_options, WORKSPACE_ID, retrieve_request(index_id), {}, runtime)
+        return await loop.run_in_executor(executor, func)
+    return await asyncio.gather(*[one(i) for i in indexes])
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f'{name:<8} mean={statistics.mean(latencies) * 1000:7.2f}ms  p50={statistics.median(latencies) * 1000:7.2f}ms'
+          f'  p95={p95 * 1000:7.2f}ms')
+
+
+async def main(args):
+    StandInHandler.latency = args.latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'127.0.0.1:{server.server_address[1]}'
+
+    enc_ak, enc_sk = encrypt('bench-ak', BENCH_KEY), encrypt('bench-sk', BENCH_KEY)
+    indexes = [f'index{i}' for i in range(args.indexes)]
+
+    runtime = util_models.RuntimeOptions(keep_alive=True, max_idle_conns=args.pool_size)
+    client = make_client(decrypt(enc_ak, BENCH_KEY), decrypt(enc_sk, BENCH_KEY), endpoint, args.pool_size)
+    executor = ThreadPoolExecutor(max_workers=args.pool_size)
+
+    for name, run in (('before', lambda: before(enc_ak, enc_sk, endpoint, indexes)),
+                      ('after', lambda: after(client, executor, runtime, indexes))):
+        await run()  # 预热
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            await run()
+            latencies.append(time.perf_counter() - start)
+        report(name, latencies)
+
+    executor.shutdown()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=50, help='请求次数，每次请求并发检索所有index')
+    parser.add_argument('--indexes', type=int, default=5, help='每次请求检索的index数量')
+    parser.add_argument('--latency', type=float, default=0.01, help='模拟服务端处理耗时，单位秒')
+    parser.add_argument('--pool-size', type=int, default=16)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,126 @@
+"""
+文件上传基准测试：对比改造前后单个大文件从收到上传到PUT完成的耗时和Python内存峰值。
+
+改造前：file.read()整体读进内存 -> 写盘 -> calculate_md5按4KB重新读一遍 -> read_file整体读回内存 -> requests.put（每次新建连接）
+改造后：分块拷贝落盘同时计算MD5和大小 -> 共享Session从文件句柄流式PUT
+
+本地起一个HTTP服务模拟OSS预签名URL，不需要真实AK&SK和数据库，在仓库根目录执行：
+    python benchmarks/upload_bench.py --size-mb 200 --files 3
+
+文件内容是随机字节，模拟压缩过的大PDF；内存峰值用tracemalloc统计，只包含Python分配的内存。
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.upload import create_upload_session, put_file
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_PUT(self):
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def before(source_path, target_dir, url):
+    # 对应改造前的 await file.read() + save_file_to_index_path + calculate_md5 + read_file + requests.put
+    with open(source_path, 'rb') as upload:
+        content = upload.read()
+    file_path = os.path.join(target_dir, 'before.pdf')
+    with open(file_path, 'wb') as file:
+        file.write(content)
+    md5_hash = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(4096), b''):
+            md5_hash.update(chunk)
+    md5_hash.hexdigest()
+    os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        file_content = file.read()
+    response = requests.put(url, data=file_content, headers={'Content-Type': 'application/pdf'})
+    response.raise_for_status()
+
+
+def after(source_path, target_dir, url, session, buffer_size):
+    # 对应 save_stream_to_index_path + upload_file，拷贝逻辑与utils.files_utils一致，避免依赖配置文件
+    file_path = os.path.join(target_dir, 'after.pdf')
+    md5_hash = hashlib.md5()
+    size = 0
+    with open(source_path, 'rb') as upload, open(file_path, 'wb') as file:
+        for chunk in iter(lambda: upload.read(buffer_size), b''):
+            md5_hash.update(chunk)
+            file.write(chunk)
+            size += len(chunk)
+    md5_hash.hexdigest()
+    response = put_file(session, file_path, url, {'Content-Type': 'application/pdf'}, buffer_size=buffer_size)
+    response.raise_for_status()
+
+
+def measure(run, files):
+    latencies = []
+    peak = 0
+    for _ in range(files):
+        tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return latencies, peak
+
+
+def main(args):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/upload'
+
+    work_dir = tempfile.mkdtemp(prefix='upload_bench_')
+    source_path = os.path.join(work_dir, 'source.pdf')
+    with open(source_path, 'wb') as source:
+        for _ in range(args.size_mb):
+            source.write(os.urandom(1024 * 1024))
+
+    buffer_size = args.buffer_kb * 1024
+    session = create_upload_session(1)
+    try:
+        for name, run in (('before', lambda: before(source_path, work_dir, url)),
+                          ('after', lambda: after(source_path, work_dir, url, session, buffer_size))):
+            run()  # 预热页缓存和连接
+            latencies, peak = measure(run, args.files)
+            throughput = args.size_mb / statistics.mean(latencies)
+            print(f'{name:<8} mean={statistics.mean(latencies) * 1000:8.1f}ms  {throughput:7.1f}MB/s'
+                  f'  peak_python_memory={peak / 1024 / 1024:7.1f}MB')
+    finally:
+        session.close()
+        server.shutdown()
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=200, help='单个文件大小，单位MB')
+    parser.add_argument('--files', type=int, default=3, help='每种方式上传的次数')
+    parser.add_argument('--buffer-kb', type=int, default=1024, help='改造后每次读写的字节数，单位KB')
+    main(parser.parse_args())
@@ -9,8 +9,8 @@ from utils.security import decrypt
 # 创建一个基类，用于定义表结构
 Base = declarative_base()
 
-# 创建数据库引擎和Session
-db_url = (
+# 创建数据库引擎和Session，配置了url时直接使用（如测试环境的sqlite）
+db_url = config['database'].get('url') or (
         f"mysql+{config['database']['driver']}://"
         f"{config['database']['username']}:{decrypt(config['database']['password'])}@"
         f"{config['database']['host']}:{config['database']['port']}/"
@@ -0,0 +1,15 @@
+from data.database import TableModel
+from sqlalchemy import Column, String, BigInteger, UniqueConstraint
+
+
+class FileRegistryEntity(TableModel):
+    """已上传到百炼数据中心的文件，按(workspace_id, md5, size)去重，跨任务和知识库复用file_id"""
+    # 已有的表需要手动加上：ALTER TABLE fileregistryentity ADD UNIQUE KEY uq_file_registry_content (workspace_id, md5, size)
+    __table_args__ = (UniqueConstraint('workspace_id', 'md5', 'size', name='uq_file_registry_content'),)
+
+    workspace_id = Column(String(64))
+    md5 = Column(String(32), index=True)
+    size = Column(BigInteger)
+    file_id = Column(String(50), index=True)
+    # 最近一次入库任务里的解析状态，解析失败的文件不复用
+    status = Column(String(20))
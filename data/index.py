@@ -0,0 +1,8 @@
+from data.database import TableModel
+from sqlalchemy import Column, String, Integer
+
+
+class IndexGenerationEntity(TableModel):
+    """知识库内容的代数，入库完成或删除时加一；检索缓存的key带上代数，所有进程里的旧缓存条目不再命中"""
+    index_id = Column(String(64), unique=True)
+    generation = Column(Integer, default=0)
@@ -0,0 +1,31 @@
+from data.database import TableModel
+from sqlalchemy import Column, String, Integer, DateTime, Text
+
+
+class JobStatus:
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+
+
+class IngestJobEntity(TableModel):
+    """入库任务队列，API进程写入，worker进程按租约领取执行"""
+    job_type = Column(String(32))
+    task_id = Column(String(36), index=True)
+    # 相同job_type和batch_key的排队任务领取时合并执行，如同一知识库的添加文件任务
+    batch_key = Column(String(64), index=True)
+    # 请求参数JSON，文件已落盘，只包含路径和元数据
+    payload = Column(Text)
+    status = Column(String(10), index=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    # PENDING状态下最早可以执行的时间，失败重试时按退避时间推后
+    run_after = Column(DateTime)
+    lease_owner = Column(String(64))
+    lease_expires = Column(DateTime)
+    last_error = Column(Text)
+
+    @property
+    def last_attempt(self):
+        return self.attempts >= self.max_attempts
@@ -3,9 +3,12 @@ from sqlalchemy import Column, String, DateTime, text
 
 
 class TaskStatus:
+    PENDING = 'PENDING'
     RUNNING = 'RUNNING'
     COMPLETED = 'COMPLETED'
     FAILED = 'FAILED'
+    # 知识库或其中的文档已删除，不再算作对文件的引用
+    DELETED = 'DELETED'
 
 
 class TaskEntity(TableModel):
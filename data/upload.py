@@ -0,0 +1,18 @@
+from data.database import TableModel
+from sqlalchemy import Column, String, BigInteger
+
+
+class UploadStatus:
+    UPLOADING = 'UPLOADING'
+    COMPLETED = 'COMPLETED'
+
+
+class UploadEntity(TableModel):
+    """分块续传的上传会话，已接收的字节数以暂存文件大小为准，服务重启后可以继续上传"""
+    upload_id = Column(String(36), index=True)
+    file_name = Column(String(255))
+    size = Column(BigInteger)
+    # 初始化时客户端声明的MD5，完成时校验；未声明时记录实际计算的MD5
+    md5 = Column(String(32))
+    path = Column(String(255))
+    status = Column(String(10))
@@ -0,0 +1,83 @@
+Feature: Stream-extract zip and tar uploads into a knowledge base
+
+  Scenario: Files with the same name in different folders are both kept
+    Given a "docs.zip" archive with the entries:
+      | name          | content |
+      | a/readme.txt  | first   |
+      | b/readme.txt  | second  |
+      | b/c/guide.md  | guide   |
+    When I extract the archive into index "idx_archive"
+    Then the extracted files should be "readme.txt, readme.txt, guide.md"
+    And the extracted contents should be "first, second, guide"
+    And every extracted file should be inside the index folder
+
+  Scenario: Entry names cannot escape the index folder
+    Given a "evil.zip" archive with the entries:
+      | name                 | content |
+      | ../../escape.txt     | zip     |
+      | /tmp/absolute.txt    | abs     |
+    When I extract the archive into index "idx_archive"
+    Then the extracted files should be "escape.txt, absolute.txt"
+    And every extracted file should be inside the index folder
+
+  Scenario: Tar members that are not regular files are ignored
+    Given a "docs.tar.gz" archive with the entries:
+      | name             | content   |
+      | ../up.txt        | tar       |
+      | link.txt         | -> up.txt |
+      | folder/          |           |
+    When I extract the archive into index "idx_archive"
+    Then the extracted files should be "up.txt"
+    And every extracted file should be inside the index folder
+
+  Scenario: Hidden, unsupported and empty entries are skipped
+    Given a "mixed.tar" archive with the entries:
+      | name                | content |
+      | __MACOSX/._a.txt    | meta    |
+      | .hidden.txt         | hidden  |
+      | image.png           | png     |
+      | empty.txt           |         |
+      | notes.md            | notes   |
+    When I extract the archive into index "idx_archive"
+    Then the extracted files should be "notes.md"
+    And the skipped entries should be "image.png: unsupported file type, empty.txt: empty file"
+
+  Scenario: Chinese names written by Windows zip tools are decoded as GBK
+    Given a "cn.zip" archive with GBK encoded entries:
+      | name            | content |
+      | 资料/说明.txt   | gbk     |
+    When I extract the archive into index "idx_archive"
+    Then the extracted files should be "说明.txt"
+
+  Scenario: Archives with too many entries are rejected
+    Given the archive limits are 2 entries and 1000 bytes
+    And a "many.zip" archive with the entries:
+      | name  | content |
+      | 1.txt | one     |
+      | 2.txt | two     |
+      | 3.txt | three   |
+    When I extract the archive into index "idx_archive"
+    Then the extraction should fail with "too many entries in archive: many.zip, max: 2"
+
+  Scenario: Archives that expand beyond the size limit are rejected
+    Given the archive limits are 10 entries and 10 bytes
+    And a "big.tgz" archive with the entries:
+      | name  | content  |
+      | 1.txt | 12345678 |
+      | 2.txt | 12345678 |
+    When I extract the archive into index "idx_archive"
+    Then the extraction should fail with "file too large"
+
+  Scenario: Skipped entries are listed in the task status
+    Given the following store tasks exist:
+      | task_id | status  | index_id | job_id |
+      | t_arc   | PENDING | idx_arc  |        |
+    And a "mixed.zip" archive with the entries:
+      | name       | content |
+      | image.png  | png     |
+      | empty.txt  |         |
+      | notes.md   | notes   |
+    When I extract the archive into index "idx_archive"
+    And the skipped entries are recorded for task "t_arc"
+    And I request the status of task "t_arc"
+    Then the task status should list "image: FAILED, empty: FAILED"
@@ -0,0 +1,47 @@
+Feature: In-process retrieve cache
+
+  Scenario: Least recently used entry is evicted when the cache is full
+    Given a memory cache with ttl 60 seconds, 2 entries and 1000 bytes
+    When I cache "a" as "1"
+    And I cache "b" as "2"
+    And I read "a" from the cache
+    And I cache "c" as "3"
+    Then the cache should hold "a, c"
+    And the cache should not hold "b"
+
+  Scenario: Oldest entries are evicted when the byte limit is exceeded
+    Given a memory cache with ttl 60 seconds, 10 entries and 10 bytes
+    When I cache "a" as "12345"
+    And I cache "b" as "12345"
+    And I cache "c" as "123"
+    Then the cache should hold "b, c"
+    And the cache should not hold "a"
+    And the cache should use 8 bytes
+
+  Scenario: A value larger than the byte limit is not cached
+    Given a memory cache with ttl 60 seconds, 10 entries and 4 bytes
+    When I cache "a" as "12345"
+    Then the cache should not hold "a"
+    And the cache should use 0 bytes
+
+  Scenario: Entries expire after the ttl
+    Given a memory cache with ttl 0.1 seconds, 10 entries and 1000 bytes
+    When I cache "a" as "1"
+    And I wait 0.2 seconds
+    Then the cache should not hold "a"
+    And the cache should use 0 bytes
+
+  Scenario: Invalidating an index drops only its entries
+    Given a memory cache with ttl 60 seconds, 10 entries and 1000 bytes
+    When index "idx_1" caches "a" as "1"
+    And index "idx_2" caches "b" as "2"
+    And I invalidate index "idx_1" in the cache
+    Then the cache should hold "b"
+    And the cache should not hold "a"
+
+  Scenario: Hits and misses are counted
+    Given a memory cache with ttl 60 seconds, 10 entries and 1000 bytes
+    When I cache "a" as "1"
+    And I read "a" from the cache
+    And I read "missing" from the cache
+    Then the cache stats should show 1 hits and 1 misses
@@ -0,0 +1,47 @@
+Feature: Resumable chunked uploads
+
+  Scenario: Chunks are appended at the received offset
+    Given I start a chunked upload of "hello world!" as "greeting.txt"
+    When I upload "hello " at offset 0
+    And I upload "world!" at offset 6
+    And I complete the upload
+    Then the upload should be "COMPLETED" with 12 bytes received
+    And the uploaded file should contain "hello world!"
+
+  Scenario: A chunk sent from before the received offset truncates and rewrites
+    Given I start a chunked upload of "hello world!" as "greeting.txt"
+    When I upload "hello wXXX" at offset 0
+    And I upload "world!" at offset 6
+    And I complete the upload
+    Then the upload should be "COMPLETED" with 12 bytes received
+    And the uploaded file should contain "hello world!"
+
+  Scenario: A chunk that would leave a gap is rejected
+    Given I start a chunked upload of "hello world!" as "greeting.txt"
+    When I upload "hello" at offset 0
+    And I upload "orld!" at offset 7
+    Then the upload request should fail with "invalid offset: 7, received: 5"
+    And the upload should be "UPLOADING" with 5 bytes received
+
+  Scenario: A chunk that overruns the declared size is rejected
+    Given I start a chunked upload of "hello world!" as "greeting.txt"
+    When I upload "hello world!!!" at offset 0
+    Then the upload request should fail with "chunk too large"
+    And the upload should be "UPLOADING" with 0 bytes received
+
+  Scenario: An interrupted upload resumes from the part file size
+    Given I start a chunked upload of "hello world!" as "greeting.txt"
+    When I upload "hello " at offset 0
+    And I complete the upload
+    Then the upload request should fail with "upload incomplete, received: 6, size: 12"
+    When I resume the upload with "hello world!"
+    And I complete the upload
+    Then the upload should be "COMPLETED" with 12 bytes received
+    And the uploaded file should contain "hello world!"
+
+  Scenario: A completed upload whose MD5 does not match is rejected
+    Given I start a chunked upload of "hello world!" as "greeting.txt" declaring the MD5 of "something else"
+    When I upload "hello world!" at offset 0
+    And I complete the upload
+    Then the upload request should fail with "md5 mismatch"
+    And the upload should be "UPLOADING" with 12 bytes received
@@ -1,82 +1,33 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from data.task import TaskEntry 
-from data.database import Base  
-from server.server import app
-import threading
-import time
-import uvicorn
+import os
+
+# 测试环境：res/test/application.yml，本地sqlite，密钥只用于解密测试配置里的假AK/SK
+os.environ.setdefault('ENV', 'test')
+os.environ.setdefault('needle_assistant_test', 'needle-test')
+
 from fastapi.testclient import TestClient
-# Database setup
-DATABASE_URL = "sqlite:///res/example.db"
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
+from data.database import Base, engine, connect_db
+# 导入app时会导入所有实体（包括日志表），之后再建表
+from server.server import app
+
+USERNAME = 'needle'
+PASSWORD = 'needle-test'
 
-def run_app():
-    """Function to run the FastAPI app using uvicorn."""
-    uvicorn.run(app, host="127.0.0.1", port=8000)
 
 def before_all(context):
-    # Setup code before all tests run
-    # Create the database tables
-    Base.metadata.create_all(engine)
+    Base.metadata.drop_all(engine)
+    connect_db()
+    # 不进入lifespan，不启动内嵌worker和大模型client
+    context.client = TestClient(app)
+    context.auth = (USERNAME, PASSWORD)
 
-    # Start the FastAPI app in a separate thread
-    context.server_thread = threading.Thread(target=run_app)
-    context.server_thread.start()
 
-    # Give the server a moment to start
-    time.sleep(2)
-    # Setup the application
-    context.client = TestClient(app) 
-    
-    # Populate mock_tasks with realistic data
-    task0 = TaskEntry(
-            task_id="123e4567-e89b-12d3-a456-426614174000",
-            status="RUNNING"
-    )
-    task0.save()
-    task1 = TaskEntry(
-            task_id="123e4567-e89b-12d3-a456-426614174001",
-            status="SUCCESS"
-    )
-    task1.save()
-    task2 = TaskEntry(
-            task_id="123e4567-e89b-12d3-a456-426614174002",
-            status="FAIL"
-    )
-    task2.save()
-"""
-    with Session() as session:
-        mock_tasks = []
-        mock_tasks.append(TaskEntry(
-            task_id="123e4567-e89b-12d3-a456-426614174000",
-            status="RUNNING"
-        ))
-        mock_tasks.append(TaskEntry(
-            task_id="123e4567-e89b-12d3-a456-426614174001",
-            status="SUCCESS"
-        ))
-        mock_tasks.append(TaskEntry(
-            task_id="123e4567-e89b-12d3-a456-426614174002",
-            status="FAIL"
-        ))
+def before_scenario(context, scenario):
+    # 每个场景从空表开始
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
 
-        session.add_all(context.mock_tasks)
-        session.commit() 
-        
-"""
 
 def after_all(context):
-    # Cleanup code after all tests run
-    
-    # Remove all mock data from the database
-    with Session() as session:
-        session.query(TaskEntry).delete()
-        session.commit()
-        session.close()
-        
-    # Drop the database tables
+    context.client.close()
     Base.metadata.drop_all(engine)
-
-    context.server_thread.join(timeout=1) 
\ No newline at end of file
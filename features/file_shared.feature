@@ -0,0 +1,19 @@
+Feature: Deduplicated files are kept while another index still uses them
+
+  Scenario Outline: Another index's task decides whether the file is shared
+    Given the following store tasks exist:
+      | task_id | status        | index_id | job_id |
+      | t_b     | <task_status> | idx_b    | job_b  |
+    And file "file_x" belongs to task "t_b" with status "<file_status>"
+    Then file "file_x" should be <shared> outside index "idx_c"
+    And file "file_x" should be not shared outside index "idx_b"
+
+    Examples:
+      | task_status | file_status | shared     |
+      | PENDING     | RUNNING     | shared     |
+      | RUNNING     | RUNNING     | shared     |
+      | COMPLETED   | FINISH      | shared     |
+      | FAILED      | RUNNING     | not shared |
+      | DELETED     | FINISH      | not shared |
+      | COMPLETED   | FAILED      | not shared |
+      | COMPLETED   | DELETED     | not shared |
@@ -0,0 +1,66 @@
+Feature: Diff a directory manifest against an index for incremental sync
+
+  Background:
+    Given the index "idx_sync" holds the documents:
+      | doc_id | name  | md5 | size |
+      | file_a | a     | m1  | 10   |
+      | file_b | b     | m2  | 20   |
+      | file_c | c     |     |      |
+
+  Scenario: Files with the same content are unchanged
+    When I diff the manifest against index "idx_sync":
+      | name  | md5 | size |
+      | a.pdf | M1  | 10   |
+      | b.pdf | m2  | 20   |
+      | c.pdf | m3  | 30   |
+    Then the diff should add "-"
+    And the diff should change "c.pdf"
+    And the diff should keep 2 documents unchanged
+    And the diff should delete "file_c: changed"
+
+  Scenario: Documents missing from the manifest are removed
+    When I diff the manifest against index "idx_sync":
+      | name    | md5 | size |
+      | a.pdf   | m1  | 10   |
+      | new.pdf | m9  | 90   |
+    Then the diff should add "new.pdf"
+    And the diff should keep 1 documents unchanged
+    And the diff should delete "file_b: removed, file_c: removed"
+
+  Scenario: Missing documents are kept when delete_missing is off
+    When I diff the manifest against index "idx_sync" keeping missing documents:
+      | name    | md5 | size |
+      | a.pdf   | m1  | 10   |
+    Then the diff should keep 1 documents unchanged
+    And the diff should delete "-"
+
+  Scenario: A renamed file is matched by its content
+    When I diff the manifest against index "idx_sync" keeping missing documents:
+      | name          | md5 | size |
+      | renamed-a.pdf | m1  | 10   |
+    Then the diff should add "-"
+    And the diff should keep 1 documents unchanged
+    And the diff should delete "-"
+
+  Scenario: A changed file replaces the old version with the same name
+    When I diff the manifest against index "idx_sync" keeping missing documents:
+      | name  | md5 | size |
+      | b.pdf | m7  | 21   |
+    Then the diff should change "b.pdf"
+    And the diff should delete "file_b: changed"
+
+  Scenario: Extra documents with the same name as kept content are duplicates
+    Given the index "idx_sync" also holds document "file_a2" named "a"
+    When I diff the manifest against index "idx_sync" keeping missing documents:
+      | name  | md5 | size |
+      | a.pdf | m1  | 10   |
+    Then the diff should keep 1 documents unchanged
+    And the diff should delete "file_a2: duplicate"
+
+  Scenario: Manifest names that collide without extension are conflicts
+    When I diff the manifest against index "idx_sync" keeping missing documents:
+      | name   | md5 | size |
+      | a.pdf  | m1  | 10   |
+      | a.docx | m5  | 50   |
+    Then the diff should report conflicts "a.docx"
+    And the diff should keep 1 documents unchanged
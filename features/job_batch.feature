@@ -0,0 +1,51 @@
+Feature: Add-documents jobs for one index are claimed and run as a batch
+
+  Scenario: Queued jobs with the same batch key are claimed together
+    Given "file_add" jobs for tasks "a, b, c" are queued for index "idx_1"
+    And "file_add" jobs for tasks "d" are queued for index "idx_2"
+    When worker "w1" claims a batch of up to 20 jobs
+    Then the claimed batch should hold tasks "a, b, c"
+    And the jobs for tasks "d" should be "PENDING"
+
+  Scenario: A batch is capped at the batch size
+    Given "file_add" jobs for tasks "a, b, c, d" are queued for index "idx_1"
+    When worker "w1" claims a batch of up to 2 jobs
+    Then the claimed batch should hold tasks "a, b"
+    And the jobs for tasks "c, d" should be "PENDING"
+
+  Scenario: Jobs without a batch key are claimed one at a time
+    Given "create_store" jobs for tasks "a, b" are queued without a batch key
+    When worker "w1" claims a batch of up to 20 jobs
+    Then the claimed batch should hold tasks "a"
+
+  Scenario: The batch handler fails only the jobs it reports
+    Given "file_add" jobs for tasks "a, b, c" are queued for index "idx_1"
+    And the batch handler fails task "b" with "boom"
+    When a worker runs the queued jobs in batches of 20
+    Then the batch handler should have run tasks "a, b, c" together
+    And the jobs for tasks "a, c" should be "COMPLETED"
+    And the job for task "b" should be "PENDING" after 1 attempts with an error containing "boom"
+
+  Scenario: An exception from the batch handler fails the whole batch
+    Given "file_add" jobs for tasks "a, b" are queued for index "idx_1"
+    And the batch handler raises "boom"
+    When a worker runs the queued jobs in batches of 20
+    Then the job for task "a" should be "PENDING" after 1 attempts with an error containing "boom"
+    And the job for task "b" should be "PENDING" after 1 attempts with an error containing "boom"
+
+  Scenario: A batch whose lease is lost is released without using an attempt
+    Given "file_add" jobs for tasks "a, b" are queued for index "idx_1"
+    And the batch handler loses the lease on its first run
+    When a worker runs the queued jobs in batches of 20
+    Then the batch handler should have run 2 times
+    And the jobs for tasks "a, b" should be "COMPLETED" after 1 attempts
+
+  Scenario Outline: Add-documents requests only get a batch key when coalescing is enabled
+    Given job coalescing is <coalesce>
+    When I add files to index "idx_1"
+    Then the queued "file_add" job should have batch key "<batch_key>"
+
+    Examples:
+      | coalesce | batch_key |
+      | disabled | -         |
+      | enabled  | idx_1     |
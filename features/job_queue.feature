@@ -0,0 +1,70 @@
+Feature: Durable ingest job queue with leases
+
+  Background:
+    Given the following store tasks exist:
+      | task_id | status  | index_id | job_id |
+      | t1      | PENDING | idx_1    |        |
+
+  Scenario: A queued job is claimed by exactly one worker
+    Given a "test" job for task "t1" is queued with 3 max attempts
+    When worker "w1" claims a job
+    And worker "w2" claims a job
+    Then worker "w1" should hold the job for task "t1" on attempt 1
+    And worker "w2" should get no job
+    And the job for task "t1" should be "RUNNING" and leased by "w1"
+
+  Scenario: Heartbeats keep the lease of the owning worker
+    Given a "test" job for task "t1" is queued with 3 max attempts
+    When worker "w1" claims a job
+    Then worker "w1" should still own its job after a heartbeat
+    And the lease of worker "w1" should pass the check
+
+  Scenario: An expired lease is taken over and fences the old worker
+    Given a "test" job for task "t1" is queued with 3 max attempts
+    When worker "w1" claims a job
+    And the lease of the job for task "t1" expires
+    And worker "w2" claims a job
+    Then worker "w2" should hold the job for task "t1" on attempt 2
+    And worker "w1" should no longer own its job after a heartbeat
+    And the lease of worker "w1" should be lost
+    And worker "w1" should not be able to complete its job
+    And the job for task "t1" should be "RUNNING" and leased by "w2"
+
+  Scenario: A failed job is retried after its backoff
+    Given a "test" job for task "t1" is queued with 3 max attempts
+    When worker "w1" claims a job
+    And worker "w1" fails its job with "boom"
+    And worker "w2" claims a job
+    Then the job for task "t1" should be "PENDING" after 1 attempts with error "boom"
+    And worker "w2" should get no job
+
+  Scenario: A job that fails on its last attempt is not retried
+    Given a "test" job for task "t1" is queued with 1 max attempts
+    When worker "w1" claims a job
+    And worker "w1" fails its job with "boom"
+    Then the job for task "t1" should be "FAILED" after 1 attempts with error "boom"
+
+  Scenario: A lease that expires on the last attempt fails the job and its task
+    Given a "test" job for task "t1" is queued with 1 max attempts
+    When worker "w1" claims a job
+    And the lease of the job for task "t1" expires
+    And worker "w2" claims a job
+    Then worker "w2" should get no job
+    And the job for task "t1" should be "FAILED" after 1 attempts with error "Lease expired on the last attempt, attempts: 1"
+    And store task "t1" should be "FAILED"
+
+  Scenario: A released job goes back to the queue without using an attempt
+    Given a "test" job for task "t1" is queued with 3 max attempts
+    When worker "w1" claims a job
+    And worker "w1" releases its job
+    And worker "w2" claims a job
+    Then worker "w2" should hold the job for task "t1" on attempt 1
+
+  Scenario: A lease that expires on the last attempt leaves a deleted task alone
+    Given a "test" job for task "t1" is queued with 1 max attempts
+    When worker "w1" claims a job
+    And store task "t1" is marked "DELETED"
+    And the lease of the job for task "t1" expires
+    And worker "w2" claims a job
+    Then the job for task "t1" should be "FAILED" after 1 attempts with error "Lease expired on the last attempt, attempts: 1"
+    And store task "t1" should be "DELETED"
@@ -0,0 +1,40 @@
+Feature: Parallel single-pass pagination of index documents
+
+  Scenario: All pages are returned in page order
+    Given the index "idx_list" holds 250 documents
+    When I list the documents of index "idx_list"
+    Then I should get documents 1 to 250 in order
+    And pages "1, 2, 3" should each have been requested once
+
+  Scenario: An empty index needs a single request
+    Given the index "idx_list" holds 0 documents
+    When I list the documents of index "idx_list"
+    Then I should get no documents
+    And pages "1" should each have been requested once
+
+  Scenario: A page that fails transiently is retried
+    Given the index "idx_list" holds 250 documents
+    And page 2 fails 2 times before succeeding
+    When I list the documents of index "idx_list"
+    Then I should get documents 1 to 250 in order
+    And page 2 should have been requested 3 times
+
+  Scenario: A page that keeps failing aborts the listing
+    Given the index "idx_list" holds 450 documents
+    And page 3 fails 10 times before succeeding
+    When I list the documents of index "idx_list"
+    Then the listing should fail with "Exception for list_file, index_id: idx_list, page: 3"
+    And page 3 should have been requested 4 times
+
+  Scenario: An unsuccessful response counts as a failure
+    Given the index "idx_list" holds 150 documents
+    And page 2 answers without success 10 times
+    When I list the documents of index "idx_list"
+    Then the listing should fail with "Exception for list_file, index_id: idx_list, page: 2"
+
+  Scenario: Stopping early does not request the remaining pages
+    Given the index "idx_list" holds 500 documents
+    And at most 1 page is listed concurrently
+    When I read the first 100 documents of index "idx_list"
+    Then I should get documents 1 to 100 in order
+    And pages "1" should each have been requested once
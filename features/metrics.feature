@@ -0,0 +1,11 @@
+Feature: Per-request stage timings
+
+  Scenario: Each index keeps its own timing entry and shares one histogram
+    Given a stage timer for request "trace1"
+    When stage "retrieve.index:idx_a" takes 0.2 seconds
+    And stage "retrieve.index:idx_b" takes 1.5 seconds
+    And stage "retrieve.index:idx_a" takes 0.3 seconds
+    And the "bench" request finishes
+    Then the timings should include "retrieve.index:idx_a, retrieve.index:idx_b, retrieve.index:idx_a#2, total"
+    And the "bench.retrieve.index" histogram should have 3 samples
+    And the Server-Timing header should include 'retrieve.index;desc="idx_b";dur=1500.0'
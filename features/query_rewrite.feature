@@ -0,0 +1,67 @@
+Feature: Query rewrite and speculative retrieve
+
+  Background:
+    Given the rewrite cache is empty
+    And the knowledge base answers:
+      | query      | text     | score |
+      | 它多少钱       | 原话检索的片段  | 0.5   |
+      | 欧洲团签证费用多少钱 | 改写后检索的片段 | 0.9   |
+    And the conversation is:
+      | role      | content  |
+      | user      | 欧洲团签证怎么办 |
+      | assistant | 老板，需要护照  |
+      | user      | 它多少钱     |
+
+  Scenario: Merge policy combines the rewritten and the speculative chunks
+    Given the speculative policy is "merge"
+    And the LLM rewrites the question to "欧洲团签证费用多少钱"
+    When I retrieve the conversation speculatively
+    Then the knowledge base should have been searched for "它多少钱, 欧洲团签证费用多少钱"
+    And the chunks used for the answer should be "改写后检索的片段, 原话检索的片段"
+
+  Scenario: Replace policy keeps only the rewritten chunks
+    Given the speculative policy is "replace"
+    And the LLM rewrites the question to "欧洲团签证费用多少钱"
+    When I retrieve the conversation speculatively
+    Then the chunks used for the answer should be "改写后检索的片段"
+
+  Scenario: A rewrite slower than the deadline falls back to the speculative chunks
+    Given the speculative deadline is 0.1 seconds
+    And the LLM rewrites the question to "欧洲团签证费用多少钱" after 1 seconds
+    When I retrieve the conversation speculatively
+    Then the knowledge base should have been searched for "它多少钱"
+    And the chunks used for the answer should be "原话检索的片段"
+
+  Scenario: A failed rewrite falls back to the speculative chunks
+    Given the LLM fails to rewrite the question
+    When I retrieve the conversation speculatively
+    Then the knowledge base should have been searched for "它多少钱"
+    And the chunks used for the answer should be "原话检索的片段"
+
+  Scenario: A rewrite equal to the raw question is not searched twice
+    Given the speculative policy is "merge"
+    And the LLM rewrites the question to " 它多少钱 "
+    When I retrieve the conversation speculatively
+    Then the knowledge base should have been searched for "它多少钱"
+    And the chunks used for the answer should be "原话检索的片段"
+
+  Scenario: A single-turn question is searched without calling the LLM
+    Given the LLM rewrites the question to "欧洲团签证费用多少钱"
+    And a conversation with 0 earlier messages ending with "它多少钱"
+    When I build the prompt for the conversation
+    Then the LLM should have been called 0 times
+    And the knowledge base should have been searched for "它多少钱"
+
+  Scenario Outline: Rewrite decision in <mode> mode
+    Given a conversation with <earlier> earlier messages ending with "<question>"
+    When I check whether the question needs a rewrite in "<mode>" mode
+    Then the rewrite decision should be "<decision>"
+
+    Examples:
+      | mode   | earlier | question         | decision |
+      | auto   | 0       | 它多少钱             | skipped  |
+      | auto   | 2       | 它多少钱             | needed   |
+      | auto   | 2       | 欧洲团签证的费用一般是多少钱呢  | skipped  |
+      | auto   | 2       | 那些欧洲国家的签证费用一般是多少 | needed   |
+      | always | 0       | 它多少钱             | needed   |
+      | never  | 2       | 它多少钱             | skipped  |
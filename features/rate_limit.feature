@@ -0,0 +1,23 @@
+Feature: Token bucket rate limiting for Bailian API calls
+
+  Scenario: Calls within the burst do not wait
+    Given a token bucket with 10 qps and a burst of 5
+    When I acquire 5 tokens
+    Then none of the acquires should have waited
+    And the bucket stats should show 5 calls and 0 waited calls
+
+  Scenario: Calls beyond the burst wait for the refill
+    Given a token bucket with 10 qps and a burst of 5
+    When I acquire 7 tokens
+    Then the last acquire should have waited about 0.1 seconds
+    And the bucket stats should show 7 calls and 2 waited calls
+
+  Scenario: Concurrent callers reserve tokens without blocking each other
+    Given a token bucket with 20 qps and a burst of 1
+    When 5 threads acquire a token at the same time
+    Then the waits should be spread 0.05 seconds apart
+
+  Scenario: Unconfigured APIs share the default limit
+    Given a rate limiter with a default of 3 qps and "Retrieve" limited to 7 qps
+    Then the "Retrieve" bucket should allow 7 qps
+    And the "ListIndexDocuments" bucket should allow 3 qps
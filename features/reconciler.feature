@@ -0,0 +1,20 @@
+Feature: Background reconciliation of index jobs
+
+  Scenario: Only submitted tasks that have not finished are polled
+    Given the following store tasks exist:
+      | task_id | status    | index_id | job_id |
+      | t_run   | RUNNING   | idx_1    | job_1  |
+      | t_done  | COMPLETED | idx_1    | job_2  |
+      | t_fail  | FAILED    | idx_1    | job_3  |
+      | t_del   | DELETED   | idx_2    | job_4  |
+      | t_new   | PENDING   | idx_3    |        |
+    Then the reconciler should poll tasks "t_run"
+
+  Scenario: Deleting an index stops polling its tasks
+    Given the following store tasks exist:
+      | task_id | status    | index_id | job_id |
+      | t_run   | RUNNING   | idx_1    | job_1  |
+      | t_done  | COMPLETED | idx_1    | job_2  |
+    When index "idx_1" is marked deleted
+    Then the reconciler should poll tasks "-"
+    And store task "t_done" should be "DELETED"
@@ -0,0 +1,36 @@
+Feature: Retrieve cache invalidation across processes
+
+  Background:
+    Given index "idx_cache" answers retrieve calls with a new version each time
+    And the retrieve cache is empty
+
+  Scenario: A repeated query is served from the cache
+    When I retrieve "hello" from index "idx_cache"
+    And I retrieve "hello" from index "idx_cache"
+    Then Bailian should have been called 1 times
+    And the retrieved text should be "version 1"
+
+  Scenario: Invalidating an index in this process drops its cached results
+    When I retrieve "hello" from index "idx_cache"
+    And index "idx_cache" is invalidated in this process
+    And I retrieve "hello" from index "idx_cache"
+    Then Bailian should have been called 2 times
+    And the retrieved text should be "version 2"
+
+  Scenario: Invalidation from a worker process reaches this process after the generation ttl
+    When I retrieve "hello" from index "idx_cache"
+    And another process invalidates index "idx_cache"
+    And I retrieve "hello" from index "idx_cache"
+    Then Bailian should have been called 1 times
+    When the cached index generations expire
+    And I retrieve "hello" from index "idx_cache"
+    Then Bailian should have been called 2 times
+    And the retrieved text should be "version 2"
+
+  Scenario: Other indexes keep their cached results
+    Given index "idx_other" answers retrieve calls with a new version each time
+    When I retrieve "hello" from index "idx_other"
+    And another process invalidates index "idx_cache"
+    And the cached index generations expire
+    And I retrieve "hello" from index "idx_other"
+    Then Bailian should have been called 1 times
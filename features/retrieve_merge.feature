@@ -0,0 +1,46 @@
+Feature: Global top-k merge of retrieve results across indexes
+
+  Scenario: Chunks from all indexes are ranked by score
+    Given the retrieve results:
+      | index | text | score |
+      | A     | a1   | 0.9   |
+      | A     | a2   | 0.5   |
+      | B     | b1   | 0.8   |
+      | B     | b2   | 0.7   |
+    When I merge the top 3 chunks with "none" normalization
+    Then the merged chunks should be "a1, b1, b2"
+
+  Scenario Outline: Ties keep the index order, then the rank inside the index
+    Given the retrieve results:
+      | index | text | score |
+      | A     | a1   | 0.5   |
+      | A     | a2   | 0.5   |
+      | B     | b1   | 0.5   |
+      | B     | b2   | 0.5   |
+    When I merge the top <top_n> chunks with "none" normalization
+    Then the merged chunks should be "<chunks>"
+
+    Examples:
+      | top_n | chunks         |
+      | 2     | a1, a2         |
+      | 4     | a1, a2, b1, b2 |
+      | 10    | a1, a2, b1, b2 |
+
+  Scenario: Normalized ties fall back to the raw score
+    Given the retrieve results:
+      | index | text | score |
+      | A     | a1   | 0.9   |
+      | A     | a2   | 0.8   |
+      | B     | b1   | 0.3   |
+      | B     | b2   | 0.1   |
+    When I merge all chunks with "minmax" normalization
+    Then the merged chunks should be "a1, b1, a2, b2"
+
+  Scenario: An index without results is skipped
+    Given the retrieve results:
+      | index | text | score |
+      | A     | a1   | 0.4   |
+      | B     |      |       |
+      | C     | c1   | 0.6   |
+    When I merge all chunks with "max" normalization
+    Then the merged chunks should be "c1, a1"
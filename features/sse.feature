@@ -0,0 +1,27 @@
+Feature: Coalesced SSE framing of streamed answers
+
+  Scenario: The first token is sent at once and the rest are buffered up to the frame size
+    Given the model streams the tokens "a|bb|cc|dd|e" 0 seconds apart
+    When I coalesce the stream into frames of 4 characters flushed every 1 seconds
+    Then the frames should be "a|bbcc|dde"
+
+  Scenario: A partial buffer is flushed after the flush interval
+    Given the model streams the tokens "a|b|c" 0.1 seconds apart
+    When I coalesce the stream into frames of 64 characters flushed every 0.02 seconds
+    Then the frames should be "a|b|c"
+
+  Scenario: Empty tokens do not produce frames
+    Given the model streams the tokens "a|||b" 0 seconds apart
+    When I coalesce the stream into frames of 1 characters flushed every 1 seconds
+    Then the frames should be "a|b"
+
+  Scenario: Heartbeats keep an idle stream alive
+    Given the model streams the tokens "a|b" 0.2 seconds apart
+    When I coalesce the stream into frames of 64 characters flushed every 0.01 seconds with heartbeats every 0.05 seconds
+    Then the frames should include a heartbeat
+    And the frame contents should add up to "ab"
+
+  Scenario: Content frames match the success response JSON
+    Given the model streams the tokens "中文 \"引号\"" 0 seconds apart
+    When I coalesce the stream into frames of 64 characters flushed every 1 seconds
+    Then every content frame should be a success response with its content
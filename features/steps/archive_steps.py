@@ -0,0 +1,128 @@
+import io
+import os
+import shutil
+import tarfile
+import zipfile
+from behave import given, when, then
+from utils import archive
+from utils.archive import extract_archive
+from utils.bailian import record_skipped_files
+from utils.files_utils import get_index_path
+
+
+class _GbkZipInfo(zipfile.ZipInfo):
+    """模拟Windows压缩工具：文件名按GBK编码，不设置UTF-8标记"""
+
+    def _encodeFilenameFlags(self):
+        return self.filename.encode('gbk'), self.flag_bits
+
+
+def _zip(rows, gbk=False):
+    stream = io.BytesIO()
+    with zipfile.ZipFile(stream, 'w') as zip_file:
+        for row in rows:
+            info = _GbkZipInfo(row['name']) if gbk else zipfile.ZipInfo(row['name'])
+            zip_file.writestr(info, row['content'])
+    return stream
+
+
+def _tar(rows, mode):
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode=mode) as tar_file:
+        for row in rows:
+            info = tarfile.TarInfo(row['name'])
+            content = row['content'].encode()
+            if row['name'].endswith('/'):
+                info.type = tarfile.DIRTYPE
+                tar_file.addfile(info)
+            elif row['content'].startswith('-> '):
+                info.type = tarfile.SYMTYPE
+                info.linkname = row['content'][3:]
+                tar_file.addfile(info)
+            else:
+                info.size = len(content)
+                tar_file.addfile(info, io.BytesIO(content))
+    return stream
+
+
+@given('a "{archive_name}" archive with the entries')
+def step_impl(context, archive_name):
+    context.archive_name = archive_name
+    if archive_name.endswith('.zip'):
+        context.archive = _zip(context.table)
+    else:
+        context.archive = _tar(context.table, 'w' if archive_name.endswith('.tar') else 'w:gz')
+
+
+@given('a "{archive_name}" archive with GBK encoded entries')
+def step_impl(context, archive_name):
+    context.archive_name = archive_name
+    context.archive = _zip(context.table, gbk=True)
+
+
+@given('the archive limits are {max_entries:d} entries and {max_total_size:d} bytes')
+def step_impl(context, max_entries, max_total_size):
+    limits = archive.MAX_ENTRIES, archive.MAX_TOTAL_SIZE
+
+    def restore():
+        archive.MAX_ENTRIES, archive.MAX_TOTAL_SIZE = limits
+
+    archive.MAX_ENTRIES, archive.MAX_TOTAL_SIZE = max_entries, max_total_size
+    context.add_cleanup(restore)
+
+
+@when('I extract the archive into index "{index_id}"')
+def step_impl(context, index_id):
+    context.index_path = os.path.realpath(get_index_path(index_id))
+    context.add_cleanup(shutil.rmtree, context.index_path, True)
+    context.archive.seek(0)
+    context.error = None
+    try:
+        context.files, context.skipped = extract_archive(index_id, context.archive_name, context.archive)
+    except ValueError as e:
+        context.error = e
+
+
+@then('the extracted files should be "{names}"')
+def step_impl(context, names):
+    assert context.error is None, context.error
+    assert [file.name for file in context.files] == names.split(', '), context.files
+
+
+@then('the extracted contents should be "{contents}"')
+def step_impl(context, contents):
+    for file, content in zip(context.files, contents.split(', ')):
+        with open(file.path, 'rb') as f:
+            assert f.read() == content.encode(), file
+        assert file.size == len(content), file
+
+
+@then('every extracted file should be inside the index folder')
+def step_impl(context):
+    for file in context.files:
+        assert os.path.realpath(file.path).startswith(context.index_path + os.sep), file.path
+
+
+@then('the skipped entries should be "{entries}"')
+def step_impl(context, entries):
+    skipped = [f'{file.name}: {file.reason}' for file in context.skipped]
+    expected = entries.split(', ')
+    assert len(skipped) == len(expected), skipped
+    for entry, prefix in zip(skipped, expected):
+        assert entry.startswith(prefix), skipped
+
+
+@then('the extraction should fail with "{error}"')
+def step_impl(context, error):
+    assert context.error is not None and str(context.error).startswith(error), context.error
+
+
+@when('the skipped entries are recorded for task "{task_id}"')
+def step_impl(context, task_id):
+    record_skipped_files(task_id, context.skipped)
+
+
+@then('the task status should list "{documents}"')
+def step_impl(context, documents):
+    listed = [f"{doc['doc_name']}: {doc['status']}" for doc in context.response.json()['data']['documents']]
+    assert listed == documents.split(', '), listed
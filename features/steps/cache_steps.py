@@ -0,0 +1,56 @@
+import time
+from behave import given, when, then
+from utils.cache import MemoryCache
+
+
+@given('a memory cache with ttl {ttl:g} seconds, {max_entries:d} entries and {max_bytes:d} bytes')
+def step_impl(context, ttl, max_entries, max_bytes):
+    context.cache = MemoryCache('test_cache', ttl, max_entries, max_bytes)
+
+
+@when('I cache "{key}" as "{value}"')
+def step_impl(context, key, value):
+    context.cache.set(key, value)
+
+
+@when('index "{index_id}" caches "{key}" as "{value}"')
+def step_impl(context, index_id, key, value):
+    context.cache.set(key, value, tags=(index_id,))
+
+
+@when('I read "{key}" from the cache')
+def step_impl(context, key):
+    context.cache.get(key)
+
+
+@when('I invalidate index "{index_id}" in the cache')
+def step_impl(context, index_id):
+    context.cache.invalidate(index_id)
+
+
+@when('I wait {seconds:g} seconds')
+def step_impl(context, seconds):
+    time.sleep(seconds)
+
+
+@then('the cache should hold "{keys}"')
+def step_impl(context, keys):
+    for key in keys.split(', '):
+        assert context.cache._get(key) is not None, key
+
+
+@then('the cache should not hold "{keys}"')
+def step_impl(context, keys):
+    for key in keys.split(', '):
+        assert context.cache._get(key) is None, key
+
+
+@then('the cache should use {size:d} bytes')
+def step_impl(context, size):
+    assert context.cache.stats()['bytes'] == size, context.cache.stats()
+
+
+@then('the cache stats should show {hits:d} hits and {misses:d} misses')
+def step_impl(context, hits, misses):
+    stats = context.cache.stats()
+    assert (stats['hits'], stats['misses']) == (hits, misses), stats
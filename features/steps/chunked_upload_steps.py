@@ -0,0 +1,61 @@
+import hashlib
+import shutil
+from behave import given, when, then
+from data.upload import UploadEntity
+from utils.files_utils import get_index_path
+
+
+def _start(context, content, file_name, md5):
+    response = context.client.post('/vector_store/upload/init', auth=context.auth,
+                                   json={'file_name': file_name, 'size': len(content.encode()), 'md5': md5})
+    context.upload_id = response.json()['data']['upload_id']
+    context.add_cleanup(shutil.rmtree, get_index_path(context.upload_id), True)
+
+
+@given('I start a chunked upload of "{content}" as "{file_name}" declaring the MD5 of "{other}"')
+def step_impl(context, content, file_name, other):
+    _start(context, content, file_name, hashlib.md5(other.encode()).hexdigest())
+
+
+@given('I start a chunked upload of "{content}" as "{file_name}"')
+def step_impl(context, content, file_name):
+    _start(context, content, file_name, hashlib.md5(content.encode()).hexdigest())
+
+
+@when('I upload "{chunk}" at offset {offset:d}')
+def step_impl(context, chunk, offset):
+    context.response = context.client.put(f'/vector_store/upload/{context.upload_id}', auth=context.auth,
+                                          params={'offset': offset}, content=chunk.encode())
+
+
+@when('I resume the upload with "{content}"')
+def step_impl(context, content):
+    response = context.client.get(f'/vector_store/upload/{context.upload_id}', auth=context.auth)
+    offset = response.json()['data']['offset']
+    context.execute_steps(f'When I upload "{content[offset:]}" at offset {offset}')
+    assert context.response.json()['status'] == 'success', context.response.text
+
+
+@when('I complete the upload')
+def step_impl(context):
+    context.response = context.client.post(f'/vector_store/upload/{context.upload_id}/complete', auth=context.auth)
+
+
+@then('the upload request should fail with "{error}"')
+def step_impl(context, error):
+    body = context.response.json()
+    assert body['status'] == 'fail' and body['error'].startswith(error), body
+
+
+@then('the upload should be "{status}" with {offset:d} bytes received')
+def step_impl(context, status, offset):
+    data = context.client.get(f'/vector_store/upload/{context.upload_id}', auth=context.auth).json()['data']
+    assert (data['status'], data['offset']) == (status, offset), data
+
+
+@then('the uploaded file should contain "{content}"')
+def step_impl(context, content):
+    upload = UploadEntity.query_first(upload_id=context.upload_id)
+    with open(upload.path, 'rb') as file:
+        assert file.read() == content.encode()
+    assert upload.md5 == hashlib.md5(content.encode()).hexdigest()
@@ -0,0 +1,18 @@
+from behave import given, then
+from data.task import FileTaskEntity
+from utils.bailian import is_file_shared
+
+
+@given('file "{doc_id}" belongs to task "{task_id}" with status "{status}"')
+def step_impl(context, doc_id, task_id, status):
+    FileTaskEntity.create(task_id=task_id, doc_name=doc_id, doc_id=doc_id, status=status)
+
+
+@then('file "{file_id}" should be shared outside index "{index_id}"')
+def step_impl(context, file_id, index_id):
+    assert is_file_shared(file_id, index_id)
+
+
+@then('file "{file_id}" should be not shared outside index "{index_id}"')
+def step_impl(context, file_id, index_id):
+    assert not is_file_shared(file_id, index_id)
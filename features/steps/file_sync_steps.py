@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+from behave import given, when, then
+from services import file_sync
+from services.file_sync import SyncRequest, ManifestEntry, diff
+from utils.bailian import register_file
+
+
+def _names(names):
+    return [] if names == '-' else names.split(', ')
+
+
+@given('the index "{index_id}" holds the documents')
+def step_impl(context, index_id):
+    context.documents = {index_id: []}
+    for row in context.table:
+        context.documents[index_id].append(SimpleNamespace(id=row['doc_id'], name=row['name']))
+        if row['md5']:
+            register_file(row['md5'], int(row['size']), row['doc_id'])
+    iter_list_file = file_sync.iter_list_file
+    context.add_cleanup(setattr, file_sync, 'iter_list_file', iter_list_file)
+    # 替换百炼的文档列表，登记表使用测试数据库
+    file_sync.iter_list_file = lambda id, file_name=None: iter(context.documents[id])
+
+
+@given('the index "{index_id}" also holds document "{doc_id}" named "{name}"')
+def step_impl(context, index_id, doc_id, name):
+    context.documents[index_id].append(SimpleNamespace(id=doc_id, name=name))
+
+
+def _diff(context, index_id, delete_missing):
+    files = [ManifestEntry(name=row['name'], md5=row['md5'], size=int(row['size'])) for row in context.table]
+    context.diff = diff(SyncRequest(id=index_id, files=files, delete_missing=delete_missing))
+
+
+@when('I diff the manifest against index "{index_id}" keeping missing documents')
+def step_impl(context, index_id):
+    _diff(context, index_id, False)
+
+
+@when('I diff the manifest against index "{index_id}"')
+def step_impl(context, index_id):
+    _diff(context, index_id, True)
+
+
+@then('the diff should add "{names}"')
+def step_impl(context, names):
+    assert context.diff.added == _names(names), context.diff
+
+
+@then('the diff should change "{names}"')
+def step_impl(context, names):
+    assert context.diff.changed == _names(names), context.diff
+
+
+@then('the diff should keep {count:d} documents unchanged')
+def step_impl(context, count):
+    assert context.diff.unchanged == count, context.diff
+
+
+@then('the diff should delete "{documents}"')
+def step_impl(context, documents):
+    deleted = [f'{document.doc_id}: {document.reason}' for document in context.diff.deleted]
+    assert deleted == _names(documents), context.diff
+
+
+@then('the diff should report conflicts "{names}"')
+def step_impl(context, names):
+    assert context.diff.conflicts == _names(names), context.diff
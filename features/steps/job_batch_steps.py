@@ -0,0 +1,133 @@
+import time
+from behave import given, when, then
+from data.job import IngestJobEntity, JobStatus
+from services import file_add as file_add_module
+from utils.job_queue import enqueue, claim, claim_batch, Worker, LeaseLost
+
+
+def _task_ids(task_ids):
+    return task_ids.split(', ')
+
+
+def _wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+@given('"{job_type}" jobs for tasks "{task_ids}" are queued for index "{index_id}"')
+def step_impl(context, job_type, task_ids, index_id):
+    context.job_types = [job_type]
+    for task_id in _task_ids(task_ids):
+        enqueue(job_type, task_id, '{}', batch_key=index_id)
+
+
+@given('"{job_type}" jobs for tasks "{task_ids}" are queued without a batch key')
+def step_impl(context, job_type, task_ids):
+    context.job_types = [job_type]
+    for task_id in _task_ids(task_ids):
+        enqueue(job_type, task_id, '{}')
+
+
+@given('the batch handler fails task "{task_id}" with "{error}"')
+def step_impl(context, task_id, error):
+    context.handler_result = lambda jobs: {job.id: RuntimeError(error) for job in jobs if job.task_id == task_id}
+
+
+@given('the batch handler raises "{error}"')
+def step_impl(context, error):
+    def result(jobs):
+        raise RuntimeError(error)
+
+    context.handler_result = result
+
+
+@given('the batch handler loses the lease on its first run')
+def step_impl(context):
+    def result(jobs):
+        if len(context.batches) == 1:
+            raise LeaseLost('lease lost')
+
+    context.handler_result = result
+
+
+@when('worker "{worker_id}" claims a batch of up to {batch_size:d} jobs')
+def step_impl(context, worker_id, batch_size):
+    job = claim(worker_id, context.job_types)
+    context.batch = [job] + claim_batch(job, worker_id, batch_size - 1)
+
+
+@when('a worker runs the queued jobs in batches of {batch_size:d}')
+def step_impl(context, batch_size):
+    context.batches = []
+
+    def handler(jobs, lease):
+        context.batches.append([job.task_id for job in jobs])
+        return context.handler_result(jobs)
+
+    def done():
+        # 放回队列的任务会被再次领取，完成、失败或等待退避重试时才算执行结束
+        return context.batches and all(job.status in (JobStatus.COMPLETED, JobStatus.FAILED) or
+                                       (job.status == JobStatus.PENDING and job.last_error)
+                                       for job in IngestJobEntity.query_all())
+
+    worker = Worker({}, concurrency=1, poll_interval=0.05, batch_handlers={context.job_types[0]: handler},
+                    batch_size=batch_size)
+    worker.start()
+    try:
+        _wait_until(done)
+    finally:
+        worker.stop(5)
+
+
+@then('the claimed batch should hold tasks "{task_ids}"')
+def step_impl(context, task_ids):
+    assert [job.task_id for job in context.batch] == _task_ids(task_ids), [job.task_id for job in context.batch]
+
+
+@then('the jobs for tasks "{task_ids}" should be "{status}"')
+def step_impl(context, task_ids, status):
+    for task_id in _task_ids(task_ids):
+        assert IngestJobEntity.query_first(task_id=task_id).status == status, task_id
+
+
+@then('the jobs for tasks "{task_ids}" should be "{status}" after {attempts:d} attempts')
+def step_impl(context, task_ids, status, attempts):
+    for task_id in _task_ids(task_ids):
+        job = IngestJobEntity.query_first(task_id=task_id)
+        assert (job.status, job.attempts) == (status, attempts), (task_id, job.status, job.attempts)
+
+
+@then('the job for task "{task_id}" should be "{status}" after {attempts:d} attempts with an error containing "{error}"')
+def step_impl(context, task_id, status, attempts, error):
+    job = IngestJobEntity.query_first(task_id=task_id)
+    assert (job.status, job.attempts) == (status, attempts), (job.status, job.attempts)
+    assert error in job.last_error, job.last_error
+
+
+@then('the batch handler should have run tasks "{task_ids}" together')
+def step_impl(context, task_ids):
+    assert context.batches == [_task_ids(task_ids)], context.batches
+
+
+@then('the batch handler should have run {count:d} times')
+def step_impl(context, count):
+    assert len(context.batches) == count, context.batches
+
+
+@given('job coalescing is {state}')
+def step_impl(context, state):
+    context.add_cleanup(setattr, file_add_module, 'COALESCE', file_add_module.COALESCE)
+    file_add_module.COALESCE = state == 'enabled'
+
+
+@when('I add files to index "{index_id}"')
+def step_impl(context, index_id):
+    file_add_module.file_add(file_add_module.FileAddRequest(id=index_id, files=[]))
+
+
+@then('the queued "{job_type}" job should have batch key "{batch_key}"')
+def step_impl(context, job_type, batch_key):
+    job = IngestJobEntity.query_first(job_type=job_type)
+    assert job.batch_key == (None if batch_key == '-' else batch_key), job.batch_key
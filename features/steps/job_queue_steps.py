@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from behave import given, when, then
+from data.job import IngestJobEntity
+from data.task import StoreTaskEntity
+from utils.job_queue import enqueue, claim, heartbeat, complete, fail, release, Lease, LeaseLost
+
+
+def _job(task_id):
+    return IngestJobEntity.query_first(task_id=task_id)
+
+
+@given('a "{job_type}" job for task "{task_id}" is queued with {max_attempts:d} max attempts')
+def step_impl(context, job_type, task_id, max_attempts):
+    context.job_types = [job_type]
+    enqueue(job_type, task_id, '{}', max_attempts)
+
+
+@when('worker "{worker_id}" claims a job')
+def step_impl(context, worker_id):
+    if not hasattr(context, 'claimed'):
+        context.claimed = {}
+    context.claimed[worker_id] = claim(worker_id, context.job_types)
+
+
+@when('the lease of the job for task "{task_id}" expires')
+def step_impl(context, task_id):
+    _job(task_id).set(lease_expires=datetime.now() - timedelta(seconds=1))
+
+
+@when('worker "{worker_id}" fails its job with "{error}"')
+def step_impl(context, worker_id, error):
+    assert fail(context.claimed[worker_id], worker_id, error)
+
+
+@when('worker "{worker_id}" releases its job')
+def step_impl(context, worker_id):
+    assert release(context.claimed[worker_id], worker_id)
+
+
+@then('worker "{worker_id}" should hold the job for task "{task_id}" on attempt {attempts:d}')
+def step_impl(context, worker_id, task_id, attempts):
+    job = context.claimed[worker_id]
+    assert job is not None and (job.task_id, job.attempts) == (task_id, attempts), job
+
+
+@then('worker "{worker_id}" should get no job')
+def step_impl(context, worker_id):
+    assert context.claimed[worker_id] is None, context.claimed[worker_id]
+
+
+@then('the job for task "{task_id}" should be "{status}" and leased by "{worker_id}"')
+def step_impl(context, task_id, status, worker_id):
+    job = _job(task_id)
+    assert (job.status, job.lease_owner) == (status, worker_id), (job.status, job.lease_owner)
+    assert job.lease_expires > datetime.now()
+
+
+@then('the job for task "{task_id}" should be "{status}" after {attempts:d} attempts with error "{error}"')
+def step_impl(context, task_id, status, attempts, error):
+    job = _job(task_id)
+    assert (job.status, job.attempts, job.last_error, job.lease_owner) == (status, attempts, error, None), \
+        (job.status, job.attempts, job.last_error, job.lease_owner)
+
+
+@then('worker "{worker_id}" should still own its job after a heartbeat')
+def step_impl(context, worker_id):
+    job = context.claimed[worker_id]
+    assert heartbeat([job.id], worker_id) == {job.id}
+
+
+@then('worker "{worker_id}" should no longer own its job after a heartbeat')
+def step_impl(context, worker_id):
+    assert heartbeat([context.claimed[worker_id].id], worker_id) == set()
+
+
+@then('the lease of worker "{worker_id}" should pass the check')
+def step_impl(context, worker_id):
+    lease = Lease([context.claimed[worker_id].id], worker_id)
+    lease.check()
+    assert not lease.lost
+
+
+@then('the lease of worker "{worker_id}" should be lost')
+def step_impl(context, worker_id):
+    lease = Lease([context.claimed[worker_id].id], worker_id)
+    try:
+        lease.check()
+    except LeaseLost:
+        assert lease.lost
+    else:
+        raise AssertionError('LeaseLost not raised')
+
+
+@then('worker "{worker_id}" should not be able to complete its job')
+def step_impl(context, worker_id):
+    assert not complete(context.claimed[worker_id], worker_id)
+
+
+@then('store task "{task_id}" should be "{status}"')
+def step_impl(context, task_id, status):
+    task = StoreTaskEntity.query_first(task_id=task_id)
+    assert task.status == status, task.status
+
+
+@when('store task "{task_id}" is marked "{status}"')
+def step_impl(context, task_id, status):
+    StoreTaskEntity.query_first(task_id=task_id).set(status=status)
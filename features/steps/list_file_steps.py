@@ -0,0 +1,102 @@
+import threading
+from collections import Counter
+from types import SimpleNamespace
+from behave import given, when, then
+from utils import bailian
+from utils.bailian import iter_list_file, MAX_PAGE_SIZE
+
+
+class _FakeClient:
+    """按页返回文档的百炼client，可以让指定的页先失败若干次"""
+
+    def __init__(self, total_count):
+        self.total_count = total_count
+        self.failures = {}
+        self.requests = Counter()
+        self._lock = threading.Lock()
+
+    def list_index_documents_with_options(self, workspace_id, request, headers, runtime):
+        page = request.page_number
+        with self._lock:
+            self.requests[page] += 1
+            failure = self.failures.get(page)
+            if failure is not None and failure[1] > 0:
+                failure[1] -= 1
+                if failure[0] == 'error':
+                    raise ConnectionError(f'page {page} unavailable')
+                return SimpleNamespace(status_code=200, body=SimpleNamespace(success=False, message='Throttling'))
+        start = (page - 1) * MAX_PAGE_SIZE
+        documents = [SimpleNamespace(id=f'doc-{i + 1}', name=f'doc-{i + 1}')
+                     for i in range(start, min(start + MAX_PAGE_SIZE, self.total_count))]
+        return SimpleNamespace(status_code=200, body=SimpleNamespace(
+            success=True, data=SimpleNamespace(documents=documents, total_count=self.total_count)))
+
+
+def _patch(context, name, value):
+    context.add_cleanup(setattr, bailian, name, getattr(bailian, name))
+    setattr(bailian, name, value)
+
+
+@given('the index "{index_id}" holds {count:d} documents')
+def step_impl(context, index_id, count):
+    context.client = _FakeClient(count)
+    _patch(context, 'client', context.client)
+    _patch(context, 'LIST_RETRY_BACKOFF', 0)
+
+
+@given('page {page:d} fails {times:d} times before succeeding')
+def step_impl(context, page, times):
+    context.client.failures[page] = ['error', times]
+
+
+@given('page {page:d} answers without success {times:d} times')
+def step_impl(context, page, times):
+    context.client.failures[page] = ['unsuccessful', times]
+
+
+@given('at most {count:d} page is listed concurrently')
+def step_impl(context, count):
+    _patch(context, 'LIST_CONCURRENCY', count)
+
+
+@when('I list the documents of index "{index_id}"')
+def step_impl(context, index_id):
+    context.documents = []
+    context.error = None
+    try:
+        for document in iter_list_file(index_id):
+            context.documents.append(document)
+    except RuntimeError as e:
+        context.error = e
+
+
+@when('I read the first {count:d} documents of index "{index_id}"')
+def step_impl(context, count, index_id):
+    documents = iter_list_file(index_id)
+    context.documents = [next(documents) for _ in range(count)]
+    documents.close()
+
+
+@then('I should get documents {first:d} to {last:d} in order')
+def step_impl(context, first, last):
+    assert [document.id for document in context.documents] == [f'doc-{i}' for i in range(first, last + 1)]
+
+
+@then('I should get no documents')
+def step_impl(context):
+    assert context.documents == [], context.documents
+
+
+@then('pages "{pages}" should each have been requested once')
+def step_impl(context, pages):
+    assert context.client.requests == Counter({int(page): 1 for page in pages.split(', ')}), context.client.requests
+
+
+@then('page {page:d} should have been requested {times:d} times')
+def step_impl(context, page, times):
+    assert context.client.requests[page] == times, context.client.requests
+
+
+@then('the listing should fail with "{error}"')
+def step_impl(context, error):
+    assert context.error is not None and str(context.error).startswith(error), context.error
@@ -0,0 +1,33 @@
+from behave import given, when, then
+from utils.metrics import StageTimer, histograms_snapshot
+
+
+@given('a stage timer for request "{trace_id}"')
+def step_impl(context, trace_id):
+    context.timer = StageTimer(trace_id)
+
+
+@when('stage "{name}" takes {seconds:g} seconds')
+def step_impl(context, name, seconds):
+    context.timer.record(name, seconds)
+
+
+@when('the "{endpoint}" request finishes')
+def step_impl(context, endpoint):
+    context.timings = context.timer.finish(endpoint)
+
+
+@then('the timings should include "{names}"')
+def step_impl(context, names):
+    assert list(context.timings) == names.split(', '), context.timings
+
+
+@then('the "{name}" histogram should have {count:d} samples')
+def step_impl(context, name, count):
+    histograms = {histogram['name']: histogram for histogram in histograms_snapshot()}
+    assert histograms[name]['count'] == count, list(histograms)
+
+
+@then("the Server-Timing header should include '{metric}'")
+def step_impl(context, metric):
+    assert metric in context.timer.server_timing().split(', '), context.timer.server_timing()
@@ -0,0 +1,148 @@
+import asyncio
+from types import SimpleNamespace
+from behave import given, when, then
+from services import query as query_module
+from services.query import QueryRequest
+from services.retrieve import RetrieveNode, RetrieveResponse
+from utils.config import config
+
+
+class FakeCompletions:
+    """只实现改写用到的chat.completions.create，按场景返回改写结果、延迟或抛错"""
+
+    def __init__(self):
+        self.calls = 0
+        self.content = None
+        self.delay = 0
+        self.error = None
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.content))])
+
+
+def _set_query_config(context, key, value):
+    query_config = config.setdefault('query', {})
+    if key in query_config:
+        context.add_cleanup(query_config.__setitem__, key, query_config[key])
+    else:
+        context.add_cleanup(query_config.pop, key, None)
+    query_config[key] = value
+
+
+def _llm(context):
+    if not hasattr(context, 'llm'):
+        context.llm = FakeCompletions()
+        client = SimpleNamespace(chat=SimpleNamespace(completions=context.llm))
+        context.add_cleanup(setattr, query_module, 'get_llm_client', query_module.get_llm_client)
+        query_module.get_llm_client = lambda: client
+        context.llm_client = client
+    return context.llm
+
+
+def _request(context):
+    return QueryRequest(ids=['idx_query'], messages=context.messages)
+
+
+@given('the rewrite cache is empty')
+def step_impl(context):
+    if query_module.rewrite_cache is not None:
+        query_module.rewrite_cache.clear()
+
+
+@given('the knowledge base answers')
+def step_impl(context):
+    answers = {row['query']: RetrieveNode(text=row['text'], score=float(row['score']), metadata={})
+               for row in context.table}
+    context.searched = []
+
+    async def retrieve(request):
+        context.searched.append(request.query)
+        chunk = answers.get(request.query)
+        return RetrieveResponse(chunks=[chunk] if chunk is not None else [], timeout_ids=[])
+
+    context.add_cleanup(setattr, query_module, 'retrieve', query_module.retrieve)
+    query_module.retrieve = retrieve
+
+
+@given('the conversation is')
+def step_impl(context):
+    context.messages = [{'role': row['role'], 'content': row['content']} for row in context.table]
+
+
+@given('a conversation with {earlier:d} earlier messages ending with "{question}"')
+def step_impl(context, earlier, question):
+    earlier_messages = [{'role': 'user', 'content': '欧洲团签证怎么办'},
+                        {'role': 'assistant', 'content': '老板，需要护照'}]
+    context.messages = earlier_messages[:earlier] + [{'role': 'user', 'content': question}]
+
+
+@given('the speculative policy is "{policy}"')
+def step_impl(context, policy):
+    _set_query_config(context, 'speculative_policy', policy)
+
+
+@given('the speculative deadline is {deadline:g} seconds')
+def step_impl(context, deadline):
+    _set_query_config(context, 'speculative_deadline', deadline)
+
+
+@given('the LLM rewrites the question to "{content}" after {delay:g} seconds')
+def step_impl(context, content, delay):
+    llm = _llm(context)
+    llm.content = content
+    llm.delay = delay
+
+
+@given('the LLM rewrites the question to "{content}"')
+def step_impl(context, content):
+    _llm(context).content = content
+
+
+@given('the LLM fails to rewrite the question')
+def step_impl(context):
+    _llm(context).error = RuntimeError('rewrite failed')
+
+
+@when('I retrieve the conversation speculatively')
+def step_impl(context):
+    request = _request(context)
+    history_messages = request.messages[-7:]
+    raw_query = query_module._last_user_content(history_messages)
+    context.retrieved = asyncio.run(query_module._speculative_retrieve(context.llm_client, request, history_messages,
+                                                                       raw_query))
+
+
+@when('I build the prompt for the conversation')
+def step_impl(context):
+    asyncio.run(query_module._query(_request(context)))
+
+
+@when('I check whether the question needs a rewrite in "{mode}" mode')
+def step_impl(context, mode):
+    request = QueryRequest(messages=context.messages, rewrite=mode)
+    context.need_rewrite = query_module._need_rewrite(request, request.messages[-7:])
+
+
+@then('the knowledge base should have been searched for "{queries}"')
+def step_impl(context, queries):
+    assert context.searched == queries.split(', '), context.searched
+
+
+@then('the chunks used for the answer should be "{texts}"')
+def step_impl(context, texts):
+    assert [chunk.text for chunk in context.retrieved.chunks] == texts.split(', '), context.retrieved
+
+
+@then('the LLM should have been called {count:d} times')
+def step_impl(context, count):
+    assert context.llm.calls == count, context.llm.calls
+
+
+@then('the rewrite decision should be "{decision}"')
+def step_impl(context, decision):
+    assert context.need_rewrite == (decision == 'needed'), context.need_rewrite
@@ -0,0 +1,54 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+from behave import given, when, then
+from utils.rate_limit import TokenBucket, RateLimiter
+
+
+@given('a token bucket with {qps:d} qps and a burst of {burst:d}')
+def step_impl(context, qps, burst):
+    context.bucket = TokenBucket('test', qps, burst)
+
+
+@when('I acquire {count:d} tokens')
+def step_impl(context, count):
+    context.waits = [context.bucket.acquire() for _ in range(count)]
+
+
+@when('{count:d} threads acquire a token at the same time')
+def step_impl(context, count):
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        context.waits = list(executor.map(lambda _: context.bucket.acquire(), range(count)))
+
+
+@then('none of the acquires should have waited')
+def step_impl(context):
+    assert context.waits == [0.0] * len(context.waits), context.waits
+
+
+@then('the last acquire should have waited about {seconds:g} seconds')
+def step_impl(context, seconds):
+    assert math.isclose(context.waits[-1], seconds, abs_tol=0.05), context.waits
+
+
+@then('the waits should be spread {interval:g} seconds apart')
+def step_impl(context, interval):
+    # 每个调用方预占一个令牌，等待时间依次多一个令牌的补充时间
+    waits = sorted(context.waits)
+    for i, wait in enumerate(waits):
+        assert math.isclose(wait, i * interval, abs_tol=0.02), waits
+
+
+@then('the bucket stats should show {calls:d} calls and {waited_calls:d} waited calls')
+def step_impl(context, calls, waited_calls):
+    stats = context.bucket.stats()
+    assert (stats['calls'], stats['waited_calls']) == (calls, waited_calls), stats
+
+
+@given('a rate limiter with a default of {default_qps:d} qps and "{api}" limited to {qps:d} qps')
+def step_impl(context, default_qps, api, qps):
+    context.limiter = RateLimiter({'default': {'qps': default_qps}, api: {'qps': qps}})
+
+
+@then('the "{api}" bucket should allow {qps:d} qps')
+def step_impl(context, api, qps):
+    assert context.limiter.bucket(api).qps == qps
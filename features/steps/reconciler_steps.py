@@ -0,0 +1,14 @@
+from behave import when, then
+from services.reconciler import Reconciler
+from utils.bailian import mark_store_deleted
+
+
+@when('index "{index_id}" is marked deleted')
+def step_impl(context, index_id):
+    mark_store_deleted(index_id)
+
+
+@then('the reconciler should poll tasks "{task_ids}"')
+def step_impl(context, task_ids):
+    polled = [task_id for task_id, _, _ in Reconciler()._in_flight()]
+    assert polled == ([] if task_ids == '-' else task_ids.split(', ')), polled
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+from behave import given, when, then
+from data.database import session_scope
+from data.index import IndexGenerationEntity
+from services import retrieve as retrieve_module
+from services.retrieve import RetrieveRequest, retrieve
+from utils import cache
+from utils.cache import retrieve_cache, invalidate_index
+
+
+@given('index "{index_id}" answers retrieve calls with a new version each time')
+def step_impl(context, index_id):
+    if not hasattr(context, 'calls'):
+        context.calls = 0
+
+        async def hedged_retrieve(request, id, timeout):
+            context.calls += 1
+            node = SimpleNamespace(score=0.9, text=f'version {context.calls}', metadata={})
+            return SimpleNamespace(body=SimpleNamespace(success=True, data=SimpleNamespace(nodes=[node])))
+
+        context.add_cleanup(setattr, retrieve_module, '_hedged_retrieve', retrieve_module._hedged_retrieve)
+        retrieve_module._hedged_retrieve = hedged_retrieve
+
+
+@given('the retrieve cache is empty')
+def step_impl(context):
+    retrieve_cache.clear()
+    cache._generations.clear()
+
+
+@when('I retrieve "{query}" from index "{index_id}"')
+def step_impl(context, query, index_id):
+    context.retrieved = asyncio.run(retrieve(RetrieveRequest(query=query, ids=[index_id])))
+
+
+@when('index "{index_id}" is invalidated in this process')
+def step_impl(context, index_id):
+    invalidate_index(index_id)
+
+
+@when('another process invalidates index "{index_id}"')
+def step_impl(context, index_id):
+    # 只改数据库里的代数，不碰本进程的缓存，和worker进程里调用invalidate_index一样
+    with session_scope() as session:
+        generation = session.query(IndexGenerationEntity).filter_by(index_id=index_id).first()
+        if generation is None:
+            session.add(IndexGenerationEntity(index_id=index_id, generation=1))
+        else:
+            generation.generation += 1
+        session.commit()
+
+
+@when('the cached index generations expire')
+def step_impl(context):
+    cache._generations.clear()
+
+
+@then('Bailian should have been called {count:d} times')
+def step_impl(context, count):
+    assert context.calls == count, context.calls
+
+
+@then('the retrieved text should be "{text}"')
+def step_impl(context, text):
+    assert [chunk.text for chunk in context.retrieved.chunks] == [text], context.retrieved
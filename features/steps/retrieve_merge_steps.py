@@ -0,0 +1,27 @@
+from behave import given, when, then
+from services.retrieve import RetrieveNode, merge_chunks
+
+
+@given('the retrieve results')
+def step_impl(context):
+    results = {}
+    for row in context.table:
+        chunks = results.setdefault(row['index'], [])
+        if row['text']:
+            chunks.append(RetrieveNode(text=row['text'], score=float(row['score']), metadata={}))
+    context.results = list(results.values())
+
+
+@when('I merge the top {top_n:d} chunks with "{normalization}" normalization')
+def step_impl(context, top_n, normalization):
+    context.merged = merge_chunks(context.results, top_n, normalization)
+
+
+@when('I merge all chunks with "{normalization}" normalization')
+def step_impl(context, normalization):
+    context.merged = merge_chunks(context.results, None, normalization)
+
+
+@then('the merged chunks should be "{texts}"')
+def step_impl(context, texts):
+    assert [chunk.text for chunk in context.merged] == texts.split(', '), [chunk.text for chunk in context.merged]
@@ -0,0 +1,64 @@
+import asyncio
+import json
+from behave import given, when, then
+from utils.sse import coalesce, HEARTBEAT
+
+
+async def _deltas(tokens, delay):
+    for token in tokens:
+        await asyncio.sleep(delay)
+        yield token
+
+
+async def _collect(frames):
+    return [frame async for frame in frames]
+
+
+def _content(frame):
+    return json.loads(frame[len('data: '):])['data']['content']
+
+
+def _coalesce(context, max_frame_chars, flush_interval, heartbeat_interval=15):
+    deltas = _deltas(context.tokens, context.delay)
+    context.frames = asyncio.run(_collect(coalesce(deltas, flush_interval, max_frame_chars, heartbeat_interval)))
+
+
+@given('the model streams the tokens "{tokens}" {delay:g} seconds apart')
+def step_impl(context, tokens, delay):
+    context.tokens = tokens.split('|')
+    context.delay = delay
+
+
+@when('I coalesce the stream into frames of {max_frame_chars:d} characters flushed every {flush_interval:g} seconds '
+      'with heartbeats every {heartbeat_interval:g} seconds')
+def step_impl(context, max_frame_chars, flush_interval, heartbeat_interval):
+    _coalesce(context, max_frame_chars, flush_interval, heartbeat_interval)
+
+
+@when('I coalesce the stream into frames of {max_frame_chars:d} characters flushed every {flush_interval:g} seconds')
+def step_impl(context, max_frame_chars, flush_interval):
+    _coalesce(context, max_frame_chars, flush_interval)
+
+
+@then('the frames should be "{contents}"')
+def step_impl(context, contents):
+    assert [_content(frame) for frame in context.frames] == contents.split('|'), context.frames
+
+
+@then('the frames should include a heartbeat')
+def step_impl(context):
+    assert HEARTBEAT in context.frames, context.frames
+
+
+@then('the frame contents should add up to "{content}"')
+def step_impl(context, content):
+    assert ''.join(_content(frame) for frame in context.frames if frame != HEARTBEAT) == content, context.frames
+
+
+@then('every content frame should be a success response with its content')
+def step_impl(context):
+    for frame in context.frames:
+        assert frame.startswith('data: ') and frame.endswith('\n\n'), frame
+        assert json.loads(frame[len('data: '):]) == {'code': 200, 'status': 'success',
+                                                      'data': {'content': _content(frame)}}, frame
+    assert ''.join(_content(frame) for frame in context.frames) == ''.join(context.tokens)
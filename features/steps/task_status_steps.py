@@ -1,31 +1,67 @@
 from behave import given, when, then
-from data.task import TaskEntry
+from data.task import StoreTaskEntity, FileTaskEntity
 
 
-@given('the following mock task entries exist')
+@given('the following store tasks exist')
 def step_impl(context):
     for row in context.table:
-        task_id = row['task_id']
-        status = row['status']
+        StoreTaskEntity.create(task_id=row['task_id'], status=row['status'], index_id=row['index_id'],
+                               job_id=row['job_id'] or None)
 
 
-@when('I request the status of task "{task_id}"')
-def step_impl(context, task_id):
-    # Send a request to the /task_status endpoint
-    response = context.client.get(f'/vector_store/task_status/{task_id}')
-    context.response = response
+@given('task "{task_id}" has a file "{file_name}" with status "{status}"')
+def step_impl(context, task_id, file_name, status):
+    FileTaskEntity.create(task_id=task_id, doc_name=file_name.split('.')[0], status=status,
+                          local_path=f'output/files/{file_name}')
+
 
 @given('I do not have valid permissions')
 def step_impl(context):
-    # Simulate lack of permissions (this can be handled in your app logic)
-    token = 'invalid_token'
+    context.auth = ('needle', 'invalid_password')
+
+
+@when('I request the status of task "{task_id}"')
+def step_impl(context, task_id):
+    context.response = context.client.get(f'/vector_store/task_status/{task_id}', auth=context.auth)
+    if context.response.status_code == 200 and 'data' in context.response.json():
+        context.version = context.response.json()['data']['version']
+
+
+@when('I request the status of task "{task_id}" since the last version')
+def step_impl(context, task_id):
+    context.last_version = context.version
+    context.response = context.client.get(f'/vector_store/task_status/{task_id}', auth=context.auth,
+                                          params={'since': context.version, 'wait': 1})
+    context.version = context.response.json()['data']['version']
+
 
 @then('the response status should be {status_code:d}')
 def step_impl(context, status_code):
-    assert context.response.status_code == status_code
+    assert context.response.status_code == status_code, context.response.text
+
 
 @then('the response should contain "{key}" as "{value}"')
 def step_impl(context, key, value):
-    #response_json = context.response.get_json()
-    #assert response_json.get(key) == value
-    assert context.response.json()['data'][key] == value
+    assert context.response.json()['data'][key] == value, context.response.text
+
+
+@then('the response should list document "{doc_name}" with status "{status}"')
+def step_impl(context, doc_name, status):
+    documents = context.response.json()['data']['documents']
+    assert [(doc['doc_name'], doc['status']) for doc in documents] == [(doc_name, status)], documents
+
+
+@then('the version should not have changed')
+def step_impl(context):
+    assert context.version == context.last_version
+
+
+@then('the response should fail with "{error}"')
+def step_impl(context, error):
+    body = context.response.json()
+    assert body['status'] == 'fail' and body['error'] == error, body
+
+
+@then('the response detail should be "{detail}"')
+def step_impl(context, detail):
+    assert context.response.json()['detail'] == detail, context.response.text
@@ -0,0 +1,50 @@
+from behave import given, when, then
+from utils.tokens import estimator, pack_texts
+
+
+def _texts(lengths, char):
+    return [char * int(length) for length in lengths.split(', ')]
+
+
+@given('the token estimator counts {cjk:g} tokens per CJK character and {other:g} per other character')
+def step_impl(context, cjk, other):
+    estimator.cjk_tokens_per_char = cjk
+    estimator.other_tokens_per_char = other
+    estimator.scale = 1.0
+
+
+@when('I pack texts of {lengths} latin characters into {budget:d} tokens keeping at least {minimum:d} tokens')
+def step_impl(context, lengths, budget, minimum):
+    context.packed = pack_texts(_texts(lengths, 'x'), budget, min_truncated_tokens=minimum)
+
+
+@when('I pack texts of {lengths} latin characters into {budget:d} tokens without truncation')
+def step_impl(context, lengths, budget):
+    context.packed = pack_texts(_texts(lengths, 'x'), budget, truncate_last=False)
+
+
+@when('I pack texts of {lengths} latin characters into {budget:d} tokens')
+def step_impl(context, lengths, budget):
+    context.packed = pack_texts(_texts(lengths, 'x'), budget)
+
+
+@when('I pack texts of {lengths} CJK characters into {budget:d} tokens')
+def step_impl(context, lengths, budget):
+    context.packed = pack_texts(_texts(lengths, '中'), budget)
+
+
+@then('{count:d} texts should be packed using {used:d} tokens')
+def step_impl(context, count, used):
+    packed, packed_used, _ = context.packed
+    assert (len(packed), packed_used) == (count, used), (len(packed), packed_used)
+
+
+@then('the last text should be truncated to {length:d} characters')
+def step_impl(context, length):
+    packed, _, truncated = context.packed
+    assert truncated and len(packed[-1]) == length, (truncated, len(packed[-1]))
+
+
+@then('the last text should not be truncated')
+def step_impl(context):
+    assert context.packed[2] is False
@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+from behave import given, when, then
+from utils import bailian
+from utils.bailian import upload_file, is_transient_error
+
+
+@given('OSS answers the upload with {status:d} "{body}"')
+def step_impl(context, status, body):
+    response = SimpleNamespace(status_code=status, ok=status < 400, text=body)
+    context.add_cleanup(setattr, bailian, 'put_file', bailian.put_file)
+    bailian.put_file = lambda *args: response
+
+
+@when('I upload a file to OSS')
+def step_impl(context):
+    context.error = None
+    try:
+        upload_file('output/files/a.pdf', 'https://oss.example.com/a.pdf', {})
+    except Exception as e:
+        context.error = e
+
+
+@then('the upload error should be transient')
+def step_impl(context):
+    assert context.error is not None and is_transient_error(context.error), context.error
+
+
+@then('the upload error should be permanent')
+def step_impl(context):
+    assert context.error is not None and not is_transient_error(context.error), context.error
+
+
+@then('the upload should succeed')
+def step_impl(context):
+    assert context.error is None, context.error
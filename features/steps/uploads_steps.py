@@ -0,0 +1,34 @@
+import asyncio
+import hashlib
+import io
+import shutil
+from behave import given, when, then
+from starlette.datastructures import UploadFile
+from server.store_router import save_uploads
+from utils.files_utils import get_index_path
+
+
+@given('the uploaded files')
+def step_impl(context):
+    context.uploads = [(row['name'], row['content'].encode()) for row in context.table]
+
+
+@when('I save the uploads')
+def step_impl(context):
+    files = [UploadFile(io.BytesIO(content), filename=name) for name, content in context.uploads]
+    upload_id, context.saved, _ = asyncio.run(save_uploads(files))
+    context.add_cleanup(shutil.rmtree, get_index_path(upload_id), True)
+
+
+@then('each saved file should hold its own content, size and MD5')
+def step_impl(context):
+    for file, (name, content) in zip(context.saved, context.uploads):
+        with open(file.path, 'rb') as f:
+            assert f.read() == content, file
+        assert (file.name, file.size, file.md5) == (name, len(content), hashlib.md5(content).hexdigest()), file
+
+
+@then('the saved files should have different paths')
+def step_impl(context):
+    paths = [file.path for file in context.saved]
+    assert len(set(paths)) == len(paths), paths
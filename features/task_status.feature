@@ -1,44 +1,52 @@
 Feature: Task Status Retrieval
 
   Background:
-    Given the following mock task entries exist:
-      | task_id                               | status    |
-      | 123e4567-e89b-12d3-a456-426614174000 | RUNNING   |
-      | 123e4567-e89b-12d3-a456-426614174001 | SUCCESS   |
-      | 123e4567-e89b-12d3-a456-426614174002 | FAIL      |
+    Given the following store tasks exist:
+      | task_id                              | status    | index_id | job_id |
+      | 123e4567-e89b-12d3-a456-426614174000 | RUNNING   | idx_run  | job_1  |
+      | 123e4567-e89b-12d3-a456-426614174001 | COMPLETED | idx_done | job_2  |
+      | 123e4567-e89b-12d3-a456-426614174002 | FAILED    | idx_fail | job_3  |
+      | 123e4567-e89b-12d3-a456-426614174003 | PENDING   | idx_new  |        |
 
   Scenario: Retrieve status of a running task
     When I request the status of task "123e4567-e89b-12d3-a456-426614174000"
     Then the response status should be 200
     And the response should contain "status" as "RUNNING"
+    And the response should contain "id" as "idx_run"
 
-  Scenario: Retrieve status of a successful task
+  Scenario: Retrieve status of a completed task
     When I request the status of task "123e4567-e89b-12d3-a456-426614174001"
     Then the response status should be 200
-    And the response should contain "status" as "SUCCESS"
+    And the response should contain "status" as "COMPLETED"
 
   Scenario: Retrieve status of a failed task
     When I request the status of task "123e4567-e89b-12d3-a456-426614174002"
     Then the response status should be 200
-    And the response should contain "status" as "FAIL"
+    And the response should contain "status" as "FAILED"
+
+  Scenario: Files are listed before the index job is submitted
+    Given task "123e4567-e89b-12d3-a456-426614174003" has a file "a.pdf" with status "PENDING"
+    When I request the status of task "123e4567-e89b-12d3-a456-426614174003"
+    Then the response should contain "status" as "PENDING"
+    And the response should list document "a" with status "PENDING"
+
+  Scenario: Same status returns the same version
+    When I request the status of task "123e4567-e89b-12d3-a456-426614174000"
+    And I request the status of task "123e4567-e89b-12d3-a456-426614174000" since the last version
+    Then the response should contain "status" as "RUNNING"
+    And the version should not have changed
 
   Scenario: Attempt to retrieve status of a non-existent task
     When I request the status of task "123e4567-e89b-12d3-a456-426614174004"
-    Then the response status should be 404
-    And the response should contain "detail" as "Task not found."
+    Then the response status should be 200
+    And the response should fail with "task not found, task_id: 123e4567-e89b-12d3-a456-426614174004"
 
   Scenario: Attempt to retrieve status without valid permissions
     Given I do not have valid permissions
     When I request the status of task "123e4567-e89b-12d3-a456-426614174000"
     Then the response status should be 401
-    And the response should contain "detail" as "Invalid permission."
+    And the response detail should be "Invalid credentials."
 
   Scenario: Attempt to retrieve status with an invalid task_id format
     When I request the status of task "invalid_task_id"
-    Then the response status should be 404
-    And the response should contain "detail" as "Task not found."
-
-  Scenario: Retrieve status of a task with an empty task_id
-    When I request the status of task ""
-    Then the response status should be 404
-    And the response should contain "detail" as "Task not found."
+    Then the response should fail with "task not found, task_id: invalid_task_id"
@@ -0,0 +1,28 @@
+Feature: Token-budgeted context packing
+
+  Background:
+    Given the token estimator counts 0.7 tokens per CJK character and 0.3 per other character
+
+  Scenario: Texts that fit the budget are packed whole
+    When I pack texts of 100, 100 latin characters into 100 tokens
+    Then 2 texts should be packed using 60 tokens
+    And the last text should not be truncated
+
+  Scenario: The first text that does not fit is truncated into the remaining budget
+    When I pack texts of 100, 100, 100, 100 latin characters into 80 tokens keeping at least 10 tokens
+    Then 3 texts should be packed using 80 tokens
+    And the last text should be truncated to 66 characters
+
+  Scenario: A remainder below the minimum is not worth truncating
+    When I pack texts of 100, 100, 100 latin characters into 65 tokens keeping at least 50 tokens
+    Then 2 texts should be packed using 60 tokens
+    And the last text should not be truncated
+
+  Scenario: Lower ranked texts are dropped even if they would fit
+    When I pack texts of 100, 300, 10 latin characters into 70 tokens without truncation
+    Then 1 texts should be packed using 30 tokens
+    And the last text should not be truncated
+
+  Scenario: CJK text costs more tokens per character
+    When I pack texts of 100 CJK characters into 100 tokens
+    Then 1 texts should be packed using 70 tokens
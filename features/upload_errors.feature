@@ -0,0 +1,19 @@
+Feature: Classify OSS upload failures for retry
+
+  Scenario Outline: Only server errors and expired leases are retried
+    Given OSS answers the upload with <status> "<body>"
+    When I upload a file to OSS
+    Then the upload error should be <kind>
+
+    Examples:
+      | status | body                                                             | kind      |
+      | 500    | InternalError                                                    | transient |
+      | 503    | ServiceUnavailable                                               | transient |
+      | 403    | <Code>AccessDenied</Code><Message>Request has expired.</Message> | transient |
+      | 403    | <Code>SignatureDoesNotMatch</Code>                               | permanent |
+      | 400    | <Code>InvalidArgument</Code>                                     | permanent |
+
+  Scenario: A successful upload raises nothing
+    Given OSS answers the upload with 200 "OK"
+    When I upload a file to OSS
+    Then the upload should succeed
@@ -0,0 +1,10 @@
+Feature: Streaming multipart uploads to the filestore
+
+  Scenario: Uploads with the same file name do not overwrite each other
+    Given the uploaded files:
+      | name      | content     |
+      | dup.txt   | first file  |
+      | dup.txt   | second file |
+    When I save the uploads
+    Then each saved file should hold its own content, size and MD5
+    And the saved files should have different paths
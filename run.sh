@@ -1 +1,2 @@
-nohup python main.py >output/run.log 2>&1 &
\ No newline at end of file
+nohup python main.py >output/run.log 2>&1 &
+nohup python worker.py >output/worker.log 2>&1 & echo $! >output/worker.pid
@@ -1,11 +1,38 @@
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from utils.config import config
+from utils.llm import get_llm_client, close_llm_client
+from services.jobs import create_worker
+from services.reconciler import Reconciler
 from fastapi import FastAPI
 from server.store_router import store_router
 from fastapi.middleware.cors import CORSMiddleware
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 启动时创建共享的大模型client，关闭时释放连接池
+    get_llm_client()
+    # 单进程部署时可以在API进程内运行入库worker，默认由独立的worker.py进程执行
+    worker = None
+    embedded_workers = config.get('job_queue', {}).get('embedded_workers', 0)
+    reconciler = None
+    if embedded_workers:
+        worker = create_worker(embedded_workers)
+        worker.start()
+        if config.get('reconciler', {}).get('enabled', True):
+            reconciler = Reconciler()
+            reconciler.start()
+    yield
+    if reconciler is not None:
+        await asyncio.to_thread(reconciler.stop)
+    if worker is not None:
+        await asyncio.to_thread(worker.stop, config.get('job_queue', {}).get('shutdown_timeout', 30))
+    await close_llm_client()
+
+
+app = FastAPI(lifespan=lifespan)
 # 包含路由
 app.include_router(store_router)
 
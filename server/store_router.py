@@ -1,19 +1,31 @@
+import os
 import uuid
-from fastapi import APIRouter, Depends, BackgroundTasks, Request, Query, File, Form, UploadFile
+from fastapi import APIRouter, Depends, Request, Response, Query, File, Form, UploadFile
 from typing import Optional, List
 from server.auth import check_permission
-from services.file_add import FileAddRequest, file_add
+from services.file_add import FileAddRequest, FileAddUploadsRequest, file_add
+from services.chunked_upload import UploadInitRequest, init_upload, get_upload, write_chunk, complete_upload, \
+    uploaded_files
 from services.query import QueryRequest, stream_query, query
 from utils.log import log
-from utils.files_utils import FileContent
+from utils.files_utils import save_stream_to_index_path, delete_directory, get_index_path
+from utils.archive import is_archive, extract_archive
+from starlette.concurrency import run_in_threadpool
 from services.create_store import create_store, CreateStoreRequest
-from services.create_store_status import task_status
-from services.retrieve import retrieve, RetrieveRequest
+from services.create_store_status import wait_task_status, stream_task_status
+from utils.sse import json_frame
+from services.retrieve import retrieve, RetrieveRequest, retrieve_cache_stats
+from services.retrieve_batch import RetrieveBatchRequest, retrieve_batch, stream_retrieve_batch, check_batch_size
 from services.file_list import file_list, file_list_abnormal, FileListBatchRequest, file_list_batch
 from services.files_delete import DeleteFilesRequest, delete_files
+from services.file_sync import SyncRequest, ManifestEntry, sync
+from pydantic import TypeAdapter
 from services.store_list import get_store_list
 from services.file_get import get_file
 from services.stores_delete import delete_store, DeleteStoreRequest
+from services.stats import get_rate_limit_stats, get_metrics
+from utils.metrics import StageTimer, current_timer
+from utils.config import config
 from server.response import SuccessResponse, FailResponse
 from fastapi.responses import StreamingResponse
 from urllib.parse import unquote
@@ -26,37 +38,86 @@ def generate_trace_id():
     return str(uuid.uuid4().hex)[:8]  # Using first 8 characters of UUID hex for simplicity
 
 
+async def save_uploads(files: List[UploadFile], decode_filename=False):
+    """
+    上传文件分块拷贝到本次上传的文件夹，边拷贝边计算MD5，返回只带路径和元数据的FileContent列表。
+    zip/tar/tar.gz逐个条目解压，不支持的类型放入跳过列表。拷贝和解压是阻塞IO，放到线程池执行。
+    每个上传文件放在按序号命名的子文件夹，同名文件互不覆盖，local_path也各不相同。
+    """
+    upload_id = str(uuid.uuid4())
+    file_list = []
+    skipped = []
+    try:
+        for i, file in enumerate(files):
+            filename = unquote(file.filename, encoding='utf-8') if decode_filename else file.filename
+            if is_archive(filename):
+                archive_files, archive_skipped = await run_in_threadpool(
+                    extract_archive, os.path.join(upload_id, f'archive{i}'), filename, file.file)
+                file_list.extend(archive_files)
+                skipped.extend(archive_skipped)
+            else:
+                file_list.append(await run_in_threadpool(
+                    save_stream_to_index_path, os.path.join(upload_id, f'file{i}'), filename, file.file))
+    except Exception:
+        delete_directory(get_index_path(upload_id))
+        raise
+    return upload_id, file_list, skipped
+
+
+def start_timer(trace_id):
+    """为当前请求创建分阶段计时器，service层通过utils.metrics记录各阶段耗时"""
+    timer = StageTimer(trace_id)
+    current_timer.set(timer)
+    return timer
+
+
+def finish_timer(timer: StageTimer, endpoint, response: Response = None):
+    timings = timer.finish(endpoint)
+    log.info(f"[TraceID:{timer.trace_id}] API /vector_store/{endpoint} stage timings: {timings}")
+    if response is not None and config.get('metrics', {}).get('timing_header', True):
+        response.headers['Server-Timing'] = timer.server_timing()
+
+
+def use_answer_cache(request: Request):
+    """请求头 X-Answer-Cache: bypass 或 Cache-Control: no-cache 时跳过回答缓存"""
+    if request.headers.get('x-answer-cache', '').lower() == 'bypass':
+        return False
+    return 'no-cache' not in request.headers.get('cache-control', '').lower()
+
+
 # 1. 创建知识库
 @store_router.post('/create')
 async def vector_store_create(name: str = Form(...),
                               chunk_size: Optional[int] = Form(None),
                               overlap_size: Optional[int] = Form(None),
                               separator: Optional[str] = Form(None),
-                              files: List[UploadFile] = File(...),
-                              background_tasks: BackgroundTasks = None):
+                              force_reupload: bool = Form(False),
+                              files: List[UploadFile] = File(...)):
     """
-        创建向量知识库：支持pdf、docx、doc、txt、md文件上传，切分。
+        创建向量知识库：支持pdf、docx、doc、txt、md文件上传，切分；也可以上传zip、tar、tar.gz压缩包。
     """
     trace_id = generate_trace_id()
     start_time = time.time()
     log.info(
         f"[TraceID:{trace_id}] API /vector_store/create started. Input params: name={name}, chunk_size={chunk_size}, "
-        f"overlap_size={overlap_size}, separator={separator}, files_count={len(files)}")
+        f"overlap_size={overlap_size}, separator={separator}, force_reupload={force_reupload}, "
+        f"files_count={len(files)}")
 
-    file_list = []
-    for file in files:
-        content = await file.read()
-        file_content = FileContent(name=file.filename, file_content=content)
-        file_list.append(file_content)
-    request = CreateStoreRequest(
-        name=name,
-        chunk_size=chunk_size,
-        overlap_size=overlap_size,
-        separator=separator,
-        files=file_list
-    )
+    upload_id = None
+    request = None
     try:
-        create_store_response = create_store(request, background_tasks)
+        upload_id, file_list, skipped = await save_uploads(files)
+        request = CreateStoreRequest(
+            name=name,
+            chunk_size=chunk_size,
+            overlap_size=overlap_size,
+            separator=separator,
+            files=file_list,
+            skipped=skipped,
+            force_reupload=force_reupload
+        )
+        # 写任务记录和排队是阻塞的数据库操作，放到线程池执行
+        create_store_response = await run_in_threadpool(create_store, request)
         log.info(
             f"[TraceID:{trace_id}] API /vector_store/create completed. Execution time: {time.time() - start_time:.2f}s. "
             f"Response: {create_store_response}")
@@ -64,21 +125,27 @@ async def vector_store_create(name: str = Form(...),
     except Exception as e:
         log.error(
             f'[TraceID:{trace_id}] Exception for /vector_store/create, request: {request}, e: {e}')
+        if upload_id is not None:
+            delete_directory(get_index_path(upload_id))
         return FailResponse(error=str(e))
 
 
 # 2. 查询任务状态
 @store_router.get('/task_status/{task_id}')
-async def vector_store_get_task_status(task_id: str):
+async def vector_store_get_task_status(task_id: str,
+                                       since: Optional[str] = Query(None),
+                                       wait: int = Query(0)):
     """
         查询任务状态：根据任务ID获取任务的当前状态。
+        传入上次返回的version作为since、wait>0时长轮询，状态变化、任务结束或等待wait秒后返回。
     """
     trace_id = generate_trace_id()
     start_time = time.time()
-    log.info(f"[TraceID:{trace_id}] API /vector_store/task_status started. Input params: task_id={task_id}")
+    log.info(f"[TraceID:{trace_id}] API /vector_store/task_status started. Input params: task_id={task_id}, "
+             f"since={since}, wait={wait}")
 
     try:
-        create_store_status_response = task_status(task_id)
+        create_store_status_response = await wait_task_status(task_id, since, wait)
         log.info(
             f"[TraceID:{trace_id}] API /vector_store/task_status completed. Execution time: {time.time() - start_time:.2f}s. "
             f"Response: {create_store_status_response}")
@@ -89,6 +156,30 @@ async def vector_store_get_task_status(task_id: str):
         return FailResponse(error=str(e))
 
 
+# 2.1 订阅任务状态（SSE）
+@store_router.get('/task_status/{task_id}/stream')
+async def vector_store_stream_task_status(task_id: str):
+    """
+        订阅任务状态：状态每次变化推送一次，任务结束后关闭连接。
+    """
+    trace_id = generate_trace_id()
+    start_time = time.time()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/task_status/stream started. Input params: task_id={task_id}")
+
+    async def event_stream():
+        try:
+            async for response in stream_task_status(task_id):
+                yield json_frame(SuccessResponse(data=response).model_dump_json(exclude_none=True))
+        except Exception as e:
+            log.error(f'[TraceID:{trace_id}] Exception for /vector_store/task_status/stream, task_id:{task_id} , e: {e}')
+            yield json_frame(FailResponse(error=str(e)).model_dump_json(exclude_none=True))
+        finally:
+            log.info(f"[TraceID:{trace_id}] API /vector_store/task_status/stream completed. "
+                     f"Execution time: {time.time() - start_time:.2f}s.")
+
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+
 # 3. 查询知识库列表
 @store_router.get('/list')
 async def vector_store_get_store_list(name: Optional[str] = Query(None)):
@@ -135,10 +226,10 @@ async def vector_store_delete_store(request: DeleteStoreRequest):
 @store_router.post('/file/add')
 async def vector_store_file_add(request: Request,
                                 id: str = Form(...),
-                                files: List[UploadFile] = File(...),
-                                background_tasks: BackgroundTasks = None):
+                                force_reupload: bool = Form(False),
+                                files: List[UploadFile] = File(...)):
     """
-        向知识库里添加文件：支持pdf、docx、doc、txt、md文件上传，切分。
+        向知识库里添加文件：支持pdf、docx、doc、txt、md文件上传，切分；也可以上传zip、tar、tar.gz压缩包。
     """
     trace_id = generate_trace_id()
     start_time = time.time()
@@ -147,27 +238,135 @@ async def vector_store_file_add(request: Request,
         client_ip = request.client.host if request.client else "unknown"
 
     log.info(
-        f"[TraceID:{trace_id}] API /vector_store/file/add started. Input params: id={id}, files_count={len(files)}, "
+        f"[TraceID:{trace_id}] API /vector_store/file/add started. Input params: id={id}, force_reupload={force_reupload}, files_count={len(files)}, "
         f"client_ip={client_ip}")
 
-    file_list = []
-    for file in files:
-        content = await file.read()
-        decoded_filename = unquote(file.filename, encoding='utf-8')
-        file_content = FileContent(name=decoded_filename, file_content=content)
-        file_list.append(file_content)
-    request = FileAddRequest(
-        id=id,
-        files=file_list
-    )
+    upload_id = None
     try:
-        file_add_response = file_add(request, background_tasks)
+        upload_id, file_list, skipped = await save_uploads(files, decode_filename=True)
+        request = FileAddRequest(
+            id=id,
+            files=file_list,
+            skipped=skipped,
+            force_reupload=force_reupload
+        )
+        file_add_response = await run_in_threadpool(file_add, request)
         log.info(
             f"[TraceID:{trace_id}] API /vector_store/file/add completed. Execution time: {time.time() - start_time:.2f}s. "
             f"Response: {file_add_response}")
         return SuccessResponse(data=file_add_response)
     except Exception as e:
         log.error(f'[TraceID:{trace_id}] Exception for /vector_store/file_add, e: {e}')
+        if upload_id is not None:
+            delete_directory(get_index_path(upload_id))
+        return FailResponse(error=str(e))
+
+
+# 5.1 分块续传：初始化上传
+@store_router.post('/upload/init')
+async def vector_store_upload_init(request: UploadInitRequest):
+    """
+        初始化分块上传，返回upload_id，之后按offset分块PUT到/upload/{upload_id}。
+    """
+    trace_id = generate_trace_id()
+    start_time = time.time()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/upload/init started. Input params: {request}")
+
+    try:
+        upload_response = await run_in_threadpool(init_upload, request)
+        log.info(
+            f"[TraceID:{trace_id}] API /vector_store/upload/init completed. Execution time: {time.time() - start_time:.2f}s. "
+            f"Response: {upload_response}")
+        return SuccessResponse(data=upload_response)
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/upload/init, request: {request}, e: {e}')
+        return FailResponse(error=str(e))
+
+
+# 5.2 分块续传：查询已接收的字节数
+@store_router.get('/upload/{upload_id}')
+async def vector_store_upload_status(upload_id: str):
+    """
+        查询上传进度，连接中断或服务重启后从返回的offset继续上传。
+    """
+    trace_id = generate_trace_id()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/upload started. Input params: upload_id={upload_id}")
+
+    try:
+        return SuccessResponse(data=await run_in_threadpool(get_upload, upload_id))
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/upload, upload_id: {upload_id}, e: {e}')
+        return FailResponse(error=str(e))
+
+
+# 5.3 分块续传：上传分块
+@store_router.put('/upload/{upload_id}')
+async def vector_store_upload_chunk(request: Request, upload_id: str, offset: int = Query(...)):
+    """
+        请求体为文件从offset开始的原始字节，offset不能大于已接收的字节数。
+    """
+    trace_id = generate_trace_id()
+    start_time = time.time()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/upload chunk started. Input params: upload_id={upload_id}, "
+             f"offset={offset}")
+
+    try:
+        upload_response = await write_chunk(upload_id, offset, request.stream())
+        log.info(
+            f"[TraceID:{trace_id}] API /vector_store/upload chunk completed. Execution time: {time.time() - start_time:.2f}s. "
+            f"Response: {upload_response}")
+        return SuccessResponse(data=upload_response)
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/upload chunk, upload_id: {upload_id}, '
+                  f'offset: {offset}, e: {e}')
+        return FailResponse(error=str(e))
+
+
+# 5.4 分块续传：完成上传
+@store_router.post('/upload/{upload_id}/complete')
+async def vector_store_upload_complete(upload_id: str):
+    """
+        校验大小和MD5，完成后可以通过/file/add_uploads按upload_id添加到知识库。
+    """
+    trace_id = generate_trace_id()
+    start_time = time.time()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/upload/complete started. Input params: upload_id={upload_id}")
+
+    try:
+        upload_response = await complete_upload(upload_id)
+        log.info(
+            f"[TraceID:{trace_id}] API /vector_store/upload/complete completed. Execution time: {time.time() - start_time:.2f}s. "
+            f"Response: {upload_response}")
+        return SuccessResponse(data=upload_response)
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/upload/complete, upload_id: {upload_id}, e: {e}')
+        return FailResponse(error=str(e))
+
+
+# 5.5 按upload_id向知识库增加文件
+@store_router.post('/file/add_uploads')
+async def vector_store_file_add_uploads(request: FileAddUploadsRequest):
+    """
+        把已完成分块上传的文件添加到知识库，与/file/add走同一个入库流程。
+    """
+    trace_id = generate_trace_id()
+    start_time = time.time()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/file/add_uploads started. Input params: {request}")
+
+    try:
+        file_list = await run_in_threadpool(uploaded_files, request.upload_ids)
+        file_add_request = FileAddRequest(
+            id=request.id,
+            files=file_list,
+            force_reupload=request.force_reupload
+        )
+        file_add_response = await run_in_threadpool(file_add, file_add_request)
+        log.info(
+            f"[TraceID:{trace_id}] API /vector_store/file/add_uploads completed. Execution time: {time.time() - start_time:.2f}s. "
+            f"Response: {file_add_response}")
+        return SuccessResponse(data=file_add_response)
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/file/add_uploads, request: {request}, e: {e}')
         return FailResponse(error=str(e))
 
 
@@ -220,6 +419,42 @@ async def vector_store_delete_files(fastapi_request: Request,
         return FailResponse(error=str(e))
 
 
+# 7.1 知识库增量同步
+@store_router.post('/file/sync')
+async def vector_store_file_sync(id: str = Form(...),
+                                 manifest: str = Form(...),
+                                 dry_run: bool = Form(True),
+                                 delete_missing: bool = Form(True),
+                                 force_reupload: bool = Form(False),
+                                 files: Optional[List[UploadFile]] = File(None)):
+    """
+        按清单增量同步知识库：manifest为 [{"name", "md5", "size"}] 的JSON。
+        dry_run时只返回差异；否则files需包含差异里added和changed的文件，上传后入库，并删除清单里已没有的文档。
+    """
+    trace_id = generate_trace_id()
+    start_time = time.time()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/file/sync started. Input params: id={id}, dry_run={dry_run}, "
+             f"delete_missing={delete_missing}, force_reupload={force_reupload}, files_count={len(files or [])}")
+
+    upload_id = None
+    try:
+        request = SyncRequest(id=id, files=TypeAdapter(List[ManifestEntry]).validate_json(manifest), dry_run=dry_run,
+                              delete_missing=delete_missing, force_reupload=force_reupload)
+        file_list = []
+        if files and not dry_run:
+            upload_id, file_list, _ = await save_uploads(files, decode_filename=True)
+        sync_response = await run_in_threadpool(sync, request, file_list)
+        log.info(
+            f"[TraceID:{trace_id}] API /vector_store/file/sync completed. Execution time: {time.time() - start_time:.2f}s. "
+            f"Response: {sync_response}")
+        return SuccessResponse(data=sync_response)
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/file/sync, id: {id}, e: {e}')
+        if upload_id is not None:
+            delete_directory(get_index_path(upload_id))
+        return FailResponse(error=str(e))
+
+
 # 8 根据file id查询文件内容
 @store_router.get('/file/get/{file_id}')
 async def vector_store_file_get(file_id):
@@ -243,16 +478,18 @@ async def vector_store_file_get(file_id):
 
 # 9. 知识召回
 @store_router.post('/retrieve')
-async def vector_store_retrieve(request: RetrieveRequest):
+async def vector_store_retrieve(request: RetrieveRequest, response: Response):
     """
         召回知识库片段：根据检索内容召回知识库相关片段。
     """
     trace_id = generate_trace_id()
     start_time = time.time()
+    timer = start_timer(trace_id)
     log.info(f"[TraceID:{trace_id}] API /vector_store/retrieve started. Input params: {request}")
 
     try:
         retrieve_response = await retrieve(request)
+        finish_timer(timer, 'retrieve', response)
         log.info(
             f"[TraceID:{trace_id}] API /vector_store/retrieve completed. Execution time: {time.time() - start_time:.2f}s. "
             f"Response count: {retrieve_response}")
@@ -263,6 +500,79 @@ async def vector_store_retrieve(request: RetrieveRequest):
         return FailResponse(error=str(e))
 
 
+# 9.1 批量知识召回
+@store_router.post('/retrieve_batch')
+async def vector_store_retrieve_batch(request: RetrieveBatchRequest):
+    """
+        批量召回知识库片段：一次请求提交多个检索，按输入顺序返回；stream=true时按完成顺序输出NDJSON。
+    """
+    trace_id = generate_trace_id()
+    start_time = time.time()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/retrieve_batch started. Input params: "
+             f"requests_count={len(request.requests)}, concurrency={request.concurrency}, stream={request.stream}")
+
+    try:
+        if request.stream:
+            check_batch_size(request)
+            return StreamingResponse(stream_retrieve_batch(request), media_type='application/x-ndjson')
+        retrieve_batch_response = await retrieve_batch(request)
+        log.info(
+            f"[TraceID:{trace_id}] API /vector_store/retrieve_batch completed. Execution time: {time.time() - start_time:.2f}s.")
+        return SuccessResponse(data=retrieve_batch_response)
+    except Exception as e:
+        log.error(
+            f'[TraceID:{trace_id}] Exception for /vector_store/retrieve_batch, requests_count: {len(request.requests)}, e: {e}')
+        return FailResponse(error=str(e))
+
+
+# 9.2 检索缓存命中统计
+@store_router.get('/retrieve/cache_stats')
+async def vector_store_retrieve_cache_stats():
+    """
+        查询检索缓存的命中/未命中次数。
+    """
+    trace_id = generate_trace_id()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/retrieve/cache_stats started.")
+
+    try:
+        return SuccessResponse(data=retrieve_cache_stats())
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/retrieve/cache_stats, e: {e}')
+        return FailResponse(error=str(e))
+
+
+# 9.3 百炼接口限流等待统计
+@store_router.get('/rate_limit_stats')
+async def vector_store_rate_limit_stats():
+    """
+        查询各百炼接口的调用次数和限流等待时间。
+    """
+    trace_id = generate_trace_id()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/rate_limit_stats started.")
+
+    try:
+        return SuccessResponse(data=get_rate_limit_stats())
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/rate_limit_stats, e: {e}')
+        return FailResponse(error=str(e))
+
+
+# 9.4 RAG各阶段耗时直方图
+@store_router.get('/metrics')
+async def vector_store_metrics():
+    """
+        查询检索、改写、首token等各阶段耗时直方图。
+    """
+    trace_id = generate_trace_id()
+    log.info(f"[TraceID:{trace_id}] API /vector_store/metrics started.")
+
+    try:
+        return SuccessResponse(data=get_metrics())
+    except Exception as e:
+        log.error(f'[TraceID:{trace_id}] Exception for /vector_store/metrics, e: {e}')
+        return FailResponse(error=str(e))
+
+
 # 10.1 流式RAG
 @store_router.post('/stream_query')
 async def vector_store_stream_query(request: Request, query_request: QueryRequest):
@@ -275,10 +585,17 @@ async def vector_store_stream_query(request: Request, query_request: QueryReques
 
     try:
         async def event_stream():
-            async for event in stream_query(query_request):
-                if await request.is_disconnected():
-                    break
-                yield event
+            timer = start_timer(trace_id)
+            try:
+                async for event in stream_query(query_request, use_answer_cache(request)):
+                    if await request.is_disconnected():
+                        break
+                    yield event
+            finally:
+                finish_timer(timer, 'stream_query')
+                log.info(
+                    f"[TraceID:{trace_id}] API /vector_store/stream_query streaming completed. "
+                    f"Execution time: {time.time() - start_time:.2f}s")
 
         log.info(
             f"[TraceID:{trace_id}] API /vector_store/stream_query streaming started. Execution time: {time.time() - start_time:.2f}s")
@@ -291,16 +608,18 @@ async def vector_store_stream_query(request: Request, query_request: QueryReques
 
 # 10.2 常规RAG
 @store_router.post('/query')
-async def vector_store_query(request: QueryRequest):
+async def vector_store_query(fastapi_request: Request, request: QueryRequest, response: Response):
     """
         知识库查询：查询知识库并调用大模型总结回答。
     """
     trace_id = generate_trace_id()
     start_time = time.time()
+    timer = start_timer(trace_id)
     log.info(f"[TraceID:{trace_id}] API /vector_store/query started. Input params: {request}")
 
     try:
-        query_response = await query(request)
+        query_response = await query(request, use_answer_cache(fastapi_request))
+        finish_timer(timer, 'query', response)
         log.info(
             f"[TraceID:{trace_id}] API /vector_store/query completed. Execution time: {time.time() - start_time:.2f}s. "
             f"Response: {query_response}")
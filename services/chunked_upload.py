@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import os
+import uuid
+import weakref
+from pydantic import BaseModel
+from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from data.upload import UploadEntity, UploadStatus
+from utils.config import config
+from utils.files_utils import FileContent, get_index_path, IO_BUFFER_SIZE
+
+chunked_upload_config = config.get('chunked_upload', {})
+MAX_CHUNK_SIZE = chunked_upload_config.get('max_chunk_size', 16 * 1024 * 1024)
+MAX_FILE_SIZE = chunked_upload_config.get('max_file_size', 1024 * 1024 * 1024)
+
+# 同一个上传会话的分块串行写入；没有请求在用时锁被回收，放弃的上传不会一直占着
+_locks = weakref.WeakValueDictionary()
+
+
+class UploadInitRequest(BaseModel):
+    file_name: str
+    size: int
+    md5: Optional[str] = None
+
+
+class UploadStatusResponse(BaseModel):
+    upload_id: str
+    file_name: str
+    size: int
+    # 已连续接收的字节数，客户端从这里继续上传
+    offset: int
+    status: str
+    md5: Optional[str] = None
+    max_chunk_size: int = MAX_CHUNK_SIZE
+
+
+def _part_path(path):
+    return path + '.part'
+
+
+def _get(upload_id):
+    upload = UploadEntity.query_first(upload_id=upload_id)
+    if upload is None:
+        raise ValueError(f'upload not found, upload_id: {upload_id}')
+    return upload
+
+
+def _offset(upload):
+    if upload.status == UploadStatus.COMPLETED:
+        return upload.size
+    part_path = _part_path(upload.path)
+    return os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+
+def _response(upload):
+    return UploadStatusResponse(upload_id=upload.upload_id, file_name=upload.file_name, size=upload.size,
+                                offset=_offset(upload), status=upload.status, md5=upload.md5)
+
+
+def init_upload(request: UploadInitRequest):
+    if request.size <= 0 or request.size > MAX_FILE_SIZE:
+        raise ValueError(f'invalid file size: {request.size}, max: {MAX_FILE_SIZE}')
+    upload_id = str(uuid.uuid4())
+    path = os.path.join(get_index_path(upload_id), os.path.basename(request.file_name))
+    open(_part_path(path), 'wb').close()
+    upload = UploadEntity.create(upload_id=upload_id, file_name=request.file_name, size=request.size,
+                                 md5=request.md5.lower() if request.md5 else None, path=path,
+                                 status=UploadStatus.UPLOADING)
+    return _response(upload)
+
+
+def get_upload(upload_id):
+    return _response(_get(upload_id))
+
+
+def _lock(upload_id):
+    lock = _locks.get(upload_id)
+    if lock is None:
+        lock = _locks[upload_id] = asyncio.Lock()
+    return lock
+
+
+def _open_part(part_path, offset, truncate):
+    file = open(part_path, 'r+b')
+    file.seek(offset)
+    if truncate:
+        file.truncate()
+    return file
+
+
+async def write_chunk(upload_id, offset, stream):
+    """
+    把请求体写到暂存文件的offset处。offset必须不大于已接收的字节数：
+    等于时追加，小于时（上次分块只写了一部分）从offset截断后重写，不允许留下空洞。
+    整个请求只打开一次文件，请求体攒够IO_BUFFER_SIZE再到线程池写一次。
+    """
+    async with _lock(upload_id):
+        upload = await run_in_threadpool(_get, upload_id)
+        if upload.status != UploadStatus.UPLOADING:
+            raise ValueError(f'upload already {upload.status}, upload_id: {upload_id}')
+        part_path = _part_path(upload.path)
+        received = await run_in_threadpool(_offset, upload)
+        if offset < 0 or offset > received:
+            raise ValueError(f'invalid offset: {offset}, received: {received}, upload_id: {upload_id}')
+        position = offset
+        file = await run_in_threadpool(_open_part, part_path, offset, offset < received)
+        try:
+            buffer = bytearray()
+            async for chunk in stream:
+                if not chunk:
+                    continue
+                if position - offset + len(chunk) > MAX_CHUNK_SIZE or position + len(chunk) > upload.size:
+                    raise ValueError(f'chunk too large, offset: {offset}, max_chunk_size: {MAX_CHUNK_SIZE}, '
+                                     f'size: {upload.size}, upload_id: {upload_id}')
+                buffer += chunk
+                position += len(chunk)
+                if len(buffer) >= IO_BUFFER_SIZE:
+                    await run_in_threadpool(file.write, buffer)
+                    buffer = bytearray()
+            if buffer:
+                await run_in_threadpool(file.write, buffer)
+        finally:
+            await run_in_threadpool(file.close)
+        return _response(upload)
+
+
+def _verify(upload):
+    md5_hash = hashlib.md5()
+    part_path = _part_path(upload.path)
+    with open(part_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(IO_BUFFER_SIZE), b''):
+            md5_hash.update(chunk)
+    md5 = md5_hash.hexdigest()
+    if upload.md5 and upload.md5 != md5:
+        raise ValueError(f'md5 mismatch, expected: {upload.md5}, actual: {md5}, upload_id: {upload.upload_id}')
+    os.replace(part_path, upload.path)
+    return md5
+
+
+async def complete_upload(upload_id):
+    """所有字节接收完后校验MD5，暂存文件转为正式文件，之后可以按upload_id添加到知识库"""
+    async with _lock(upload_id):
+        upload = await run_in_threadpool(_get, upload_id)
+        if upload.status == UploadStatus.COMPLETED:
+            return _response(upload)
+        received = await run_in_threadpool(_offset, upload)
+        if received != upload.size:
+            raise ValueError(f'upload incomplete, received: {received}, size: {upload.size}, upload_id: {upload_id}')
+        md5 = await run_in_threadpool(_verify, upload)
+        await run_in_threadpool(upload.set, md5=md5, status=UploadStatus.COMPLETED)
+    return _response(upload)
+
+
+def uploaded_files(upload_ids: List[str]):
+    """已完成的上传转成FileContent，按路径交给add_files"""
+    files = []
+    for upload_id in upload_ids:
+        upload = _get(upload_id)
+        if upload.status != UploadStatus.COMPLETED:
+            raise ValueError(f'upload not completed, upload_id: {upload_id}')
+        files.append(FileContent(name=upload.file_name, path=upload.path, size=upload.size, md5=upload.md5))
+    return files
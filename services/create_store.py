@@ -1,13 +1,13 @@
 import uuid
 
 from pydantic import BaseModel
-from fastapi import BackgroundTasks
 
 from data.database import connect_db
 from utils.bailian import *
 from data.task import StoreTaskEntity
+from utils.job_queue import enqueue
 from typing import List, Optional
-from utils.files_utils import FileContent
+from utils.files_utils import FileContent, SkippedFile, save_file_to_index_path
 
 
 class CreateStoreRequest(BaseModel):
@@ -16,21 +16,40 @@ class CreateStoreRequest(BaseModel):
     overlap_size: Optional[int] = None
     separator: Optional[str] = None
     files: Optional[List[FileContent]] = None
+    # 压缩包里没有入库的条目
+    skipped: Optional[List[SkippedFile]] = None
+    # 为True时即使相同内容已上传过也重新上传解析
+    force_reupload: bool = False
 
 
 class CreateStoreResponse(BaseModel):
     task_id: str
 
 
-def _create_store(request: CreateStoreRequest, task_id: str):
+JOB_TYPE = 'create_store'
+
+
+def _create_store(request: CreateStoreRequest, task_id: str, retry_failed=False, lease=None):
+    if lease is not None:
+        # 租约已丢失时不再创建知识库，避免与接手的worker各建一个
+        lease.check()
     store = add_store(task_id, request.name, request.chunk_size, request.overlap_size, request.separator)
     if store:
-        add_files(task_id, store.index_id, request.files)
+        add_files(task_id, store.index_id, request.files, request.force_reupload, retry_failed, lease)
+    elif retry_failed:
+        raise RuntimeError(f'add_store failed, task_id: {task_id}')
+
+
+def run_job(job, lease):
+    """worker进程执行入库队列里的创建知识库任务"""
+    _create_store(CreateStoreRequest.model_validate_json(job.payload), job.task_id, not job.last_attempt, lease)
 
 
-def create_store(request: CreateStoreRequest, background_tasks: BackgroundTasks):
+def create_store(request: CreateStoreRequest):
     task_id = str(uuid.uuid4())
-    background_tasks.add_task(_create_store, request, task_id=task_id)
+    StoreTaskEntity.create(task_id=task_id, status=TaskStatus.PENDING)
+    record_skipped_files(task_id, request.skipped)
+    enqueue(JOB_TYPE, task_id, request.model_dump_json())
     return CreateStoreResponse(task_id=task_id)
 
 
@@ -40,9 +59,11 @@ if __name__ == '__main__':
     for _task in StoreTaskEntity.query_all():
         _task.delete()
 
+    _file_path = save_file_to_index_path('aaa', 'server.txt', b'Test Doc')
     _create_store(CreateStoreRequest(name='test', files=[FileContent(
         name='server.txt',
-        file_content=b'Test Doc')]),
+        path=_file_path,
+        size=os.path.getsize(_file_path))]),
                   'aaa')
     for _task in StoreTaskEntity.query_all():
         print(f'task_id: {_task.task_id}, status: {_task.status}, '
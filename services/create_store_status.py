@@ -1,9 +1,16 @@
+import asyncio
+import hashlib
 from pydantic import BaseModel
 from typing import List, Optional
-from utils.bailian import *
-import traceback
+from starlette.concurrency import run_in_threadpool
 from utils.files_utils import Document
-from data.task import StoreTaskEntity, FileTaskEntity
+from utils.config import config
+from data.task import StoreTaskEntity, FileTaskEntity, TaskStatus
+
+task_status_config = config.get('task_status', {})
+# 长轮询时读数据库的间隔（秒），任务和文件状态由后台Reconciler写入
+POLL_INTERVAL = task_status_config.get('poll_interval', 1)
+MAX_WAIT = task_status_config.get('max_wait', 30)
 
 
 class StoreStatusResponse(BaseModel):
@@ -12,29 +19,60 @@ class StoreStatusResponse(BaseModel):
     message: Optional[str] = None
     id: Optional[str] = None
     documents: Optional[List[Document]] = None
+    # 任务和文件状态的指纹，长轮询时作为since传回，状态变化后才返回
+    version: Optional[str] = None
+
+
+def _version(status, message, documents):
+    fingerprint = '|'.join([str(status), str(message)] +
+                           [f'{doc.doc_id}:{doc.status}:{doc.message}' for doc in documents])
+    return hashlib.md5(fingerprint.encode()).hexdigest()[:16]
 
 
 def task_status(task_id):
+    """只读数据库，百炼入库任务的状态由services.reconciler后台同步"""
     task = StoreTaskEntity.query_first(task_id=task_id)
+    if task is None:
+        raise ValueError(f'task not found, task_id: {task_id}')
+    # 提交update_index之前也返回文件记录：上传中、等待重试、压缩包里跳过的条目都能看到
     documents = []
+    for file_task in FileTaskEntity.query_all(task_id=task_id):
+        documents.append(Document(doc_name=file_task.doc_name, doc_id=file_task.doc_id, status=file_task.status,
+                                  message=file_task.message))
+    return StoreStatusResponse(task_id=task_id, status=task.status, message=task.message, id=task.index_id,
+                               documents=documents, version=_version(task.status, task.message, documents))
 
-    if task.job_id:
-        try:
-            result = get_index_result(task.index_id, task.job_id)
-            for doc in result.body.data.documents:
-                file_task = FileTaskEntity.query_first(task_id=task_id, doc_id=doc.doc_id)
-                file_task.set(status=doc.status, message=doc.message)
-            for file_task in FileTaskEntity.query_all(task_id=task_id):
-                documents.append(Document(doc_name=file_task.doc_name, doc_id=file_task.doc_id, status=file_task.status,
-                                          message=file_task.message))
-            task.set(status=result.body.data.status, message=result.body.message)
-        except Exception as e:
-            trace_info = traceback.format_exc()
-            task.set(status=TaskStatus.FAILED,
-                     message=f'Exception for task_status, task_id: {task_id}, e: {e}, trace: {trace_info}')
 
-    return StoreStatusResponse(task_id=task_id, status=task.status, message=task.message, id=task.index_id,
-                               documents=documents)
+def is_final(response: StoreStatusResponse):
+    return response.status in (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.DELETED)
+
+
+async def wait_task_status(task_id, since=None, wait=0):
+    """
+    长轮询：状态指纹与since不同、任务已结束或等待超过wait秒时返回。
+    since为空时返回当前状态。
+    """
+    response = await run_in_threadpool(task_status, task_id)
+    deadline = asyncio.get_running_loop().time() + min(wait, MAX_WAIT)
+    while since is not None and response.version == since and not is_final(response):
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(POLL_INTERVAL, remaining))
+        response = await run_in_threadpool(task_status, task_id)
+    return response
+
+
+async def stream_task_status(task_id):
+    """SSE：每次状态变化推送一次，任务结束后关闭"""
+    version = None
+    while True:
+        response = await wait_task_status(task_id, version, MAX_WAIT)
+        if response.version != version:
+            version = response.version
+            yield response
+        if is_final(response):
+            return
 
 
 if __name__ == '__main__':
@@ -1,25 +1,65 @@
 import uuid
 from pydantic import BaseModel
-from fastapi import BackgroundTasks
 from utils.bailian import *
+from utils.job_queue import enqueue, LeaseLost, COALESCE
 from typing import List, Optional
-from utils.files_utils import FileContent
+from utils.files_utils import FileContent, SkippedFile
 
 
 class FileAddRequest(BaseModel):
     id: str
     files: Optional[List[FileContent]] = None
+    # 压缩包里没有入库的条目
+    skipped: Optional[List[SkippedFile]] = None
+    # 为True时即使相同内容已上传过也重新上传解析
+    force_reupload: bool = False
+
+
+class FileAddUploadsRequest(BaseModel):
+    """按分块上传的upload_id添加文件，文件已在filestore，不再经过multipart上传"""
+    id: str
+    upload_ids: List[str]
+    force_reupload: bool = False
 
 
 class FileAddResponse(BaseModel):
     task_id: str
 
     
-def file_add(request: FileAddRequest, background_tasks: BackgroundTasks):
+JOB_TYPE = 'file_add'
+
+
+def file_add(request: FileAddRequest):
     task_id = str(uuid.uuid4())
-    background_tasks.add_task(_file_add, request, task_id=task_id)
+    StoreTaskEntity.create(task_id=task_id, index_id=request.id, status=TaskStatus.PENDING)
+    record_skipped_files(task_id, request.skipped)
+    # 开启job_queue.coalesce时，同一知识库排队中的添加文件任务由worker领取时合并提交
+    enqueue(JOB_TYPE, task_id, request.model_dump_json(), batch_key=request.id if COALESCE else None)
     return FileAddResponse(task_id=task_id)
 
 
-def _file_add(request: FileAddRequest, task_id: str):
-    add_files(task_id, request.id, request.files)
+def run_jobs(jobs, lease):
+    """
+    worker进程执行入库队列里的添加文件任务。开启合并时同一知识库排队中的任务领取时合并成一批：
+    各任务分别上传文件，成功的文件合并提交一个update_index；有文件等待重试的任务单独失败重试，不影响同批其他任务。
+    返回 {job.id: 异常}。
+    """
+    errors = {}
+    task_file_ids = []
+    index_id = None
+    for job in jobs:
+        request = FileAddRequest.model_validate_json(job.payload)
+        index_id = request.id
+        try:
+            file_ids = ingest_files(job.task_id, request.id, request.files, request.force_reupload,
+                                    not job.last_attempt, lease)
+        except LeaseLost:
+            raise
+        except Exception as e:
+            errors[job.id] = e
+            continue
+        if file_ids:
+            task_file_ids.append((job.task_id, file_ids))
+    if task_file_ids:
+        submit_files(index_id, task_file_ids, lease)
+    return errors
@@ -1,7 +1,7 @@
 from pydantic import BaseModel
 from typing import List, Optional
 from utils.files_utils import Document
-from utils.bailian import list_file, list_file_batch
+from utils.bailian import iter_list_file, list_file_batch
 from utils.log import log
 
 
@@ -13,15 +13,14 @@ class FileListBatchRequest(BaseModel):
     file_names: list[str]
 
 def file_list(index_id: str, file_name: str):
-    all_files = list_file(index_id, file_name)
     documents = []
-    for file in all_files:
+    for file in iter_list_file(index_id, file_name):
         documents.append(Document(doc_id=file.id, doc_name=file.name, status=file.status, message=file.message))
     return FileListResponse(documents=documents)
 
 def file_list_abnormal(index_id: str, file_name: str):
-    all_files = list_file(index_id, file_name)
-    documents = [Document(doc_id=f.id, doc_name=f.name, status=f.status, message=f.message) for f in all_files if f.status != 'FINISH']
+    documents = [Document(doc_id=f.id, doc_name=f.name, status=f.status, message=f.message)
+                 for f in iter_list_file(index_id, file_name) if f.status != 'FINISH']
     return FileListResponse(documents=documents)
 
 def file_list_batch(index_id: str, file_names: list[str]):
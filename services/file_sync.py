@@ -0,0 +1,144 @@
+import os
+from pydantic import BaseModel
+from typing import List, Optional, Dict
+from utils.bailian import iter_list_file, registered_files, find_registered_file
+from utils.files_utils import FileContent
+from services.file_add import FileAddRequest, file_add
+from services.files_delete import DeleteFilesRequest, delete_files
+from utils.log import log
+
+
+class ManifestEntry(BaseModel):
+    name: str
+    md5: str
+    size: int
+
+
+class SyncRequest(BaseModel):
+    id: str
+    files: List[ManifestEntry]
+    # 只返回差异，不上传也不删除
+    dry_run: bool = True
+    # 删除清单里没有的文档
+    delete_missing: bool = True
+    force_reupload: bool = False
+
+
+class SyncDocument(BaseModel):
+    name: str
+    doc_id: Optional[str] = None
+    reason: Optional[str] = None
+
+
+class SyncResponse(BaseModel):
+    # 需要上传的文件名：知识库里没有的、内容有变化的、本地没有MD5记录无法判断的
+    added: List[str] = []
+    changed: List[str] = []
+    # 将被删除的文档：清单里已没有的、被新版本替换的、重名多余的
+    deleted: List[SyncDocument] = []
+    unchanged: int = 0
+    # 清单里去掉扩展名后重名的文件，无法和知识库文档一一对应
+    conflicts: List[str] = []
+    dry_run: bool = True
+    task_id: Optional[str] = None
+    deleted_ids: Optional[List[str]] = None
+
+
+def doc_key(name):
+    """知识库文档名不带扩展名，与FileTaskEntity.doc_name一致"""
+    return os.path.basename(name).split('.')[0]
+
+
+def diff(request: SyncRequest):
+    """
+    比较清单和知识库，文档的MD5和大小取自本地文件登记表。
+    先按内容 (md5, size) 匹配：去重后的file_id沿用第一次上传时的文件名，改名或内容相同的文件按名字对不上。
+    内容匹配不到时再按文档名匹配，同名文档视为旧版本。
+    """
+    response = SyncResponse(dry_run=request.dry_run)
+    manifest: Dict[str, ManifestEntry] = {}
+    for entry in request.files:
+        key = doc_key(entry.name)
+        if key in manifest:
+            response.conflicts.append(entry.name)
+            continue
+        manifest[key] = entry
+
+    documents = list(iter_list_file(request.id))
+    records = registered_files([document.id for document in documents])
+    by_name = {}
+    by_content = {}
+    for document in documents:
+        by_name.setdefault(doc_key(document.name), []).append(document)
+        if document.id in records:
+            by_content.setdefault(records[document.id], []).append(document)
+
+    kept = set()
+    deleted = {}
+    for key, entry in manifest.items():
+        same = by_content.get((entry.md5.lower(), entry.size), [])
+        if same:
+            response.unchanged += 1
+            kept.add(same[0].id)
+            reason = 'duplicate'
+        elif by_name.get(key):
+            response.changed.append(entry.name)
+            reason = 'changed'
+        else:
+            response.added.append(entry.name)
+            continue
+        for document in by_name.get(key, []):
+            if document.id not in kept:
+                deleted.setdefault(document.id, SyncDocument(name=document.name, doc_id=document.id, reason=reason))
+    if request.delete_missing:
+        for document in documents:
+            if document.id not in kept:
+                deleted.setdefault(document.id, SyncDocument(name=document.name, doc_id=document.id,
+                                                             reason='removed'))
+
+    # 新上传的文件去重后会复用已登记的file_id，这些文档即将重新加入知识库，不能删除
+    reused = set()
+    if not request.force_reupload:
+        for name in response.added + response.changed:
+            entry = manifest[doc_key(name)]
+            file_id = find_registered_file(entry.md5.lower(), entry.size)
+            if file_id is not None:
+                reused.add(file_id)
+    response.deleted = [document for doc_id, document in deleted.items() if doc_id not in kept | reused]
+    return response
+
+
+def sync(request: SyncRequest, uploads: List[FileContent]):
+    """
+    增量同步：只上传新增和有变化的文件，删除清单里已没有的文档，其余文档不动。
+    uploads为本次请求上传的文件，必须覆盖差异里所有需要上传的文件且MD5与清单一致，否则不做任何修改。
+    """
+    response = diff(request)
+    if request.dry_run:
+        return response
+    if response.conflicts:
+        raise ValueError(f'duplicate document names in manifest: {response.conflicts}')
+
+    expected = {doc_key(entry.name): entry for entry in request.files}
+    uploaded = {doc_key(file.name): file for file in uploads}
+    files = []
+    for name in response.added + response.changed:
+        file = uploaded.get(doc_key(name))
+        if file is None:
+            raise ValueError(f'file not uploaded: {name}')
+        entry = expected[doc_key(name)]
+        if file.md5 != entry.md5.lower() or file.size != entry.size:
+            raise ValueError(f'uploaded file does not match manifest: {name}, md5: {file.md5}, size: {file.size}')
+        files.append(file)
+
+    if files:
+        response.task_id = file_add(FileAddRequest(id=request.id, files=files,
+                                                   force_reupload=request.force_reupload)).task_id
+    if response.deleted:
+        # 被替换的旧版本在这里直接删除，新版本解析完成前该文档检索不到
+        deleted = delete_files(DeleteFilesRequest(id=request.id,
+                                                  file_ids=[document.doc_id for document in response.deleted]))
+        response.deleted_ids = deleted.file_ids
+    log.info(f'sync index: {request.id}, added: {len(response.added)}, changed: {len(response.changed)}, '
+             f'deleted: {len(response.deleted)}, unchanged: {response.unchanged}, task_id: {response.task_id}')
+    return response
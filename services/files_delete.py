@@ -1,8 +1,7 @@
 from pydantic import BaseModel
-from utils.bailian import delete_store_files, delete_file
+from utils.bailian import delete_store_files, delete_file, is_file_shared, unregister_file
 import traceback
 from utils.log import log
-import time
 
 
 class DeleteFilesRequest(BaseModel):
@@ -16,11 +15,13 @@ class DeleteFilesResponse(BaseModel):
 
 def delete_files(request: DeleteFilesRequest):
     deleted_ids = delete_store_files(request.id, request.file_ids)
-    for i, file_id in enumerate(deleted_ids):
+    for file_id in deleted_ids:
         try:
+            # 文件去重后可能还被其他知识库引用，这时只从当前知识库移除
+            if is_file_shared(file_id, request.id):
+                continue
             delete_file(file_id)
-            if (i + 1) % 10 == 0:
-                time.sleep(1)
+            unregister_file(file_id)
         except Exception as e:
             trace_info = traceback.format_exc()
             log.error(f'Exception for files_delete, file id:{file_id} , e: {e}, trace: {trace_info}')
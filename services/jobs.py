@@ -0,0 +1,23 @@
+from services import create_store, file_add
+from data.task import StoreTaskEntity, TaskStatus
+from utils.job_queue import Worker
+
+HANDLERS = {
+    create_store.JOB_TYPE: create_store.run_job,
+}
+# 同一知识库的添加文件任务领取时合并成一批，提交一个update_index
+BATCH_HANDLERS = {
+    file_add.JOB_TYPE: file_add.run_jobs,
+}
+
+
+def _on_failed(job, e):
+    """重试次数用完后把任务标记为失败，task_status可以查到"""
+    task = StoreTaskEntity.query_first(task_id=job.task_id)
+    if task is not None and task.status != TaskStatus.FAILED:
+        task.set(status=TaskStatus.FAILED,
+                 message=f'Exception for ingest job, task_id: {job.task_id}, attempts: {job.attempts}, e: {e}')
+
+
+def create_worker(concurrency=None):
+    return Worker(HANDLERS, concurrency=concurrency, on_failed=_on_failed, batch_handlers=BATCH_HANDLERS)
@@ -1,10 +1,17 @@
 from pydantic import BaseModel
+import asyncio
+import traceback
 from typing import Dict, List, Optional
-from openai import AsyncOpenAI
-from utils.security import decrypt
+from utils.llm import get_llm_client
 from utils.config import config
-from services.retrieve import RetrieveRequest, retrieve
+from services.retrieve import RetrieveRequest, retrieve, merge_retrieve_responses
 from server.response import SuccessResponse
+from utils.log import log
+from utils.cache import create_cache, make_key
+from utils.tokens import estimator, pack_texts
+from utils.sse import coalesce, content_frame, json_frame
+from utils import metrics
+import time
 
 
 class QueryRequest(BaseModel):
@@ -18,10 +25,28 @@ class QueryRequest(BaseModel):
     sparse_top_k: Optional[int] = None
     rerank_threshold: Optional[float] = None
     search_filters: Optional[Dict[str, str]] = None
+    merge_top_k: Optional[int] = None
+    rewrite: Optional[str] = None  # auto | always | never，为空使用application.yml中query.rewrite
+    speculative: Optional[bool] = None
+    max_context_tokens: Optional[int] = None
+
+
+class ContextUsage(BaseModel):
+    budget_tokens: int
+    used_tokens: int
+    chunks: int
+    dropped_chunks: int
+    truncated: bool
 
 
 class QueryResponse(BaseModel):
     content: str
+    context: Optional[ContextUsage] = None
+    cached: Optional[bool] = None
+    usage: Optional[Dict] = None
+    timing: Optional[Dict] = None
+    timeout_ids: Optional[List[str]] = None
+    done: Optional[bool] = None
 
 
 SYSTEM = """# 角色
@@ -45,15 +70,46 @@ SYSTEM = """# 角色
         """
 
 
-async def _query(request: QueryRequest):
-    if request.id:
-        if request.id not in request.ids:
-            request.ids.append(request.id)
-    client = AsyncOpenAI(
-        api_key=decrypt(config['api_key']),
-        base_url='https://dashscope.aliyuncs.com/compatible-mode/v1',
-    )
-    history_messages = request.messages[-7:]
+# 出现这些指代词时，最后一句话依赖上下文，需要改写后再检索
+REFERENCE_WORDS = ('这个', '那个', '这些', '那些', '这种', '那种', '它', '他们', '她们', '上面', '上述', '刚才', '之前',
+                   '前面', '同样', '还有吗', '其他的', '另外的')
+
+rewrite_cache = create_cache('rewrite_cache')
+answer_cache = create_cache('answer_cache')
+MODEL = 'qwen-plus-latest'
+
+
+def _last_user_content(messages):
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            return message.get('content') or ''
+    return ''
+
+
+def _need_rewrite(request: QueryRequest, history_messages):
+    """单轮对话或最后一句话本身语义完整时，直接用原话检索，省掉一次改写调用"""
+    query_config = config.get('query', {})
+    mode = request.rewrite or query_config.get('rewrite', 'auto')
+    if mode == 'always':
+        return True
+    if mode == 'never':
+        return False
+    dialog = [message for message in history_messages if message.get('role') in ('user', 'assistant')]
+    if len(dialog) <= 1:
+        return False
+    content = _last_user_content(history_messages)
+    if len(content) < query_config.get('self_contained_min_length', 12):
+        return True
+    return any(word in content for word in REFERENCE_WORDS)
+
+
+async def _rewrite_query(client, request: QueryRequest, history_messages):
+    cache_key = None
+    if rewrite_cache is not None:
+        cache_key = make_key(history_messages)
+        cached = rewrite_cache.get(cache_key)
+        if cached is not None:
+            return cached
     prompt = f'''你是一个知识库检索助手，可以根据聊天历史生成知识库检索句子。
 要求只能根据聊天历史进行总结，不允许总结超出聊天历史的内容。
 
@@ -68,29 +124,136 @@ async def _query(request: QueryRequest):
         }
     ]
     messages = messages + request.messages
-    completion = await client.chat.completions.create(
-        model="qwen-plus-latest",
-        messages=messages
-    )
+    with metrics.stage('rewrite'):
+        completion = await client.chat.completions.create(
+            model=MODEL,
+            messages=messages
+        )
     query_content = completion.choices[0].message.content
-    retrieve_request = RetrieveRequest(
-        ids=request.ids,
+    if not (query_content or '').strip():
+        # 大模型没有给出改写结果时用原话检索，也不写入改写缓存
+        log.warning('Query rewrite returned empty content, use raw query')
+        return _last_user_content(history_messages)
+    if cache_key is not None:
+        rewrite_cache.set(cache_key, query_content)
+    return query_content
+
+
+def _retrieve_request(request: QueryRequest, query_content):
+    return RetrieveRequest(
+        ids=list(request.ids),
         query=query_content,
         top_k=request.top_k,
         rerank_top_k=request.rerank_top_k,
         sparse_top_k=request.sparse_top_k,
         rerank_threshold=request.rerank_threshold,
-        search_filters=request.search_filters
+        search_filters=request.search_filters,
+        # 多个index合并后只取全局最好的N个片段放进prompt
+        merge_top_k=_merge_top_k(request),
+        # 近似重复的片段只在放进prompt前去掉，/retrieve的返回结果不受影响
+        dedup=config.get('query', {}).get('dedup', True)
     )
-    retrieve_response = await retrieve(retrieve_request)
-    documents = []
-    for chunk in retrieve_response.chunks:
-        documents.append(chunk.text)
-    documents = '\n'.join(documents)
-    system = request.system
-    if system is None:
-        system = SYSTEM
-    system = system.replace('${documents}', documents)
+
+
+def _merge_top_k(request: QueryRequest):
+    return request.merge_top_k or request.rerank_top_k or 5
+
+
+def _speculative(request: QueryRequest):
+    if request.speculative is not None:
+        return request.speculative
+    return config.get('query', {}).get('speculative', False)
+
+
+def _discard_result(task):
+    if not task.cancelled() and task.exception() is not None:
+        log.error(f'Exception for background query rewrite, e: {task.exception()}')
+
+
+async def _speculative_retrieve(client, request: QueryRequest, history_messages, raw_query):
+    """
+    改写的同时用原话先检索。改写在speculative_deadline内完成时按策略处理：
+    merge-改写后的检索结果与原话检索结果合并；replace-只用改写后的检索结果。
+    改写超时或失败时直接使用原话检索的结果，改写继续在后台完成并写入改写缓存。
+    """
+    query_config = config.get('query', {})
+    policy = query_config.get('speculative_policy', 'merge')
+    deadline = query_config.get('speculative_deadline', 1.5)
+    speculative_task = asyncio.ensure_future(retrieve(_retrieve_request(request, raw_query)))
+    rewrite_task = asyncio.ensure_future(_rewrite_query(client, request, history_messages))
+    try:
+        query_content = await asyncio.wait_for(asyncio.shield(rewrite_task), timeout=deadline)
+    except asyncio.TimeoutError:
+        log.info(f'Query rewrite exceeded speculative deadline {deadline}s, use speculative chunks')
+        rewrite_task.add_done_callback(_discard_result)
+        return await speculative_task
+    except Exception as e:
+        trace_info = traceback.format_exc()
+        log.error(f'Exception for query rewrite, use speculative chunks, e: {e}, trace: {trace_info}')
+        return await speculative_task
+
+    if (query_content or '').strip() == raw_query.strip():
+        return await speculative_task
+    rewritten_response = await retrieve(_retrieve_request(request, query_content))
+    if policy == 'replace':
+        speculative_task.cancel()
+        return rewritten_response
+    speculative_response = await speculative_task
+    return merge_retrieve_responses([rewritten_response, speculative_response], _merge_top_k(request),
+                                    config.get('query', {}).get('dedup', True))
+
+
+def _pack_documents(request: QueryRequest, texts):
+    """按token预算从高分到低分放入检索片段"""
+    query_config = config.get('query', {})
+    budget = request.max_context_tokens or query_config.get('max_context_tokens', 6000)
+    packed, used, truncated = pack_texts(texts, budget, query_config.get('truncate_last_chunk', True))
+    context = ContextUsage(budget_tokens=budget, used_tokens=used, chunks=len(packed),
+                           dropped_chunks=len(texts) - len(packed), truncated=truncated)
+    log.info(f'Query context packed, tokens used: {used}/{budget}, chunks: {len(packed)}/{len(texts)}, '
+             f'truncated: {truncated}')
+    return '\n'.join(packed), context
+
+
+def _calibrate(messages, usage):
+    """用大模型返回的prompt_tokens校准token估算"""
+    if usage is not None and usage.prompt_tokens:
+        estimated = sum(estimator.estimate(message.get('content') or '') for message in messages)
+        estimator.calibrate(estimated, usage.prompt_tokens)
+
+
+def _answer_cache_key(messages, temperature):
+    """
+    最终prompt中system已替换为检索片段，对归一化后的消息取哈希，
+    即同时覆盖了对话历史、system提示词和检索片段内容，知识库变化后自然不再命中。
+    """
+    normalized = [(message.get('role', ''), ' '.join((message.get('content') or '').split()))
+                  for message in messages]
+    return make_key(MODEL, temperature, normalized)
+
+
+async def _query(request: QueryRequest):
+    if request.id:
+        if request.id not in request.ids:
+            request.ids.append(request.id)
+    client = get_llm_client()
+    history_messages = request.messages[-7:]
+    raw_query = _last_user_content(history_messages)
+    if not _need_rewrite(request, history_messages):
+        retrieve_response = await retrieve(_retrieve_request(request, raw_query))
+    elif _speculative(request):
+        retrieve_response = await _speculative_retrieve(client, request, history_messages, raw_query)
+    else:
+        query_content = await _rewrite_query(client, request, history_messages)
+        retrieve_response = await retrieve(_retrieve_request(request, query_content))
+    if retrieve_response.timeout_ids:
+        log.warning(f'Query answered with partial chunks, timed out index_ids: {retrieve_response.timeout_ids}')
+    with metrics.stage('prompt_build'):
+        documents, context = _pack_documents(request, [chunk.text for chunk in retrieve_response.chunks])
+        system = request.system
+        if system is None:
+            system = SYSTEM
+        system = system.replace('${documents}', documents)
     messages = [
         {
             'role': 'system',
@@ -98,37 +261,106 @@ async def _query(request: QueryRequest):
         }
     ]
     messages = messages + history_messages
-    return client, messages
+    return client, messages, context, retrieve_response.timeout_ids or None
+
+
+def _timing(start_time, end_time, first_token=None):
+    """最后一帧里的耗时：开启metrics.timing_in_stream时带上各阶段耗时"""
+    timing = {}
+    timer = metrics.current_timer.get()
+    if timer is not None and config.get('metrics', {}).get('timing_in_stream', True):
+        timing.update(timer.timings())
+    elif first_token is not None:
+        timing['first_token'] = round(first_token - start_time, 3)
+    timing['total'] = round(end_time - start_time, 3)
+    return timing
+
+
+def _final_frame(context, usage=None, timing=None, cached=None, timeout_ids=None):
+    """流式输出的最后一帧，携带token用量、耗时和检索超时的index"""
+    response = QueryResponse(content='', context=context, usage=usage, timing=timing, cached=cached,
+                             timeout_ids=timeout_ids, done=True)
+    return json_frame(SuccessResponse(data=response).model_dump_json(exclude_none=True))
 
 
-async def stream_query(request: QueryRequest):
-    client, messages = await _query(request)
+async def stream_query(request: QueryRequest, use_cache=True):
+    start_time = time.monotonic()
+    client, messages, context, timeout_ids = await _query(request)
     if request.temperature is not None:
         temperature = request.temperature
     else:
         temperature = 0.5
+    cache_key = None
+    if use_cache and answer_cache is not None:
+        cache_key = _answer_cache_key(messages, temperature)
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            yield content_frame(cached)
+            yield _final_frame(context, timing=_timing(start_time, time.monotonic()), cached=True,
+                               timeout_ids=timeout_ids)
+            return
     completion = await client.chat.completions.create(
-        model="qwen-plus-latest",
+        model=MODEL,
         messages=messages,
         temperature=temperature,
         stream=True,
         stream_options={"include_usage": True}
     )
-    async for chunk in completion:
-        if len(chunk.choices) > 0:
-            response = SuccessResponse(data=QueryResponse(content=chunk.choices[0].delta.content)).model_dump_json()
-            yield f"data: {response}\n\n"
+    state = {'contents': [], 'finished': False, 'usage': None, 'first_token': None}
 
+    async def deltas():
+        async for chunk in completion:
+            if chunk.usage is not None:
+                state['usage'] = chunk.usage
+            if len(chunk.choices) > 0:
+                if chunk.choices[0].finish_reason == 'stop':
+                    state['finished'] = True
+                content = chunk.choices[0].delta.content
+                if content:
+                    if state['first_token'] is None:
+                        state['first_token'] = time.monotonic()
+                        metrics.mark('first_token')
+                    state['contents'].append(content)
+                    yield content
 
-async def query(request: QueryRequest):
-    client, messages = await _query(request)
+    async for frame in coalesce(deltas()):
+        yield frame
+
+    end_time = time.monotonic()
+    usage = state['usage']
+    _calibrate(messages, usage)
+    if state['first_token'] is not None:
+        metrics.record('stream', end_time - state['first_token'])
+        if usage is not None and usage.completion_tokens and end_time > state['first_token']:
+            metrics.rate('tokens_per_sec', usage.completion_tokens / (end_time - state['first_token']))
+    timing = _timing(start_time, end_time, state['first_token'])
+    # 只缓存完整生成的回答，中途断开或被截断的不缓存
+    if cache_key is not None and state['finished']:
+        answer_cache.set(cache_key, ''.join(state['contents']))
+    yield _final_frame(context, usage=usage.model_dump() if usage is not None else None, timing=timing,
+                       timeout_ids=timeout_ids)
+
+
+async def query(request: QueryRequest, use_cache=True):
+    client, messages, context, timeout_ids = await _query(request)
     if request.temperature is not None:
         temperature = request.temperature
     else:
         temperature = 0.5
-    completion = await client.chat.completions.create(
-        model="qwen-plus-latest",
-        temperature=temperature,
-        messages=messages
-    )
-    return QueryResponse(content=completion.choices[0].message.content)
+    cache_key = None
+    if use_cache and answer_cache is not None:
+        cache_key = _answer_cache_key(messages, temperature)
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            return QueryResponse(content=cached, context=context, cached=True, timeout_ids=timeout_ids)
+    with metrics.stage('generate'):
+        completion = await client.chat.completions.create(
+            model=MODEL,
+            temperature=temperature,
+            messages=messages
+        )
+    _calibrate(messages, completion.usage)
+    content = completion.choices[0].message.content
+    if cache_key is not None and completion.choices[0].finish_reason == 'stop':
+        answer_cache.set(cache_key, content)
+    return QueryResponse(content=content, context=context, timeout_ids=timeout_ids)
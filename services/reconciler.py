@@ -0,0 +1,124 @@
+import threading
+import time
+import traceback
+from data.database import session_scope
+from data.task import StoreTaskEntity, FileTaskEntity, TaskStatus
+from utils.bailian import get_index_result, update_registered_file_statuses
+from utils.cache import invalidate_index
+from utils.config import config
+from utils.log import log
+
+reconciler_config = config.get('reconciler', {})
+# 知识库删除后任务标记为DELETED，不再轮询，也不能被轮询结果覆盖
+FINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.DELETED)
+
+
+class Reconciler:
+    """
+    后台轮询在途的百炼入库任务（StoreTaskEntity已有job_id且未结束），把任务和文件状态批量写回数据库，
+    task_status只读数据库。
+    每个任务单独安排下次轮询时间：状态没有变化时间隔按backoff倍数拉长到max_interval，有变化时回到min_interval。
+    合并提交的多个任务共用一个job_id，按job轮询一次后更新所有相关任务。
+    多个worker进程同时运行时会重复轮询同一任务，写入是幂等的。
+    """
+
+    def __init__(self, min_interval=None, max_interval=None, backoff=None, max_errors=None):
+        self.min_interval = min_interval or reconciler_config.get('min_interval', 2)
+        self.max_interval = max_interval or reconciler_config.get('max_interval', 60)
+        self.backoff = backoff or reconciler_config.get('backoff', 1.5)
+        self.max_errors = max_errors or reconciler_config.get('max_errors', 10)
+        # job_id -> [下次轮询时间, 当前间隔, 连续失败次数]
+        self._schedule = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='reconciler', daemon=True)
+        self._thread.start()
+        log.info('Reconciler started.')
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stopping.wait(1):
+            try:
+                self.reconcile_once()
+            except Exception as e:
+                trace_info = traceback.format_exc()
+                log.error(f'Exception for reconcile, e: {e}, trace: {trace_info}')
+
+    def _in_flight(self):
+        with session_scope() as session:
+            rows = session.query(StoreTaskEntity.task_id, StoreTaskEntity.index_id, StoreTaskEntity.job_id).filter(
+                StoreTaskEntity.job_id.isnot(None),
+                StoreTaskEntity.status.notin_(FINAL_STATUSES)
+            ).all()
+            return [tuple(row) for row in rows]
+        return []
+
+    def reconcile_once(self):
+        now = time.monotonic()
+        jobs = {}
+        for task_id, index_id, job_id in self._in_flight():
+            jobs.setdefault((index_id, job_id), []).append(task_id)
+        in_flight_jobs = {job_id for _, job_id in jobs}
+        for job_id in list(self._schedule):
+            if job_id not in in_flight_jobs:
+                del self._schedule[job_id]
+        for (index_id, job_id), task_ids in jobs.items():
+            schedule = self._schedule.setdefault(job_id, [now, self.min_interval, 0])
+            if schedule[0] > now:
+                continue
+            try:
+                changed = self.reconcile_job(index_id, job_id, task_ids)
+                schedule[1] = self.min_interval if changed else min(self.max_interval, schedule[1] * self.backoff)
+                schedule[2] = 0
+            except Exception as e:
+                schedule[2] += 1
+                schedule[1] = min(self.max_interval, schedule[1] * self.backoff)
+                trace_info = traceback.format_exc()
+                log.error(f'Exception for reconcile, job_id: {job_id}, task_ids: {task_ids}, '
+                          f'errors: {schedule[2]}, e: {e}')
+                if schedule[2] >= self.max_errors:
+                    for task_id in task_ids:
+                        self._fail(task_id, f'Exception for task_status, task_id: {task_id}, e: {e}, '
+                                            f'trace: {trace_info}')
+            schedule[0] = time.monotonic() + schedule[1]
+
+    def reconcile_job(self, index_id, job_id, task_ids):
+        """拉取一次任务状态，在一个事务里批量更新该job下所有任务和文件的状态，返回是否有变化"""
+        result = get_index_result(index_id, job_id)
+        documents = {doc.doc_id: doc for doc in result.body.data.documents}
+        job_status = result.body.data.status
+        changed = False
+        with session_scope() as session:
+            for file_task in session.query(FileTaskEntity).filter(FileTaskEntity.task_id.in_(task_ids),
+                                                                  FileTaskEntity.doc_id.in_(list(documents)),
+                                                                  FileTaskEntity.status != TaskStatus.DELETED):
+                doc = documents[file_task.doc_id]
+                if file_task.status != doc.status or file_task.message != doc.message:
+                    file_task.status = doc.status
+                    file_task.message = doc.message
+                    changed = True
+            for task in session.query(StoreTaskEntity).filter(StoreTaskEntity.task_id.in_(task_ids),
+                                                              StoreTaskEntity.status != TaskStatus.DELETED):
+                if task.status != job_status or task.message != result.body.message:
+                    task.status = job_status
+                    task.message = result.body.message
+                    changed = True
+            session.commit()
+        if changed:
+            update_registered_file_statuses({doc_id: doc.status for doc_id, doc in documents.items()})
+        if job_status == TaskStatus.COMPLETED:
+            # 新文档入库完成后才会被检索到，这里再清一次检索缓存
+            invalidate_index(index_id)
+        return changed
+
+    @staticmethod
+    def _fail(task_id, message):
+        task = StoreTaskEntity.query_first(task_id=task_id)
+        if task is not None:
+            task.set(status=TaskStatus.FAILED, message=message)
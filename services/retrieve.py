@@ -1,13 +1,22 @@
 from pydantic import BaseModel
 from typing import Optional
-from utils.bailian import create_client
+from utils.bailian import retrieve_async
+from utils.cache import retrieve_cache, make_key, index_generations
 from alibabacloud_bailian20231229 import models as bailian_20231229_models
-from alibabacloud_tea_util import models as util_models
-from utils.config import config
 from typing import Dict, List
 import traceback
 from utils.log import log
 import asyncio
+import heapq
+import json
+import statistics
+import threading
+import time
+from collections import deque
+from utils.config import config
+from utils.dedup import dedup_texts
+from utils import metrics
+from starlette.concurrency import run_in_threadpool
 
 
 class RetrieveRequest(BaseModel):
@@ -20,6 +29,11 @@ class RetrieveRequest(BaseModel):
     rerank_threshold: Optional[float] = None
     search_filters: Optional[Dict[str, str]] = None
     min_score: Optional[float] = None
+    merge_top_k: Optional[int] = None
+    deadline: Optional[float] = None
+    index_timeout: Optional[float] = None
+    hedge: Optional[bool] = None
+    dedup: Optional[bool] = None
 
 
 class RetrieveNode(BaseModel):
@@ -30,31 +44,92 @@ class RetrieveNode(BaseModel):
 
 class RetrieveResponse(BaseModel):
     chunks: Optional[List[RetrieveNode]] = None
+    timeout_ids: Optional[List[str]] = None
+
+
+class CacheStatsResponse(BaseModel):
+    enabled: bool
+    stats: Optional[Dict] = None
+
+
+class LatencyTracker:
+    """
+    记录每个index最近的检索耗时，用于计算对冲请求的触发阈值。
+    耗时在线程池里记录，只含SDK调用本身；超时的调用按实际耗时（约等于read_timeout）记录，不会让p95偏低。
+    """
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            samples = self._samples.setdefault(key, deque(maxlen=self.window))
+            samples.append(seconds)
+
+    def percentile(self, key, q, min_samples):
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+latency_tracker = LatencyTracker()
 
 
-async def _retrieve(request, id):
-    """封装retrieve操作为一个独立的函数"""
-    client = create_client()
+async def _retrieve_remote(request, id, timeout):
+    retrieve_request = bailian_20231229_models.RetrieveRequest(
+        query=request.query,
+        index_id=id,
+        enable_reranking=True,
+        dense_similarity_top_k=request.top_k,
+        rerank_top_n=request.rerank_top_k,
+        search_filters=request.search_filters,
+        sparse_similarity_top_k=request.sparse_top_k,
+        rerank_min_score=request.min_score
+    )
+    return await retrieve_async(retrieve_request, timeout,
+                                lambda seconds: latency_tracker.record(id, seconds))
+
+
+async def _hedged_retrieve(request, id, timeout):
+    """超过该index的p95延迟仍未返回时，再发一个相同请求，取先返回的结果"""
+    retrieve_config = config.get('retrieve', {})
+    hedge = request.hedge if request.hedge is not None else retrieve_config.get('hedge', False)
+    delay = None
+    if hedge:
+        delay = latency_tracker.percentile(id, 0.95, retrieve_config.get('hedge_min_samples', 20))
+    if delay is None:
+        return await _retrieve_remote(request, id, timeout)
+
+    tasks = {asyncio.ensure_future(_retrieve_remote(request, id, timeout))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            log.info(f'Retrieve hedged for index_id: {id}, p95: {delay:.3f}s')
+            tasks.add(asyncio.ensure_future(_retrieve_remote(request, id, timeout)))
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        return done.pop().result()
+    finally:
+        # 线程池里已经发出的调用无法中断，这里只是丢弃较慢的那个结果；它最多再占用线程timeout秒
+        for task in tasks:
+            task.cancel()
+
+
+async def _retrieve_uncached(request, id, cache_key, cacheable):
     chunks = []
-    if request.min_score is None:
-        request.min_score = 0.3
     try:
-        retrieve_request = bailian_20231229_models.RetrieveRequest(
-            query=request.query,
-            index_id=id,
-            enable_reranking=True,
-            dense_similarity_top_k=request.top_k,
-            rerank_top_n=request.rerank_top_k,
-            search_filters=request.search_filters,
-            sparse_similarity_top_k=request.sparse_top_k,
-            rerank_min_score=request.min_score
-        )
-        runtime = util_models.RuntimeOptions()
-        headers = {}
-        result = await client.retrieve_with_options_async(config['workspace_id'], retrieve_request, headers, runtime)
+        # SDK调用的read_timeout取单个index超时和整个请求截止时间中较小的一个
+        result = await _hedged_retrieve(request, id, min(request.index_timeout, request.deadline))
         if result.body and result.body.data and result.body.data.nodes:
             for node in result.body.data.nodes:
                 chunks.append(RetrieveNode(score=node.score, text=node.text, metadata=node.metadata))
+        if cacheable and result.body and result.body.success:
+            retrieve_cache.set(cache_key, json.dumps([chunk.model_dump() for chunk in chunks], ensure_ascii=False),
+                               tags=(id,))
     except Exception as e:
         trace_info = traceback.format_exc()
         ids = str(request.ids)
@@ -62,6 +137,81 @@ async def _retrieve(request, id):
     return chunks
 
 
+# 正在进行中的检索，相同参数的并发请求共用同一次百炼调用
+_inflight = {}
+
+
+async def _retrieve(request, id, generation=None):
+    """封装retrieve操作为一个独立的函数，generation为该index的代数，为None时不读写缓存"""
+    if request.min_score is None:
+        request.min_score = 0.3
+    cache_key = make_key(id, generation, request.query, request.top_k, request.rerank_top_k, request.sparse_top_k,
+                         request.min_score, request.search_filters)
+    cacheable = retrieve_cache is not None and generation is not None
+    if cacheable:
+        cached = retrieve_cache.get(cache_key)
+        if cached is not None:
+            return [RetrieveNode(**node) for node in json.loads(cached)]
+    task = _inflight.get(cache_key)
+    if task is None:
+        task = asyncio.ensure_future(_retrieve_uncached(request, id, cache_key, cacheable))
+        _inflight[cache_key] = task
+        task.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+    # shield: 某个调用方超时取消时，不影响共用这次检索的其他调用方
+    return await asyncio.shield(task)
+
+
+async def _timed_retrieve(request, id, generation=None):
+    """
+    记录当前请求在每个index上等待的时间（含缓存命中和超时），阶段名带上index_id，日志里能看出哪个index慢。
+    所有index共用一个retrieve.index直方图，index数量不限，不能每个index一个直方图。
+    """
+    start_time = time.monotonic()
+    try:
+        return await _retrieve(request, id, generation)
+    finally:
+        metrics.record(f'retrieve.index:{id}', time.monotonic() - start_time)
+
+
+def _normalize(scores, method):
+    """index内分数归一化，只用于跨index排序，不改变返回的原始分数"""
+    if method == 'minmax':
+        low, high = min(scores), max(scores)
+        if high == low:
+            return [1.0] * len(scores)
+        return [(score - low) / (high - low) for score in scores]
+    if method == 'max':
+        high = max(scores)
+        return [score / high if high > 0 else 0.0 for score in scores]
+    if method == 'zscore':
+        mean, std = statistics.fmean(scores), statistics.pstdev(scores)
+        return [(score - mean) / std if std > 0 else 0.0 for score in scores]
+    return scores
+
+
+def merge_chunks(results, top_n=None, normalization='none'):
+    """
+    合并多个index的检索结果，按归一化分数取全局top_n。
+    分数相同时依次按原始分数、index在请求中的顺序、index内排名排序，结果稳定。
+    """
+    candidates = []
+    for order, chunks in enumerate(results):
+        if not chunks:
+            continue
+        scores = _normalize([chunk.score for chunk in chunks], normalization)
+        for rank, (chunk, score) in enumerate(zip(chunks, scores)):
+            candidates.append((score, chunk.score, -order, -rank, chunk))
+
+    def sort_key(item):
+        return item[:4]
+
+    if top_n is None or top_n >= len(candidates):
+        ranked = sorted(candidates, key=sort_key, reverse=True)
+    else:
+        ranked = heapq.nlargest(top_n, candidates, key=sort_key)
+    return [item[4] for item in ranked]
+
+
 async def retrieve(request: RetrieveRequest):
     if request.id:
         if request.id not in request.ids:
@@ -72,20 +222,89 @@ async def retrieve(request: RetrieveRequest):
         request.top_k = 10
     if request.sparse_top_k is None:
         request.sparse_top_k = 10
+    retrieve_config = config.get('retrieve', {})
+    if request.merge_top_k is None:
+        request.merge_top_k = retrieve_config.get('merge_top_k')
+    if request.deadline is None:
+        request.deadline = retrieve_config.get('deadline', 5.0)
+    if request.index_timeout is None:
+        request.index_timeout = retrieve_config.get('index_timeout', 3.0)
 
-    all_chunks = []
+    index_chunks = []
+    timeout_ids = []
 
-    # Create a list of tasks for each ID
-    tasks = [_retrieve(request, id) for id in request.ids]
+    # 缓存key带上index的代数，入库或删除由其他进程完成时旧的缓存条目也不再命中
+    generations = {}
+    if retrieve_cache is not None:
+        generations = await run_in_threadpool(index_generations, request.ids)
 
-    # Run all tasks concurrently
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # Create a list of tasks for each ID, every index is bounded by index_timeout
+    tasks = [asyncio.ensure_future(asyncio.wait_for(_timed_retrieve(request, id, generations.get(id)),
+                                                    timeout=request.index_timeout))
+             for id in request.ids]
+
+    # Run all tasks concurrently, the whole request is bounded by the deadline
+    with metrics.stage('retrieve'):
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=request.deadline)
+        for task in pending:
+            task.cancel()
 
     # Process results
-    for id, result in zip(request.ids, results):
-        if isinstance(result, Exception):
-            log.error(f'Retrieve generated an exception for index_id: {id}, exception: {result}')
+    for id, task in zip(request.ids, tasks):
+        if task in pending:
+            log.warning(f'Retrieve exceeded request deadline for index_id: {id}, deadline: {request.deadline}s')
+            timeout_ids.append(id)
+            index_chunks.append([])
+        elif isinstance(task.exception(), asyncio.TimeoutError):
+            log.warning(f'Retrieve timed out for index_id: {id}, timeout: {request.index_timeout}s')
+            timeout_ids.append(id)
+            index_chunks.append([])
+        elif task.exception() is not None:
+            log.error(f'Retrieve generated an exception for index_id: {id}, exception: {task.exception()}')
+            index_chunks.append([])
         else:
-            all_chunks.extend(result)
+            index_chunks.append(task.result())
+
+    with metrics.stage('merge'):
+        all_chunks = rank_chunks(index_chunks, request.merge_top_k, request.dedup)
+    return RetrieveResponse(chunks=all_chunks, timeout_ids=timeout_ids)
+
+
+def rank_chunks(index_chunks, top_n=None, dedup=None):
+    """合并、去重并截断多组检索结果，index_chunks按优先级排列"""
+    retrieve_config = config.get('retrieve', {})
+    normalization = retrieve_config.get('score_normalization', 'none')
+    if dedup is None:
+        dedup = retrieve_config.get('dedup', False)
+    if not dedup:
+        return merge_chunks(index_chunks, top_n, normalization)
+    # 先全量排序去重再截断，避免重复片段占掉top_k名额
+    all_chunks = merge_chunks(index_chunks, None, normalization)
+    kept = dedup_texts([chunk.text for chunk in all_chunks], retrieve_config.get('dedup_threshold', 0.9))
+    return [all_chunks[i] for i in kept][:top_n]
+
+
+def merge_retrieve_responses(responses, top_n=None, dedup=None):
+    """合并多次检索的结果（如改写前后的两个query），去掉完全相同的片段后重新排序"""
+    seen = set()
+    chunk_lists = []
+    timeout_ids = []
+    for response in responses:
+        chunks = []
+        for chunk in response.chunks or []:
+            if chunk.text not in seen:
+                seen.add(chunk.text)
+                chunks.append(chunk)
+        chunk_lists.append(chunks)
+        for id in response.timeout_ids or []:
+            if id not in timeout_ids:
+                timeout_ids.append(id)
+    return RetrieveResponse(chunks=rank_chunks(chunk_lists, top_n, dedup), timeout_ids=timeout_ids)
+
 
-    return RetrieveResponse(chunks=all_chunks)
+def retrieve_cache_stats():
+    if retrieve_cache is None:
+        return CacheStatsResponse(enabled=False)
+    return CacheStatsResponse(enabled=True, stats=retrieve_cache.stats())
@@ -0,0 +1,69 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from services.retrieve import RetrieveRequest, RetrieveResponse, retrieve
+from utils.config import config
+from utils.log import log
+import traceback
+import asyncio
+
+
+class RetrieveBatchRequest(BaseModel):
+    requests: List[RetrieveRequest]
+    concurrency: Optional[int] = None
+    stream: Optional[bool] = False
+
+
+class RetrieveBatchItem(BaseModel):
+    index: int
+    result: Optional[RetrieveResponse] = None
+    error: Optional[str] = None
+
+
+class RetrieveBatchResponse(BaseModel):
+    results: List[RetrieveBatchItem]
+
+
+def _concurrency(request: RetrieveBatchRequest):
+    batch_config = config.get('retrieve_batch', {})
+    max_concurrency = batch_config.get('max_concurrency', 16)
+    if request.concurrency is None:
+        return batch_config.get('concurrency', 8)
+    return max(1, min(request.concurrency, max_concurrency))
+
+
+def check_batch_size(request: RetrieveBatchRequest):
+    max_size = config.get('retrieve_batch', {}).get('max_size', 1000)
+    if len(request.requests) > max_size:
+        raise ValueError(f'Too many requests in one batch: {len(request.requests)}, max: {max_size}')
+
+
+async def _retrieve_one(index, request: RetrieveRequest, semaphore):
+    async with semaphore:
+        try:
+            return RetrieveBatchItem(index=index, result=await retrieve(request))
+        except Exception as e:
+            trace_info = traceback.format_exc()
+            log.error(f'Exception for retrieve_batch, index: {index}, e: {e}, trace: {trace_info}')
+            return RetrieveBatchItem(index=index, error=str(e))
+
+
+async def retrieve_batch(request: RetrieveBatchRequest):
+    """批量检索，结果按输入顺序返回；相同的(index, query)检索由retrieve内部合并为一次调用"""
+    check_batch_size(request)
+    semaphore = asyncio.Semaphore(_concurrency(request))
+    tasks = [_retrieve_one(i, item, semaphore) for i, item in enumerate(request.requests)]
+    results = await asyncio.gather(*tasks)
+    return RetrieveBatchResponse(results=results)
+
+
+async def stream_retrieve_batch(request: RetrieveBatchRequest):
+    """批量检索的NDJSON流式版本，每完成一个检索就输出一行，用index对应输入顺序"""
+    semaphore = asyncio.Semaphore(_concurrency(request))
+    tasks = [asyncio.ensure_future(_retrieve_one(i, item, semaphore)) for i, item in enumerate(request.requests)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            item = await task
+            yield item.model_dump_json() + '\n'
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+from utils.bailian import rate_limit_stats
+from utils.metrics import histograms_snapshot
+
+
+class RateLimitStatsResponse(BaseModel):
+    apis: Optional[List[Dict]] = None
+
+
+class MetricsResponse(BaseModel):
+    histograms: Optional[List[Dict]] = None
+
+
+def get_rate_limit_stats():
+    return RateLimitStatsResponse(apis=rate_limit_stats())
+
+
+def get_metrics():
+    return MetricsResponse(histograms=histograms_snapshot())
@@ -1 +1,2 @@
-ENV=uat nohup python main.py >output/run.log 2>&1 &
\ No newline at end of file
+ENV=uat nohup python main.py >output/run.log 2>&1 &
+ENV=uat nohup python worker.py >output/worker.log 2>&1 & echo $! >output/worker.pid
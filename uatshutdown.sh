@@ -10,4 +10,15 @@ if [ -n "$pid" ]; then
     echo "Application stopped."
 else
     echo "No process found listening on port 8471."
-fi
\ No newline at end of file
+fi
+
+# 停止入库worker，SIGTERM后worker等待在途任务结束，未完成的任务放回队列
+if [ -f output/worker.pid ]; then
+    worker_pid=$(cat output/worker.pid)
+    echo "Stopping worker with PID $worker_pid..."
+    kill $worker_pid
+    rm -f output/worker.pid
+    echo "Worker stopped."
+else
+    echo "No worker pid file found."
+fi
@@ -0,0 +1,98 @@
+import os
+import tarfile
+import zipfile
+from utils.config import config
+from utils.files_utils import FileContent, SkippedFile, get_index_path, copy_stream
+
+archive_config = config.get('archive', {})
+ALLOWED_EXTENSIONS = tuple(archive_config.get('allowed_extensions', ['.pdf', '.docx', '.doc', '.txt', '.md']))
+# 防止压缩炸弹：条目数和解压后总大小上限
+MAX_ENTRIES = archive_config.get('max_entries', 10000)
+MAX_TOTAL_SIZE = archive_config.get('max_total_size', 2 * 1024 * 1024 * 1024)
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar.gz', '.tgz', '.tar')
+
+
+def is_archive(filename):
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _zip_name(info):
+    """没有设置UTF-8标记的zip条目名按cp437解码，Windows下中文文件名实际是GBK"""
+    if info.flag_bits & 0x800:
+        return info.filename
+    raw = info.filename.encode('cp437')
+    for encoding in ('utf-8', 'gbk'):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return info.filename
+
+
+class _Extractor:
+    def __init__(self, index_id, archive_name):
+        self.root = get_index_path(index_id)
+        self.archive_name = archive_name
+        self.files = []
+        self.skipped = []
+        self.entries = 0
+        self.total_size = 0
+
+    def accept(self, name):
+        """过滤目录、隐藏文件和不支持的类型，返回入库使用的文件名"""
+        self.entries += 1
+        if self.entries > MAX_ENTRIES:
+            raise ValueError(f'too many entries in archive: {self.archive_name}, max: {MAX_ENTRIES}')
+        base_name = os.path.basename(name.rstrip('/'))
+        if not base_name or name.startswith('__MACOSX/') or base_name.startswith('.'):
+            return None
+        if not base_name.lower().endswith(ALLOWED_EXTENSIONS):
+            self.skipped.append(SkippedFile(name=name, reason=f'unsupported file type, allowed: {ALLOWED_EXTENSIONS}'))
+            return None
+        return base_name
+
+    def extract(self, name, base_name, stream):
+        # 每个条目放在按序号命名的子文件夹，不同目录下的同名文件互不覆盖，也不会写到文件夹之外
+        entry_dir = os.path.join(self.root, str(self.entries))
+        os.makedirs(entry_dir, exist_ok=True)
+        files_path = os.path.join(entry_dir, base_name)
+        size, md5 = copy_stream(stream, files_path, max_size=MAX_TOTAL_SIZE - self.total_size)
+        self.total_size += size
+        if size == 0:
+            os.remove(files_path)
+            self.skipped.append(SkippedFile(name=name, reason='empty file'))
+            return
+        self.files.append(FileContent(name=base_name, path=files_path, size=size, md5=md5))
+
+
+def extract_archive(index_id, archive_name, stream):
+    """
+    把zip/tar/tar.gz逐个条目流式解压到index_id命名的文件夹（同一次上传有多个压缩包时每个压缩包各用一个），边解压边计算MD5，不把压缩包整体读进内存。
+    zip需要可seek的stream（UploadFile.file是落盘的临时文件），tar按流式模式读取。
+    :return: (FileContent列表, SkippedFile列表)
+    """
+    extractor = _Extractor(index_id, archive_name)
+    if archive_name.lower().endswith('.zip'):
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                name = _zip_name(info)
+                base_name = extractor.accept(name)
+                if base_name is None:
+                    continue
+                with archive.open(info) as entry:
+                    extractor.extract(name, base_name, entry)
+    else:
+        mode = 'r|' if archive_name.lower().endswith('.tar') else 'r|gz'
+        with tarfile.open(fileobj=stream, mode=mode) as archive:
+            for member in archive:
+                # 只解压普通文件，跳过目录、链接和设备文件
+                if not member.isfile():
+                    continue
+                base_name = extractor.accept(member.name)
+                if base_name is None:
+                    continue
+                extractor.extract(member.name, base_name, archive.extractfile(member))
+    return extractor.files, extractor.skipped
@@ -4,17 +4,40 @@ from alibabacloud_tea_util import models as util_models
 from alibabacloud_bailian20231229 import models as bailian_20231229_models
 from utils.security import decrypt
 from utils.config import config
-from utils.files_utils import save_file_to_index_path, calculate_md5, read_file
+from utils.files_utils import calculate_md5
 from utils.log import log
+from utils.cache import invalidate_index
+from utils.rate_limit import RateLimiter
+from utils.upload import create_upload_session, put_file
 import os, time
 from data.task import StoreTaskEntity, FileTaskEntity, TaskStatus
+from data.file import FileRegistryEntity
+from data.database import session_scope
+from sqlalchemy.exc import IntegrityError
 import traceback
-import requests
 import concurrent
+import requests
+from Tea.exceptions import TeaException, UnretryableException
+import asyncio
+import functools
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 
 MAX_PAGE_SIZE = 100
 
+bailian_config = config.get('bailian', {})
+# SDK按host缓存keep-alive连接，连接池大小即同时在途的请求数
+POOL_SIZE = bailian_config.get('pool_size', 16)
+
+
+@functools.lru_cache(maxsize=1)
+def get_credentials():
+    """解密AK&SK，进程内只解密一次"""
+    return decrypt(config['ak']), decrypt(config['sk'])
+
 
 def create_client() -> bailian20231229Client:
     """
@@ -22,9 +45,11 @@ def create_client() -> bailian20231229Client:
     @return: Client
     @throws Exception
     """
+    access_key_id, access_key_secret = get_credentials()
     client_config = open_api_models.Config(
-        access_key_id=decrypt(config['ak']),
-        access_key_secret=decrypt(config['sk'])
+        access_key_id=access_key_id,
+        access_key_secret=access_key_secret,
+        max_idle_conns=POOL_SIZE
     )
     # Endpoint 请参考 https://api.aliyun.com/product/bailian
     client_config.endpoint = 'bailian.cn-beijing.aliyuncs.com'
@@ -32,9 +57,65 @@ def create_client() -> bailian20231229Client:
 
 
 workspace_id = config['workspace_id']
-runtime = util_models.RuntimeOptions()
+runtime = util_models.RuntimeOptions(
+    keep_alive=True,
+    max_idle_conns=POOL_SIZE,
+    connect_timeout=bailian_config.get('connect_timeout', 5000),
+    read_timeout=bailian_config.get('read_timeout', 10000)
+)
 headers = {}
+# 所有百炼接口调用前都要先取令牌，按接口分别限流，线程和事件循环共用
+limiter = RateLimiter(config.get('rate_limit'))
+# 进程内共享的client，同步和异步调用都用它
 client = create_client()
+# SDK的*_async方法每次调用都会新建aiohttp连接，检索改为在单独的线程池里执行同步方法，复用keep-alive连接；
+# 线程池容纳对冲请求和超时后仍在执行的调用
+retrieve_executor = ThreadPoolExecutor(max_workers=bailian_config.get('retrieve_pool_size', POOL_SIZE * 2),
+                                       thread_name_prefix='bailian-retrieve')
+
+ingest_config = config.get('ingest', {})
+# 文件入库分为 lease（申请上传租约）、upload（PUT到OSS）、register（AddFile）三个阶段，
+# 每个阶段单独限制并发，不同文件的不同阶段可以同时进行；百炼接口的QPS仍由limiter控制
+INGEST_CONCURRENCY = {
+    'lease': ingest_config.get('lease_concurrency', 4),
+    'upload': ingest_config.get('upload_concurrency', 8),
+    'register': ingest_config.get('register_concurrency', 4),
+}
+INGEST_STAGES = {stage: threading.BoundedSemaphore(n) for stage, n in INGEST_CONCURRENCY.items()}
+# 线程数等于各阶段并发之和，保证每个阶段都能跑满
+ingest_executor = ThreadPoolExecutor(max_workers=sum(INGEST_CONCURRENCY.values()), thread_name_prefix='ingest')
+# PUT到OSS共用一个Session，上传阶段的各线程复用keep-alive连接
+upload_session = create_upload_session(INGEST_CONCURRENCY['upload'])
+UPLOAD_TIMEOUT = (ingest_config.get('upload_connect_timeout', 5), ingest_config.get('upload_read_timeout', 300))
+
+
+def _retrieve_with_latency(retrieve_request, options, on_latency):
+    start_time = time.monotonic()
+    try:
+        return client.retrieve_with_options(workspace_id, retrieve_request, headers, options)
+    finally:
+        if on_latency is not None:
+            on_latency(time.monotonic() - start_time)
+
+
+async def retrieve_async(retrieve_request, timeout=None, on_latency=None):
+    """
+    检索在单独的线程池里执行：超时或对冲后被放弃的调用仍占着线程直到SDK返回，不能挤占其他百炼调用。
+    timeout（秒）同时作为这次调用的read_timeout，被放弃的调用最多再占用线程timeout秒。
+    on_latency(seconds)在线程里回调，只含SDK调用本身的耗时，不含排队时间，被放弃和超时的调用也会回调。
+    """
+    await limiter.acquire_async('Retrieve')
+    options = runtime
+    if timeout is not None:
+        options = util_models.RuntimeOptions(
+            keep_alive=True,
+            max_idle_conns=POOL_SIZE,
+            connect_timeout=runtime.connect_timeout,
+            read_timeout=max(1, min(runtime.read_timeout, int(timeout * 1000)))
+        )
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieve_executor,
+                                      functools.partial(_retrieve_with_latency, retrieve_request, options, on_latency))
 
 
 def create_index(name, chunk_size, overlap_size, separator):
@@ -68,6 +149,7 @@ def create_index(name, chunk_size, overlap_size, separator):
     create_index_request = bailian_20231229_models.CreateIndexRequest(
         **params
     )
+    limiter.acquire('CreateIndex')
     result = client.create_index_with_options(workspace_id, create_index_request, headers, runtime)
     if result.status_code != 200 or not result.body.success:
         raise RuntimeError(result.body)
@@ -81,6 +163,7 @@ def update_index(index_id, file_ids):
         source_type='DATA_CENTER_FILE',
         document_ids=file_ids
     )
+    limiter.acquire('SubmitIndexAddDocumentsJob')
     result = client.submit_index_add_documents_job_with_options(workspace_id, submit_index_job_request, headers, runtime)
     if result.status_code != 200 or not result.body.success:
         raise RuntimeError(result.body)
@@ -93,21 +176,22 @@ def get_index_result(index_id, job_id):
         job_id=job_id,
         index_id=index_id
     )
+    limiter.acquire('GetIndexJobStatus')
     result = client.get_index_job_status_with_options(workspace_id, get_index_job_status_request, headers, runtime)
     if result.status_code != 200 or not result.body.success:
         raise RuntimeError(result.body)
     return result
 
-def add_file_lease(task_id, category_id, file_name, file_content):
-    file_name = file_name
-    file_path = save_file_to_index_path(task_id, file_name, file_content)
-    md_5 = calculate_md5(file_path)
-    size_in_bytes = str(os.path.getsize(file_path))
+def add_file_lease(category_id, file):
+    """file为已落盘的FileContent，路由层落盘时已算好MD5和大小"""
+    md_5 = file.md5 or calculate_md5(file.path)
+    size_in_bytes = str(file.size)
     apply_file_upload_lease_request = bailian_20231229_models.ApplyFileUploadLeaseRequest(
-        file_name=file_name,
+        file_name=file.name,
         md_5=md_5,
         size_in_bytes=size_in_bytes
     )
+    limiter.acquire('ApplyFileUploadLease')
     result = client.apply_file_upload_lease_with_options(category_id, workspace_id,
                                                          apply_file_upload_lease_request,
                                                          headers,
@@ -117,15 +201,19 @@ def add_file_lease(task_id, category_id, file_name, file_content):
     lease_id = result.body.data.file_upload_lease_id
     url = result.body.data.param.url
     upload_file_headers = result.body.data.param.headers
-    return lease_id, url, upload_file_headers, file_path
+    return lease_id, url, upload_file_headers
 
 
 def upload_file(file_path, url, upload_file_headers):
-    file_content = read_file(file_path)
-    response = requests.put(url, data=file_content, headers=upload_file_headers)
-    if response.status_code != 200 or not response.ok:
-        raise RuntimeError(f'Exception for upload_file: {file_path}, url: {url}, response: {response.status_code}'
-                           f' {response.text}')
+    response = put_file(upload_session, file_path, url, upload_file_headers, UPLOAD_TIMEOUT,
+                        ingest_config.get('io_buffer_size', 1024 * 1024))
+    if response.status_code == 200 and response.ok:
+        return
+    error = f'Exception for upload_file: {file_path}, url: {url}, response: {response.status_code} {response.text}'
+    # OSS服务端错误和上传租约（预签名URL）过期可以重新申请租约重试；签名、参数等其他错误重试也不会成功
+    if response.status_code >= 500 or (response.status_code == 403 and 'expired' in response.text.lower()):
+        raise TransientError(error)
+    raise RuntimeError(error)
 
 
 def add_file(category_id, lease_id):
@@ -134,6 +222,7 @@ def add_file(category_id, lease_id):
         parser='DASHSCOPE_DOCMIND',
         category_id=category_id
     )
+    limiter.acquire('AddFile')
     result = client.add_file_with_options(workspace_id, add_file_request, headers, runtime)
     if result.status_code != 200 or not result.body.success:
         raise RuntimeError(result.body)
@@ -142,7 +231,11 @@ def add_file(category_id, lease_id):
 
 
 def add_store(task_id, name, chunk_size, overlap_size, separator):
-    task = StoreTaskEntity.create(task_id=task_id, status=TaskStatus.RUNNING)
+    task = StoreTaskEntity.get_or_create(task_id=task_id)
+    if task.index_id:
+        # 任务重试时知识库已创建，直接继续
+        return task
+    task.set(status=TaskStatus.RUNNING)
     try:
         index_id = create_index(name, chunk_size, overlap_size, separator)
         task.set(index_id=index_id)
@@ -155,74 +248,324 @@ def add_store(task_id, name, chunk_size, overlap_size, separator):
         return None
 
 
-def add_files(task_id, index_id, files):
+def find_registered_file(md5, size):
+    """相同内容已上传且解析没有失败时返回已有的file_id"""
+    for entity in FileRegistryEntity.query_all(workspace_id=workspace_id, md5=md5, size=size):
+        if entity.file_id and entity.status != TaskStatus.FAILED:
+            return entity.file_id
+    return None
+
+
+def register_file(md5, size, file_id):
+    """
+    (workspace_id, md5, size)唯一：多个任务同时上传相同内容时，插入冲突的一方改为更新，
+    和已有记录一样以最后上传的file_id为准。
+    """
+    values = {FileRegistryEntity.file_id: file_id, FileRegistryEntity.status: TaskStatus.RUNNING}
+    with session_scope() as session:
+        def update():
+            return session.query(FileRegistryEntity).filter(
+                FileRegistryEntity.workspace_id == workspace_id,
+                FileRegistryEntity.md5 == md5,
+                FileRegistryEntity.size == size
+            ).update(values, synchronize_session=False)
+
+        if not update():
+            session.add(FileRegistryEntity(workspace_id=workspace_id, md5=md5, size=size, file_id=file_id,
+                                           status=TaskStatus.RUNNING))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            log.info(f'register_file conflict, md5: {md5}, size: {size}, file_id: {file_id}')
+            update()
+            session.commit()
+
+
+def registered_files(file_ids):
+    """批量查询file_id对应的 (md5, size)，没有本地记录的file_id不在结果里"""
+    if not file_ids:
+        return {}
+    with session_scope() as session:
+        rows = session.query(FileRegistryEntity.file_id, FileRegistryEntity.md5, FileRegistryEntity.size).filter(
+            FileRegistryEntity.workspace_id == workspace_id,
+            FileRegistryEntity.file_id.in_(list(file_ids))
+        ).all()
+        return {file_id: (md5, size) for file_id, md5, size in rows}
+    return {}
+
+
+def update_registered_file_statuses(statuses):
+    """statuses为 {file_id: 解析状态}，按状态分组批量更新"""
+    groups = {}
+    for file_id, status in statuses.items():
+        groups.setdefault(status, []).append(file_id)
+    with session_scope() as session:
+        for status, file_ids in groups.items():
+            session.query(FileRegistryEntity).filter(
+                FileRegistryEntity.workspace_id == workspace_id,
+                FileRegistryEntity.file_id.in_(file_ids),
+                FileRegistryEntity.status != status
+            ).update({FileRegistryEntity.status: status}, synchronize_session=False)
+        session.commit()
+
+
+def unregister_file(file_id):
+    for entity in FileRegistryEntity.query_all(workspace_id=workspace_id, file_id=file_id):
+        entity.delete()
+
+
+def is_file_shared(file_id, index_id):
+    """
+    去重后同一个file_id可能被多个知识库引用，判断除index_id外是否还有知识库在用。
+    排队中和入库中的任务可能已经复用了这个file_id，也要算作引用；
+    失败的任务和文件不算，知识库或文档删除后任务和文件记录标记为DELETED，也不再计入。
+    """
+    with session_scope() as session:
+        row = session.query(FileTaskEntity.id).join(
+            StoreTaskEntity, StoreTaskEntity.task_id == FileTaskEntity.task_id
+        ).filter(
+            FileTaskEntity.doc_id == file_id,
+            FileTaskEntity.status.notin_((TaskStatus.DELETED, TaskStatus.FAILED)),
+            StoreTaskEntity.index_id != index_id,
+            StoreTaskEntity.status.notin_((TaskStatus.DELETED, TaskStatus.FAILED))
+        ).first()
+        return row is not None
+    # 查询失败时当作仍被引用，宁可留下文件也不误删
+    return True
+
+
+def mark_documents_deleted(index_id, file_ids):
+    """文档从知识库删除后，把该知识库任务里对应的文件记录标记为DELETED"""
+    if not file_ids:
+        return
+    with session_scope() as session:
+        task_ids = session.query(StoreTaskEntity.task_id).filter(StoreTaskEntity.index_id == index_id)
+        session.query(FileTaskEntity).filter(
+            FileTaskEntity.task_id.in_(task_ids),
+            FileTaskEntity.doc_id.in_(list(file_ids))
+        ).update({FileTaskEntity.status: TaskStatus.DELETED}, synchronize_session=False)
+        session.commit()
+
+
+def mark_store_deleted(index_id):
+    """知识库删除后，它的任务不再算作对文件的引用"""
+    with session_scope() as session:
+        session.query(StoreTaskEntity).filter(StoreTaskEntity.index_id == index_id).update(
+            {StoreTaskEntity.status: TaskStatus.DELETED}, synchronize_session=False)
+        session.commit()
+
+
+def record_skipped_files(task_id, skipped):
+    """压缩包里被跳过的条目也记一条FileTaskEntity，task_status里可以看到每个条目的状态；一个事务批量写入"""
+    if not skipped:
+        return
+    with session_scope() as session:
+        # 按列宽截断，跳过原因（如允许的扩展名列表）可能超过message的长度
+        session.add_all([FileTaskEntity(task_id=task_id, status=TaskStatus.FAILED,
+                                        doc_name=file.name.split('.')[0][:128], message=file.reason[:50])
+                         for file in skipped])
+        session.commit()
+
+
+class TransientError(RuntimeError):
+    """稍后重试可能成功的错误，如OSS返回5xx或上传租约过期"""
+
+
+def is_transient_error(e):
+    """网络错误、超时、限流和服务端5xx可以重试；参数错误、文件格式不支持、本地文件读不到等重试也不会成功"""
+    if isinstance(e, UnretryableException) and e.inner_exception is not None:
+        # SDK把网络异常包装成UnretryableException
+        e = e.inner_exception
+    if isinstance(e, (TransientError, requests.RequestException, TimeoutError, ConnectionError)):
+        return True
+    if isinstance(e, TeaException):
+        status = getattr(e, 'statusCode', None)
+        return status is None or status == 429 or status >= 500 or 'Throttling' in (e.code or '')
+    return False
+
+
+def _ingest_file(task, category_id, file, force_reupload=False, retry_failed=False, lease=None):
+    """
+    单个文件依次经过lease、upload、register三个阶段，失败只影响该文件，返回 (file_id或None, 是否需要重试)。
+    相同内容已上传过且force_reupload为False时直接复用已有的file_id。队列任务的租约已丢失时不再开始上传。
+    retry_failed为True时可重试的失败标记为PENDING，任务重试时重新上传；其余失败标记为FAILED，任务重试时跳过。
+    """
+    if lease is not None and lease.lost:
+        return None, False
+    file_task = FileTaskEntity.query_first(task_id=task.task_id, local_path=file.path)
+    if file_task is None:
+        file_task = FileTaskEntity.create(task_id=task.task_id, status=TaskStatus.RUNNING,
+                                          doc_name=file.name.split('.')[0], local_path=file.path)
+    elif file_task.doc_id:
+        # 任务重试时已注册的文件不再重复上传
+        return file_task.doc_id, False
+    elif file_task.status == TaskStatus.FAILED:
+        # 上一次执行时已确定重试也不会成功
+        return None, False
+    else:
+        file_task.set(status=TaskStatus.RUNNING, message=None)
+    try:
+        if file.md5 is None:
+            file.md5 = calculate_md5(file.path)
+        if not force_reupload:
+            file_id = find_registered_file(file.md5, file.size)
+            if file_id is not None:
+                log.info(f'add_files reuse registered file, task_id: {task.task_id}, file_name: {file.name}, '
+                         f'file_id: {file_id}')
+                file_task.set(doc_id=file_id)
+                return file_id, False
+        with INGEST_STAGES['lease']:
+            lease_id, url, upload_file_headers = add_file_lease(category_id, file)
+        with INGEST_STAGES['upload']:
+            upload_file(file.path, url, upload_file_headers)
+        with INGEST_STAGES['register']:
+            file_id = add_file(category_id, lease_id)
+        file_task.set(doc_id=file_id)
+        register_file(file.md5, file.size, file_id)
+        return file_id, False
+    except Exception as e:
+        trace_info = traceback.format_exc()
+        retry = retry_failed and is_transient_error(e)
+        file_task.set(status=TaskStatus.PENDING if retry else TaskStatus.FAILED,
+                      message=f'Exception for add_files, task_id: {task.task_id},  id: {task.index_id}, file_name: '
+                              f'{file.name}, e: {e}'
+                              f', trace: {trace_info}')
+        return None, retry
+
+
+def ingest_files(task_id, index_id, files, force_reupload=False, retry_failed=False, lease=None):
+    """
+    上传并注册一个任务的文件，返回需要提交update_index的file_id（同一任务里内容相同的只保留一个）。
+    任务已提交过update_index、没有文件或文件全部失败时返回None，后两种情况直接结束任务。
+    retry_failed为True时（队列任务还有重试次数），有文件可重试地失败（网络、限流、5xx）就抛出异常等待重试；
+    重试时已注册的文件直接复用，确定重试也不会成功的文件不再重试。
+    """
     category_id = config['parent_category_id']
     task = StoreTaskEntity.get_or_create(task_id=task_id, index_id=index_id)
+    if task.job_id:
+        # 任务重试时update_index已提交
+        return None
+    if not files:
+        task.set(status=TaskStatus.COMPLETED)
+        return None
     task.set(status=TaskStatus.RUNNING)
-    if files:
-        file_ids = []
-        for file in files:
-            file_task = FileTaskEntity.create(task_id=task.task_id, status=TaskStatus.RUNNING, doc_name=file.name.split('.')[0])
-            try:
-                lease_id, url, upload_file_headers, file_path = add_file_lease(task.task_id, category_id,
-                                                                               file.name, file.file_content)
-                file_task.set(local_path=file_path)
-                upload_file(file_path, url, upload_file_headers)
-                file_id = add_file(category_id, lease_id)
-                file_task.set(doc_id=file_id)
-                file_ids.append(file_id)
-            except Exception as e:
-                trace_info = traceback.format_exc()
-                file_task.set(status=TaskStatus.FAILED,
-                         message=f'Exception for add_files, task_id: {task.task_id},  id: {task.index_id}, file_name: '
-                                 f'{file.name}, e: {e}'
-                                 f', trace: {trace_info}')
+    futures = [ingest_executor.submit(_ingest_file, task, category_id, file, force_reupload, retry_failed, lease)
+               for file in files]
+    results = [future.result() for future in futures]
+    if lease is not None:
+        lease.check()
+    retrying = sum(1 for _, retry in results if retry)
+    if retrying:
+        raise RuntimeError(f'{retrying} of {len(files)} files failed and will be retried in add_files, '
+                           f'task_id: {task_id}')
+    file_ids = list(dict.fromkeys(file_id for file_id, _ in results if file_id is not None))
+    if not file_ids:
+        task.set(status=TaskStatus.FAILED, message=f'All {len(files)} files failed')
+        return None
+    return file_ids
+
+
+def submit_files(index_id, task_file_ids, lease=None):
+    """
+    task_file_ids为 [(task_id, file_ids)]：同一知识库的多个任务合并提交一个update_index，所有任务记录同一个job_id，
+    由Reconciler按job_id轮询一次更新所有任务。
+    lease为队列任务的租约，提交和写入job_id前确认租约仍属于当前worker，租约丢失时抛出异常，
+    由接手的worker继续，避免重复提交。
+    """
+    task_ids = [task_id for task_id, _ in task_file_ids]
+    file_ids = list(dict.fromkeys(itertools.chain.from_iterable(file_ids for _, file_ids in task_file_ids)))
+    if lease is not None:
+        lease.check()
+    job_id = update_index(index_id, file_ids)
+    if lease is not None:
         try:
-            job_id = update_index(task.index_id, file_ids)
-            task.set(job_id=job_id)
-        except Exception as e:
-            trace_info = traceback.format_exc()
-            task.set(status=TaskStatus.FAILED,
-                     message=f'Exception for add_files, task_id: {task.task_id},  index_id: {index_id}, e: {e}, '
-                             f'trace: {trace_info}')
-    else:
-        task.set(status=TaskStatus.COMPLETED)
+            lease.check()
+        except Exception:
+            log.warning(f'add_files lease lost after submit, task_ids: {task_ids}, job_id: {job_id}')
+            raise
+    with session_scope() as session:
+        session.query(StoreTaskEntity).filter(
+            StoreTaskEntity.task_id.in_(task_ids),
+            StoreTaskEntity.job_id.is_(None)
+        ).update({StoreTaskEntity.job_id: job_id}, synchronize_session=False)
+        session.commit()
+    log.info(f'add_files submitted, index_id: {index_id}, task_ids: {task_ids}, files: {len(file_ids)}, '
+             f'job_id: {job_id}')
+    invalidate_index(index_id)
+    return job_id
 
 
-def list_file(index_id, file_name):
+def add_files(task_id, index_id, files, force_reupload=False, retry_failed=False, lease=None):
+    """上传一个任务的文件并单独提交update_index，参数同ingest_files"""
+    file_ids = ingest_files(task_id, index_id, files, force_reupload, retry_failed, lease)
+    if file_ids:
+        submit_files(index_id, [(task_id, file_ids)], lease)
+
+
+LIST_CONCURRENCY = bailian_config.get('list_concurrency', 4)
+LIST_RETRIES = bailian_config.get('list_retries', 3)
+LIST_RETRY_BACKOFF = bailian_config.get('list_retry_backoff', 0.5)
+# 分页查询单独用一个线程池，调用方本身在共享线程池里执行时也不会互相等待
+list_executor = ThreadPoolExecutor(max_workers=LIST_CONCURRENCY, thread_name_prefix='bailian-list')
+
+
+def _list_page(index_id, file_name, page):
+    """查询一页文档，失败按退避时间重试，重试用完仍失败时抛出异常"""
     params = {
-        "index_id": index_id,
-        "page_size": MAX_PAGE_SIZE
+        'index_id': index_id,
+        'page_size': MAX_PAGE_SIZE,
+        'page_number': page
     }
     if file_name is not None:
-        params["document_name"] = file_name
-    list_index_documents_request = bailian_20231229_models.ListIndexDocumentsRequest(**params)
-    result = client.list_index_documents_with_options(workspace_id, list_index_documents_request, headers, runtime)
-    if result.status_code != 200 or not result.body.success:
-        raise RuntimeError(result.body)
-    total_count = result.body.data.total_count
-    total_pages = (total_count + MAX_PAGE_SIZE - 1) // MAX_PAGE_SIZE  # 向上取整
-    all_files = []
-    for page in range(1, total_pages + 1):
-        params = {
-            "index_id": index_id,
-            "page_size": MAX_PAGE_SIZE,
-            "page_number": page  # 添加页码参数
-        }
+        params['document_name'] = file_name
+    request = bailian_20231229_models.ListIndexDocumentsRequest(**params)
+    error = None
+    for attempt in range(LIST_RETRIES + 1):
+        if attempt:
+            time.sleep(LIST_RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            limiter.acquire('ListIndexDocuments')
+            result = client.list_index_documents_with_options(workspace_id, request, headers, runtime)
+            if result.status_code == 200 and result.body.success:
+                return result.body.data
+            error = result.body
+        except Exception as e:
+            error = e
+        log.warning(f'list_index_documents failed, index_id: {index_id}, page: {page}, attempt: {attempt + 1}, '
+                    f'e: {error}')
+    raise RuntimeError(f'Exception for list_file, index_id: {index_id}, page: {page}, e: {error}')
 
-        if file_name is not None:
-            params["document_name"] = file_name
 
-        list_index_documents_request = bailian_20231229_models.ListIndexDocumentsRequest(**params)
-        result = client.list_index_documents_with_options(workspace_id, list_index_documents_request, headers, runtime)
+def iter_list_file(index_id, file_name=None):
+    """
+    按页返回知识库文档，不需要把整个知识库的文档列表放进内存。
+    第一页同时得到total_count，其余页在list_executor里并发查询（最多LIST_CONCURRENCY页在途），按页码顺序返回；
+    任何一页重试后仍失败都会抛出异常，不会返回不完整的结果。
+    """
+    first = _list_page(index_id, file_name, 1)
+    yield from first.documents or []
+    total_pages = (first.total_count + MAX_PAGE_SIZE - 1) // MAX_PAGE_SIZE  # 向上取整
+    pages = iter(range(2, total_pages + 1))
+    in_flight = deque()
+    try:
+        for page in itertools.islice(pages, LIST_CONCURRENCY):
+            in_flight.append(list_executor.submit(_list_page, index_id, file_name, page))
+        while in_flight:
+            data = in_flight.popleft().result()
+            page = next(pages, None)
+            if page is not None:
+                in_flight.append(list_executor.submit(_list_page, index_id, file_name, page))
+            yield from data.documents or []
+    finally:
+        # 调用方提前结束迭代或出错时取消还没开始的页
+        for future in in_flight:
+            future.cancel()
 
-        if result.status_code != 200 or not result.body.success:
-            continue
 
-        # 将当前页的数据添加到 all_files 列表中
-        all_files.extend(result.body.data.documents)
+def list_file(index_id, file_name):
+    return list(iter_list_file(index_id, file_name))
 
-    return all_files
 
 def list_file_batch(index_id, file_names):
     # 据阿里百炼 API/SDK 官方文档：
@@ -230,12 +573,11 @@ def list_file_batch(index_id, file_names):
     #   限流说明： 本接口频繁调用会被限流，频率请勿超过 15 次/秒。如遇限流，请稍后重试。
     #   https://next.api.aliyun.com/api/bailian/2023-12-29/ListIndexDocuments?tab=DOC
     #
-    # 本函数不应并发调用。为防限流，每调用 10 次接口，就 sleep(1)。
+    # 限流统一由 limiter 按 application.yml 中 rate_limit.ListIndexDocuments 控制。
     #
     # 理论上，查询一个 file_name 可能调用多次该接口，
     # 但实际应该极难遇到（一个 file_name 对应超过 MAX_PAGE_SIZE 个 documents）
 
-    api_cnt = 0
     all_files = []
     for file_name in file_names:
         page_no = 0
@@ -248,10 +590,8 @@ def list_file_batch(index_id, file_names):
                 'page_number': page_no
             }
             request = bailian_20231229_models.ListIndexDocumentsRequest(**params)
+            limiter.acquire('ListIndexDocuments')
             result = client.list_index_documents_with_options(workspace_id, request, headers, runtime)
-            api_cnt += 1
-            if api_cnt % 10 == 0:
-                time.sleep(1)
             if result.status_code != 200 or not result.body.success:
                 log.error(f'/vector/router/file/list_batch: list_index_document failed. params:{params}')
                 continue
@@ -276,6 +616,7 @@ def delete_store_files(index_id, document_ids):
             document_ids=batch_document_ids
         )
 
+        limiter.acquire('DeleteIndexDocument')
         result = client.delete_index_document_with_options(workspace_id, delete_index_document_request, headers,
                                                            runtime)
 
@@ -285,10 +626,14 @@ def delete_store_files(index_id, document_ids):
         # 假设 result.body.data.deleted_document 返回的是一个列表
         deleted_ids.extend(result.body.data.deleted_document)
 
+    if deleted_ids:
+        invalidate_index(index_id)
+        mark_documents_deleted(index_id, deleted_ids)
     return deleted_ids
 
 
 def delete_file(file_id):
+    limiter.acquire('DeleteFile')
     result = client.delete_file_with_options(file_id, workspace_id, headers, runtime)
     if result.status_code != 200 or not result.body.success:
         raise RuntimeError(result.body)
@@ -303,16 +648,22 @@ def list_store(name):
     list_indices_request = bailian_20231229_models.ListIndicesRequest(
         **params
     )
+    limiter.acquire('ListIndices')
     result = client.list_indices_with_options(workspace_id, list_indices_request, headers, runtime)
     if result.status_code != 200 or not result.body.success:
         raise RuntimeError(result.body)
     return result.body.data.indices
 
 
+def rate_limit_stats():
+    return limiter.stats()
+
+
 def delete_store(index_id):
     delete_index_request = bailian_20231229_models.DeleteIndexRequest(
         index_id=index_id
     )
+    limiter.acquire('DeleteIndex')
     result = client.delete_index_with_options(workspace_id, delete_index_request, headers, runtime)
     if result.status_code != 200 or not result.body.success:
         raise RuntimeError(result.body)
@@ -324,6 +675,8 @@ def delete_store_and_files(ids):
         try:
             file_ids = list_file(index_id, None)
             delete_store(index_id)
+            invalidate_index(index_id)
+            mark_store_deleted(index_id)
             deleted_ids.append(index_id)
             delete_store_files(index_id, file_ids)
         except Exception as e:
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from data.database import session_scope
+from data.index import IndexGenerationEntity
+from utils.config import config
+from utils.log import log
+
+
+def make_key(*parts):
+    """把任意可JSON序列化的参数拼成定长的缓存key"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class Cache(ABC):
+    """缓存基类，值统一为字符串，tags用于按index等维度批量失效"""
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # 命中计数在线程池里并发更新，和MemoryCache的数据共用一把锁
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'name': self.name,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+        }
+
+    @abstractmethod
+    def _get(self, key):
+        pass
+
+    @abstractmethod
+    def set(self, key, value, tags=()):
+        pass
+
+    @abstractmethod
+    def invalidate(self, tag):
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+
+class MemoryCache(Cache):
+    """进程内LRU缓存，按条数和字节数双重限制，过期时间为ttl秒"""
+
+    def __init__(self, name, ttl, max_entries, max_bytes):
+        super().__init__(name, ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expire_at, value, tags)
+        self._tags = {}  # tag -> set(key)
+        self._bytes = 0
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+            self._bytes += len(value)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def stats(self):
+        result = super().stats()
+        with self._lock:
+            result.update(backend='memory', entries=len(self._entries), bytes=self._bytes)
+        return result
+
+    def _remove(self, key):
+        _, value, tags = self._entries.pop(key)
+        self._bytes -= len(value)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache(Cache):
+    """Redis兼容的共享缓存，多个worker共用；内存上限和LRU淘汰交给Redis的maxmemory-policy"""
+
+    def __init__(self, name, ttl, redis_url):
+        super().__init__(name, ttl)
+        import redis
+        self._redis = redis.Redis.from_url(redis_url, decode_responses=True)
+        self._prefix = f"{config['project_name']}:{config['env']}:{name}"
+
+    def _get(self, key):
+        try:
+            return self._redis.get(f'{self._prefix}:{key}')
+        except Exception as e:
+            log.error(f'Exception for redis cache get, cache: {self.name}, e: {e}')
+            return None
+
+    def set(self, key, value, tags=()):
+        full_key = f'{self._prefix}:{key}'
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.set(full_key, value, ex=self.ttl)
+            for tag in tags:
+                tag_key = f'{self._prefix}:tag:{tag}'
+                pipe.sadd(tag_key, full_key)
+                pipe.expire(tag_key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            log.error(f'Exception for redis cache set, cache: {self.name}, e: {e}')
+
+    def invalidate(self, tag):
+        tag_key = f'{self._prefix}:tag:{tag}'
+        try:
+            keys = self._redis.smembers(tag_key)
+            self._redis.delete(tag_key, *keys)
+        except Exception as e:
+            log.error(f'Exception for redis cache invalidate, cache: {self.name}, tag: {tag}, e: {e}')
+
+    def clear(self):
+        try:
+            keys = list(self._redis.scan_iter(f'{self._prefix}:*'))
+            if keys:
+                self._redis.delete(*keys)
+        except Exception as e:
+            log.error(f'Exception for redis cache clear, cache: {self.name}, e: {e}')
+
+    def stats(self):
+        result = super().stats()
+        result.update(backend='redis')
+        return result
+
+
+def create_cache(name):
+    """根据application.yml中同名配置创建缓存，未启用时返回None"""
+    cache_config = config.get(name, {})
+    if not cache_config.get('enabled', False):
+        return None
+    ttl = cache_config.get('ttl', 300)
+    if cache_config.get('backend', 'memory') == 'redis':
+        return RedisCache(name, ttl, cache_config['redis_url'])
+    return MemoryCache(name, ttl, cache_config.get('max_entries', 10000),
+                       cache_config.get('max_bytes', 64 * 1024 * 1024))
+
+
+retrieve_cache = create_cache('retrieve_cache')
+# 本进程缓存index代数的时间（秒），其他进程（如worker）的失效最多延迟这么久生效
+GENERATION_TTL = config.get('retrieve_cache', {}).get('generation_ttl', 1)
+_generations = {}  # index_id -> (expire_at, generation)
+_generations_lock = threading.Lock()
+
+
+def index_generations(index_ids):
+    """
+    批量查询index的代数，用在检索缓存的key里，没有记录的index代数为0。
+    查询数据库失败的index不在结果里，调用方不读写这些index的缓存。
+    """
+    now = time.monotonic()
+    result = {}
+    missing = []
+    with _generations_lock:
+        for index_id in index_ids:
+            entry = _generations.get(index_id)
+            if entry is not None and entry[0] > now:
+                result[index_id] = entry[1]
+            else:
+                missing.append(index_id)
+    if not missing:
+        return result
+    rows = None
+    with session_scope() as session:
+        rows = session.query(IndexGenerationEntity.index_id, IndexGenerationEntity.generation).filter(
+            IndexGenerationEntity.index_id.in_(missing)
+        ).all()
+    if rows is None:
+        log.error(f'Exception for index_generations, index_ids: {missing}')
+        return result
+    loaded = {index_id: 0 for index_id in missing}
+    loaded.update({index_id: generation for index_id, generation in rows})
+    with _generations_lock:
+        for index_id in [index_id for index_id, entry in _generations.items() if entry[0] <= now]:
+            del _generations[index_id]
+        for index_id, generation in loaded.items():
+            _generations[index_id] = (now + GENERATION_TTL, generation)
+    result.update(loaded)
+    return result
+
+
+def _bump_generation(index_id):
+    with session_scope() as session:
+        def update():
+            return session.query(IndexGenerationEntity).filter(IndexGenerationEntity.index_id == index_id).update(
+                {IndexGenerationEntity.generation: IndexGenerationEntity.generation + 1}, synchronize_session=False)
+
+        if not update():
+            session.add(IndexGenerationEntity(index_id=index_id, generation=1))
+        try:
+            session.commit()
+        except IntegrityError:
+            # 并发插入同一index时冲突的一方改为加一
+            session.rollback()
+            update()
+            session.commit()
+
+
+def invalidate_index(index_id):
+    """
+    知识库内容变化时，在数据库里把该index的代数加一，所有进程的检索缓存都不再命中旧条目；
+    本进程的缓存条目直接清掉。
+    """
+    _bump_generation(index_id)
+    with _generations_lock:
+        _generations.pop(index_id, None)
+    if retrieve_cache is not None:
+        retrieve_cache.invalidate(index_id)
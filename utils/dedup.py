@@ -0,0 +1,61 @@
+import re
+
+FINGERPRINT_BITS = 64
+_HASH_MASK = (1 << FINGERPRINT_BITS) - 1
+_IGNORED = re.compile(r'[\s\W_]+', re.UNICODE)
+
+
+def simhash(text, shingle_size=3):
+    """
+    计算文本的64位SimHash指纹。
+    去掉空白和标点后按字符切成shingle（中文不分词也能用），重复出现的shingle权重累加。
+    64个位的计数用按位切片的计数器（planes[i]保存所有位计数的第i个二进制位），
+    每个shingle只做几次64位的异或/与运算，不需要逐位循环。
+    指纹只在同一进程内比较，shingle哈希直接用内置hash（SipHash，按进程加盐）。
+    """
+    text = _IGNORED.sub('', text.lower())
+    total = max(1, len(text) - shingle_size + 1)
+    planes = []
+    for start in range(total):
+        carry = hash(text[start:start + shingle_size]) & _HASH_MASK
+        for i in range(len(planes)):
+            plane = planes[i]
+            planes[i] = plane ^ carry
+            carry &= plane
+            if not carry:
+                break
+        else:
+            if carry:
+                planes.append(carry)
+    # 逐位比较计数 > total // 2，即该位为1的加权次数超过一半
+    half = total // 2
+    greater, equal = 0, _HASH_MASK
+    for i in range(max(len(planes), half.bit_length()) - 1, -1, -1):
+        plane = planes[i] if i < len(planes) else 0
+        if half >> i & 1:
+            equal &= plane
+        else:
+            greater |= equal & plane
+            equal &= ~plane
+    return greater
+
+
+def similarity(a, b):
+    """两个指纹的相似度，1 - 汉明距离/64"""
+    return 1 - (a ^ b).bit_count() / FINGERPRINT_BITS
+
+
+def dedup_texts(texts, threshold=0.9, shingle_size=3):
+    """
+    去掉近似重复的文本，返回保留下来的下标。
+    texts需按优先级从高到低排列，重复时保留靠前（分数更高）的一份。
+    """
+    max_distance = int((1 - threshold) * FINGERPRINT_BITS)
+    kept = []
+    kept_fingerprints = []
+    for i, text in enumerate(texts):
+        fingerprint = simhash(text, shingle_size)
+        if all((fingerprint ^ other).bit_count() > max_distance for other in kept_fingerprints):
+            kept.append(i)
+            kept_fingerprints.append(fingerprint)
+    return kept
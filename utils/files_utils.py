@@ -5,31 +5,72 @@ import hashlib
 from pydantic import BaseModel
 from typing import Optional
 
+# 落盘和计算MD5时每次读写的字节数
+IO_BUFFER_SIZE = config.get('ingest', {}).get('io_buffer_size', 1024 * 1024)
+
 
 class FileContent(BaseModel):
+    """已落盘的上传文件，只携带路径和元数据，不在内存里保留文件内容"""
     name: str
-    file_content: bytes
+    path: str
+    size: int
+    md5: Optional[str] = None
+
+
+class SkippedFile(BaseModel):
+    """压缩包里没有入库的条目，如不支持的文件类型"""
+    name: str
+    reason: str
 
 
 class Document(BaseModel):
     doc_name: str
-    doc_id: str
+    # 上传失败或被跳过的文件没有doc_id
+    doc_id: Optional[str] = None
     status: str
     message: Optional[str] = None
 
 
-def save_file_to_index_path(index_id, filename, content):
-    """文件流转成File，保存到index_id命名的文件夹"""
+def get_index_path(index_id):
     file_path_root = os.path.join(os.path.dirname('__file__'), config['filestore_root_dir'])
     index_path = os.path.join(file_path_root, index_id)
-    if not os.path.exists(index_path):
-        os.makedirs(index_path)
-    files_path = os.path.join(index_path, filename)
+    # 多个文件并发落盘时目录可能已被其他线程创建
+    os.makedirs(index_path, exist_ok=True)
+    return index_path
+
+
+def save_file_to_index_path(index_id, filename, content):
+    """文件流转成File，保存到index_id命名的文件夹"""
+    files_path = os.path.join(get_index_path(index_id), filename)
     with open(files_path, 'wb') as file:
         file.write(content)
     return files_path
 
 
+def save_stream_to_index_path(index_id, filename, stream, chunk_size=IO_BUFFER_SIZE):
+    """
+    分块把文件流拷贝到index_id命名的文件夹，拷贝的同时计算MD5和大小，不把整个文件读进内存
+    :return: FileContent
+    """
+    files_path = os.path.join(get_index_path(index_id), os.path.basename(filename))
+    size, md5 = copy_stream(stream, files_path, chunk_size)
+    return FileContent(name=filename, path=files_path, size=size, md5=md5)
+
+
+def copy_stream(stream, files_path, chunk_size=IO_BUFFER_SIZE, max_size=None):
+    """分块拷贝文件流，返回 (大小, MD5)；超过max_size时抛出ValueError"""
+    md5_hash = hashlib.md5()
+    size = 0
+    with open(files_path, 'wb') as file:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise ValueError(f'file too large: {files_path}, max: {max_size}')
+            md5_hash.update(chunk)
+            file.write(chunk)
+    return size, md5_hash.hexdigest()
+
+
 def delete_file(file_path):
     """  
     删除指定路径的文件  
@@ -73,7 +114,7 @@ def calculate_md5(file_path):
         # 以二进制模式打开文件
         with open(file_path, "rb") as file:
             # 分块读取文件内容，防止大文件占用过多内存
-            for chunk in iter(lambda: file.read(4096), b""):
+            for chunk in iter(lambda: file.read(IO_BUFFER_SIZE), b""):
                 md5_hash.update(chunk)
 
         # 返回 MD5 哈希值
@@ -0,0 +1,351 @@
+import os
+import socket
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from data.database import session_scope
+from data.job import IngestJobEntity, JobStatus
+from data.task import StoreTaskEntity, TaskStatus
+from utils.config import config
+from utils.log import log
+
+job_queue_config = config.get('job_queue', {})
+LEASE_SECONDS = job_queue_config.get('lease_seconds', 60)
+MAX_ATTEMPTS = job_queue_config.get('max_attempts', 3)
+# 第n次失败后等待 backoff_base * 2^(n-1) 秒再重试，不超过backoff_max
+BACKOFF_BASE = job_queue_config.get('backoff_base', 10)
+BACKOFF_MAX = job_queue_config.get('backoff_max', 600)
+# 是否合并同一知识库排队中的添加文件任务，默认关闭，每个请求单独提交入库任务
+COALESCE = job_queue_config.get('coalesce', False)
+# 领取可合并的任务时，最多连同多少个相同batch_key的排队任务一起领取
+BATCH_SIZE = job_queue_config.get('batch_size', 20)
+
+
+def enqueue(job_type, task_id, payload, max_attempts=MAX_ATTEMPTS, batch_key=None):
+    return IngestJobEntity.create(job_type=job_type, task_id=task_id, payload=payload, status=JobStatus.PENDING,
+                                  attempts=0, max_attempts=max_attempts, run_after=datetime.now(),
+                                  batch_key=batch_key)
+
+
+def claim(worker_id, job_types, lease_seconds=LEASE_SECONDS):
+    """
+    领取一个可执行的任务：到期的PENDING任务，或租约已过期的RUNNING任务（worker进程退出后由其他worker接着执行）。
+    用attempts做乐观锁，多个worker同时领取同一任务时只有一个UPDATE生效，不依赖SELECT ... FOR UPDATE SKIP LOCKED。
+    租约过期时已用完重试次数的任务（如每次都让worker进程崩溃）不再领取，连同入库任务一起标记为FAILED。
+    """
+    now = datetime.now()
+    with session_scope() as session:
+        candidates = session.query(IngestJobEntity.id, IngestJobEntity.attempts, IngestJobEntity.max_attempts,
+                                   IngestJobEntity.status).filter(
+            IngestJobEntity.job_type.in_(job_types),
+            or_(and_(IngestJobEntity.status == JobStatus.PENDING, IngestJobEntity.run_after <= now),
+                and_(IngestJobEntity.status == JobStatus.RUNNING, IngestJobEntity.lease_expires < now))
+        ).order_by(IngestJobEntity.id).limit(10).all()
+        for job_id, attempts, max_attempts, status in candidates:
+            if status == JobStatus.RUNNING and attempts >= max_attempts:
+                _fail_expired(session, job_id, attempts, now)
+                continue
+            updated = session.query(IngestJobEntity).filter(
+                IngestJobEntity.id == job_id,
+                IngestJobEntity.attempts == attempts
+            ).update({
+                IngestJobEntity.status: JobStatus.RUNNING,
+                IngestJobEntity.attempts: attempts + 1,
+                IngestJobEntity.lease_owner: worker_id,
+                IngestJobEntity.lease_expires: now + timedelta(seconds=lease_seconds)
+            }, synchronize_session=False)
+            session.commit()
+            if updated:
+                job = session.get(IngestJobEntity, job_id)
+                session.expunge(job)
+                return job
+    return None
+
+
+def claim_batch(job, worker_id, limit, lease_seconds=LEASE_SECONDS):
+    """
+    领取与job相同job_type和batch_key、已到期的PENDING任务，最多limit个，和job一起执行。
+    只合并领取时已在排队的任务，不等待后续任务；同样用attempts做乐观锁，被其他worker抢先领取的跳过。
+    """
+    if not job.batch_key or limit <= 0:
+        return []
+    now = datetime.now()
+    jobs = []
+    with session_scope() as session:
+        candidates = session.query(IngestJobEntity.id, IngestJobEntity.attempts).filter(
+            IngestJobEntity.job_type == job.job_type,
+            IngestJobEntity.batch_key == job.batch_key,
+            IngestJobEntity.status == JobStatus.PENDING,
+            IngestJobEntity.run_after <= now,
+            IngestJobEntity.id != job.id
+        ).order_by(IngestJobEntity.id).limit(limit).all()
+        for job_id, attempts in candidates:
+            updated = session.query(IngestJobEntity).filter(
+                IngestJobEntity.id == job_id,
+                IngestJobEntity.attempts == attempts,
+                IngestJobEntity.status == JobStatus.PENDING
+            ).update({
+                IngestJobEntity.status: JobStatus.RUNNING,
+                IngestJobEntity.attempts: attempts + 1,
+                IngestJobEntity.lease_owner: worker_id,
+                IngestJobEntity.lease_expires: now + timedelta(seconds=lease_seconds)
+            }, synchronize_session=False)
+            session.commit()
+            if updated:
+                sibling = session.get(IngestJobEntity, job_id)
+                session.expunge(sibling)
+                jobs.append(sibling)
+    return jobs
+
+
+def _fail_expired(session, job_id, attempts, now):
+    """最后一次执行的租约过期，任务和对应的入库任务一起标记为FAILED"""
+    error = f'Lease expired on the last attempt, attempts: {attempts}'
+    updated = session.query(IngestJobEntity).filter(
+        IngestJobEntity.id == job_id,
+        IngestJobEntity.attempts == attempts,
+        IngestJobEntity.status == JobStatus.RUNNING,
+        IngestJobEntity.lease_expires < now
+    ).update({
+        IngestJobEntity.status: JobStatus.FAILED,
+        IngestJobEntity.last_error: error,
+        IngestJobEntity.lease_owner: None,
+        IngestJobEntity.lease_expires: None
+    }, synchronize_session=False)
+    if updated:
+        task_id = session.query(IngestJobEntity.task_id).filter(IngestJobEntity.id == job_id).scalar()
+        session.query(StoreTaskEntity).filter(
+            StoreTaskEntity.task_id == task_id,
+            StoreTaskEntity.status.notin_((TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.DELETED))
+        ).update({StoreTaskEntity.status: TaskStatus.FAILED,
+                  StoreTaskEntity.message: error}, synchronize_session=False)
+    session.commit()
+    if updated:
+        log.error(f'Job failed, lease expired on the last attempt, id: {job_id}, task_id: {task_id}')
+
+
+def heartbeat(job_ids, worker_id, lease_seconds=LEASE_SECONDS):
+    """续租，返回租约仍属于当前worker的任务id"""
+    if not job_ids:
+        return set()
+    with session_scope() as session:
+        session.query(IngestJobEntity).filter(
+            IngestJobEntity.id.in_(job_ids),
+            IngestJobEntity.lease_owner == worker_id,
+            IngestJobEntity.status == JobStatus.RUNNING
+        ).update({IngestJobEntity.lease_expires: datetime.now() + timedelta(seconds=lease_seconds)},
+                 synchronize_session=False)
+        session.commit()
+        rows = session.query(IngestJobEntity.id).filter(
+            IngestJobEntity.id.in_(job_ids),
+            IngestJobEntity.lease_owner == worker_id
+        ).all()
+        return {row[0] for row in rows}
+    return set(job_ids)
+
+
+def _finish(job, worker_id, values):
+    with session_scope() as session:
+        updated = session.query(IngestJobEntity).filter(
+            IngestJobEntity.id == job.id,
+            IngestJobEntity.lease_owner == worker_id
+        ).update(values, synchronize_session=False)
+        session.commit()
+        return bool(updated)
+    return False
+
+
+def complete(job, worker_id):
+    return _finish(job, worker_id, {IngestJobEntity.status: JobStatus.COMPLETED,
+                                    IngestJobEntity.lease_owner: None,
+                                    IngestJobEntity.lease_expires: None})
+
+
+def backoff(attempts):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(0, attempts - 1))
+
+
+def fail(job, worker_id, error):
+    """失败后按退避时间重新排队，超过最大次数标记为FAILED"""
+    values = {IngestJobEntity.last_error: error,
+              IngestJobEntity.lease_owner: None,
+              IngestJobEntity.lease_expires: None}
+    if job.last_attempt:
+        values[IngestJobEntity.status] = JobStatus.FAILED
+    else:
+        values[IngestJobEntity.status] = JobStatus.PENDING
+        values[IngestJobEntity.run_after] = datetime.now() + timedelta(seconds=backoff(job.attempts))
+    return _finish(job, worker_id, values)
+
+
+class LeaseLost(Exception):
+    """任务租约已被其他worker领取，当前worker不能再写入任何结果"""
+
+
+class Lease:
+    """
+    传给handler的租约凭证：心跳发现租约丢失时置为lost，handler可以据此提前停止；
+    提交百炼入库任务、写入job_id等不可重复的操作前调用check()，到数据库确认租约仍属于当前worker并续租。
+    """
+
+    def __init__(self, job_ids, worker_id, lease_seconds=LEASE_SECONDS):
+        self.job_ids = list(job_ids)
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self._lost = threading.Event()
+
+    @property
+    def lost(self):
+        return self._lost.is_set()
+
+    def lose(self):
+        self._lost.set()
+
+    def check(self):
+        if not self._lost.is_set():
+            owned = heartbeat(self.job_ids, self.worker_id, self.lease_seconds)
+            if set(self.job_ids) <= owned:
+                return
+            self._lost.set()
+        raise LeaseLost(f'Job lease lost, ids: {self.job_ids}, worker: {self.worker_id}')
+
+
+def release(job, worker_id):
+    """worker正常退出时把未完成的任务放回队列，不计入重试次数"""
+    return _finish(job, worker_id, {IngestJobEntity.status: JobStatus.PENDING,
+                                    IngestJobEntity.attempts: job.attempts - 1,
+                                    IngestJobEntity.run_after: datetime.now(),
+                                    IngestJobEntity.lease_owner: None,
+                                    IngestJobEntity.lease_expires: None})
+
+
+class Worker:
+    """
+    入库任务worker：concurrency个线程各自领取任务执行，一个心跳线程定期为在途任务续租。
+    handlers为 {job_type: handler(job, lease)}，handler抛出异常即视为失败，按退避时间重试；
+    抛出LeaseLost表示任务已被其他worker接手，不再记录结果。
+    batch_handlers为 {job_type: handler(jobs, lease)}，领取时连同相同batch_key的排队任务一起执行，
+    返回 {job.id: 异常} 表示其中失败的任务，其余任务完成；handler抛出异常时整批失败。
+    on_failed(job, error)在最后一次重试仍失败时调用。
+    """
+
+    def __init__(self, handlers, concurrency=None, lease_seconds=LEASE_SECONDS,
+                 poll_interval=None, on_failed=None, batch_handlers=None, batch_size=BATCH_SIZE):
+        self.handlers = handlers
+        self.batch_handlers = batch_handlers or {}
+        self.batch_size = batch_size
+        self.concurrency = concurrency or job_queue_config.get('concurrency', 2)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval or job_queue_config.get('poll_interval', 2)
+        self.on_failed = on_failed
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._stopping = threading.Event()
+        self._closed = threading.Event()
+        self._running = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._heartbeat_thread = None
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, name=f'ingest-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name='ingest-heartbeat', daemon=True)
+        self._heartbeat_thread.start()
+        log.info(f'Ingest worker {self.worker_id} started, concurrency: {self.concurrency}')
+
+    def stop(self, timeout=None):
+        """不再领取新任务，等待在途任务结束；超时仍未结束的任务放回队列，由其他worker从已完成的步骤继续"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        # 等待期间继续续租，避免在途任务被其他worker重复领取
+        self._closed.set()
+        with self._lock:
+            running = [job for job, _ in self._running.values()]
+        for job in running:
+            release(job, self.worker_id)
+        log.info(f'Ingest worker {self.worker_id} stopped, released jobs: {[job.id for job in running]}')
+
+    def _loop(self):
+        job_types = list(self.handlers) + list(self.batch_handlers)
+        while not self._stopping.is_set():
+            jobs = []
+            try:
+                job = claim(self.worker_id, job_types, self.lease_seconds)
+                if job is not None:
+                    jobs.append(job)
+                    if job.job_type in self.batch_handlers:
+                        jobs += claim_batch(job, self.worker_id, self.batch_size - 1, self.lease_seconds)
+            except Exception as e:
+                log.error(f'Exception for claim job, worker: {self.worker_id}, e: {e}')
+            if not jobs:
+                self._stopping.wait(self.poll_interval)
+                continue
+            self._run(jobs)
+
+    def _run(self, jobs):
+        lease = Lease([job.id for job in jobs], self.worker_id, self.lease_seconds)
+        job_type = jobs[0].job_type
+        with self._lock:
+            for job in jobs:
+                self._running[job.id] = (job, lease)
+        for job in jobs:
+            log.info(f'Job started, id: {job.id}, type: {job.job_type}, task_id: {job.task_id}, '
+                     f'attempt: {job.attempts}/{job.max_attempts}, batch: {len(jobs)}')
+        try:
+            if job_type in self.batch_handlers:
+                errors = self.batch_handlers[job_type](jobs, lease) or {}
+            else:
+                self.handlers[job_type](jobs[0], lease)
+                errors = {}
+        except LeaseLost as e:
+            # 同一批里租约还属于当前worker的任务放回队列，由其他worker继续
+            for job in jobs:
+                release(job, self.worker_id)
+            log.warning(f'Job abandoned, ids: {[job.id for job in jobs]}, e: {e}')
+        except Exception as e:
+            self._finish(jobs, {job.id: e for job in jobs})
+        else:
+            self._finish(jobs, errors)
+        finally:
+            with self._lock:
+                for job in jobs:
+                    self._running.pop(job.id, None)
+
+    def _finish(self, jobs, errors):
+        for job in jobs:
+            if job.id in errors:
+                self._fail(job, errors[job.id])
+            else:
+                complete(job, self.worker_id)
+                log.info(f'Job completed, id: {job.id}, task_id: {job.task_id}')
+
+    def _fail(self, job, e):
+        trace_info = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        error = f'{e}, trace: {trace_info}'
+        log.error(f'Exception for job, id: {job.id}, task_id: {job.task_id}, '
+                  f'attempt: {job.attempts}/{job.max_attempts}, e: {error}')
+        # 租约已被其他worker领取时fail不生效，也不能把入库任务标记为失败
+        if fail(job, self.worker_id, error) and job.last_attempt and self.on_failed is not None:
+            self.on_failed(job, e)
+
+    def _heartbeat_loop(self):
+        while not self._closed.wait(self.lease_seconds / 3):
+            with self._lock:
+                job_ids = list(self._running)
+            try:
+                owned = heartbeat(job_ids, self.worker_id, self.lease_seconds)
+            except Exception as e:
+                log.error(f'Exception for job heartbeat, worker: {self.worker_id}, e: {e}')
+                continue
+            for job_id in set(job_ids) - owned:
+                # 租约过期后已被其他worker领取，通知handler停止，不再提交入库任务
+                log.warning(f'Job lease lost, id: {job_id}, worker: {self.worker_id}')
+                with self._lock:
+                    running = self._running.get(job_id)
+                if running is not None:
+                    running[1].lose()
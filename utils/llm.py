@@ -0,0 +1,52 @@
+import importlib.util
+import httpx
+from openai import AsyncOpenAI
+from utils.security import decrypt
+from utils.config import config
+from utils.log import log
+
+llm_config = config.get('llm', {})
+BASE_URL = llm_config.get('base_url', 'https://dashscope.aliyuncs.com/compatible-mode/v1')
+
+_client = None
+
+
+def create_llm_client() -> AsyncOpenAI:
+    """创建DashScope兼容OpenAI接口的client，连接池、keep-alive、超时和重试按application.yml中llm配置"""
+    limits = httpx.Limits(
+        max_connections=llm_config.get('max_connections', 100),
+        max_keepalive_connections=llm_config.get('max_keepalive_connections', 20),
+        keepalive_expiry=llm_config.get('keepalive_expiry', 60)
+    )
+    timeout = httpx.Timeout(
+        llm_config.get('timeout', 60),
+        connect=llm_config.get('connect_timeout', 5)
+    )
+    # HTTP/2需要安装h2，没有安装时退回HTTP/1.1
+    http2 = llm_config.get('http2', True) and importlib.util.find_spec('h2') is not None
+    http_client = httpx.AsyncClient(limits=limits, timeout=timeout, http2=http2)
+    return AsyncOpenAI(
+        api_key=decrypt(config['api_key']),
+        base_url=BASE_URL,
+        timeout=timeout,
+        max_retries=llm_config.get('max_retries', 2),
+        http_client=http_client
+    )
+
+
+def get_llm_client() -> AsyncOpenAI:
+    """进程内共享的client，应用启动时创建，未启动应用（如脚本调用）时首次使用再创建"""
+    global _client
+    if _client is None:
+        _client = create_llm_client()
+    return _client
+
+
+async def close_llm_client():
+    global _client
+    if _client is not None:
+        try:
+            await _client.close()
+        except Exception as e:
+            log.error(f'Exception for close_llm_client, e: {e}')
+        _client = None
@@ -0,0 +1,161 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# 耗时直方图的分桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 生成速度直方图的分桶上界（tokens/秒）
+RATE_BUCKETS = (5, 10, 20, 40, 80, 160, 320)
+
+
+class Histogram:
+    """固定分桶的直方图，分位数取所在分桶的上界，足够定位p99落在哪个阶段"""
+
+    def __init__(self, name, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            'name': self.name,
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'avg': round(self.sum / self.count, 4) if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'buckets': buckets,
+        }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    histogram = _histograms.get(name)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(name, Histogram(name, buckets))
+    histogram.observe(value)
+
+
+def histograms_snapshot():
+    return [histogram.snapshot() for histogram in sorted(list(_histograms.values()), key=lambda h: h.name)]
+
+
+class StageTimer:
+    """单个请求的分阶段耗时，用trace_id关联日志"""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.start = time.monotonic()
+        self.stages = {}
+        self.rates = {}
+
+    def record(self, name, seconds):
+        # 同一阶段出现多次（如推测检索和改写后检索）时依次编号
+        key, n = name, 1
+        while key in self.stages:
+            n += 1
+            key = f'{name}#{n}'
+        self.stages[key] = round(seconds, 4)
+
+    def mark(self, name):
+        """记录从请求开始到当前的耗时，如首个token"""
+        self.record(name, time.monotonic() - self.start)
+
+    def rate(self, name, value):
+        self.rates[name] = round(value, 2)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - start)
+
+    def finish(self, endpoint):
+        """
+        请求结束时写入直方图，返回全部耗时。
+        阶段名里冒号后的部分（如retrieve.index:<index_id>）和重复编号只保留在本请求的耗时里，不进直方图名。
+        """
+        self.stages['total'] = round(time.monotonic() - self.start, 4)
+        for name, seconds in self.stages.items():
+            observe(f"{endpoint}.{name.split('#')[0].split(':')[0]}", seconds)
+        for name, value in self.rates.items():
+            observe(f'{endpoint}.{name}', value, RATE_BUCKETS)
+        return self.timings()
+
+    def timings(self):
+        return {**self.stages, **self.rates}
+
+    def server_timing(self):
+        """Server-Timing响应头，单位毫秒；冒号后的部分（如index_id）放在desc里"""
+        metrics = []
+        for name, seconds in self.stages.items():
+            name, _, desc = name.replace('#', '-').partition(':')
+            desc = f';desc="{desc}"' if desc else ''
+            metrics.append(f'{name}{desc};dur={seconds * 1000:.1f}')
+        return ', '.join(metrics)
+
+
+current_timer = contextvars.ContextVar('stage_timer', default=None)
+
+
+@contextmanager
+def stage(name):
+    """在当前请求的StageTimer上记录一个阶段，没有StageTimer时不记录"""
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+    with timer.stage(name):
+        yield
+
+
+def record(name, seconds):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.record(name, seconds)
+
+
+def mark(name):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.mark(name)
+
+
+def rate(name, value):
+    timer = current_timer.get()
+    if timer is not None:
+        timer.rate(name, value)
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶，线程和事件循环共用。
+    取令牌时先预占（令牌数可以为负），返回需要等待的时间，调用方在锁外sleep，不会阻塞其他调用方。
+    """
+
+    def __init__(self, name, qps, burst=None):
+        self.name = name
+        self.qps = qps
+        self.burst = burst or qps
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waited_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.qps)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.qps if self._tokens < 0 else 0.0
+            self.calls += 1
+            if wait > 0:
+                self.waited_calls += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def stats(self):
+        return {
+            'api': self.name,
+            'qps': self.qps,
+            'burst': self.burst,
+            'calls': self.calls,
+            'waited_calls': self.waited_calls,
+            'total_wait': round(self.total_wait, 3),
+            'avg_wait': round(self.total_wait / self.calls, 4) if self.calls else 0.0,
+            'max_wait': round(self.max_wait, 3),
+        }
+
+
+class RateLimiter:
+    """按接口名分别限流，未单独配置的接口使用default配置"""
+
+    def __init__(self, limits):
+        limits = dict(limits or {})
+        self._default = limits.pop('default', {'qps': 10})
+        self._limits = limits
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, api):
+        bucket = self._buckets.get(api)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(api)
+                if bucket is None:
+                    limit = self._limits.get(api, self._default)
+                    bucket = TokenBucket(api, limit['qps'], limit.get('burst'))
+                    self._buckets[api] = bucket
+        return bucket
+
+    def acquire(self, api):
+        return self.bucket(api).acquire()
+
+    async def acquire_async(self, api):
+        return await self.bucket(api).acquire_async()
+
+    def stats(self):
+        return [bucket.stats() for bucket in list(self._buckets.values())]
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import time
+from utils.config import config
+
+# 与 SuccessResponse(data=QueryResponse(content=...)).model_dump_json(exclude_none=True) 的输出一致，预先拼好
+_PREFIX = 'data: {"code":200,"status":"success","data":{"content":'
+_SUFFIX = '}}\n\n'
+HEARTBEAT = ': ping\n\n'
+
+sse_config = config.get('sse', {})
+
+
+def content_frame(content):
+    return f'{_PREFIX}{json.dumps(content, ensure_ascii=False)}{_SUFFIX}'
+
+
+def json_frame(data):
+    return f'data: {data}\n\n'
+
+
+async def coalesce(deltas, flush_interval=None, max_frame_chars=None, heartbeat_interval=None):
+    """
+    把大模型逐token输出的增量文本合并成SSE帧。
+    第一个token立即输出，之后缓冲到max_frame_chars个字符或距缓冲开始超过flush_interval秒再输出一帧；
+    上游长时间没有输出时每heartbeat_interval秒发送一次心跳注释，防止代理断开连接。
+    """
+    if flush_interval is None:
+        flush_interval = sse_config.get('flush_interval', 0.05)
+    if max_frame_chars is None:
+        max_frame_chars = sse_config.get('max_frame_chars', 64)
+    if heartbeat_interval is None:
+        heartbeat_interval = sse_config.get('heartbeat_interval', 15)
+
+    iterator = deltas.__aiter__()
+    buffer = []
+    buffered_chars = 0
+    buffered_since = None
+    first = True
+    last_write = time.monotonic()
+    next_delta = None
+    try:
+        while True:
+            if next_delta is None:
+                next_delta = asyncio.ensure_future(iterator.__anext__())
+            now = time.monotonic()
+            if buffer:
+                timeout = max(0.0, buffered_since + flush_interval - now)
+            else:
+                timeout = max(0.0, last_write + heartbeat_interval - now)
+            done, _ = await asyncio.wait({next_delta}, timeout=timeout)
+            if not done:
+                if buffer:
+                    yield content_frame(''.join(buffer))
+                    buffer, buffered_chars, buffered_since = [], 0, None
+                else:
+                    yield HEARTBEAT
+                last_write = time.monotonic()
+                continue
+
+            task, next_delta = next_delta, None
+            try:
+                delta = task.result()
+            except StopAsyncIteration:
+                break
+            if not delta:
+                continue
+            buffer.append(delta)
+            buffered_chars += len(delta)
+            if buffered_since is None:
+                buffered_since = time.monotonic()
+            if first or buffered_chars >= max_frame_chars:
+                yield content_frame(''.join(buffer))
+                buffer, buffered_chars, buffered_since = [], 0, None
+                first = False
+                last_write = time.monotonic()
+        if buffer:
+            yield content_frame(''.join(buffer))
+    finally:
+        if next_delta is not None:
+            next_delta.cancel()
@@ -0,0 +1,80 @@
+import math
+import re
+import threading
+from utils.config import config
+
+_CJK = re.compile(r'[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+
+class TokenEstimator:
+    """
+    不加载分词器的token数估算：中文字符和其他字符分别按系数折算，
+    再用大模型返回的usage.prompt_tokens按指数滑动平均校准整体比例。
+    """
+
+    def __init__(self, cjk_tokens_per_char, other_tokens_per_char, smoothing=0.1):
+        self.cjk_tokens_per_char = cjk_tokens_per_char
+        self.other_tokens_per_char = other_tokens_per_char
+        self.smoothing = smoothing
+        self.scale = 1.0
+        self._lock = threading.Lock()
+
+    def _raw(self, text):
+        cjk = len(_CJK.findall(text))
+        return cjk * self.cjk_tokens_per_char + (len(text) - cjk) * self.other_tokens_per_char
+
+    def estimate(self, text):
+        if not text:
+            return 0
+        return math.ceil(self._raw(text) * self.scale)
+
+    def truncate(self, text, max_tokens):
+        """按估算截断文本，使其不超过max_tokens"""
+        if self.estimate(text) <= max_tokens:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.estimate(text[:middle]) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return text[:low]
+
+    def calibrate(self, estimated, actual):
+        """estimated为按当前比例估算的token数，actual为大模型实际统计的token数"""
+        if not estimated or not actual:
+            return
+        with self._lock:
+            ratio = self.scale * actual / estimated
+            self.scale += self.smoothing * (ratio - self.scale)
+
+
+tokens_config = config.get('tokens', {})
+estimator = TokenEstimator(tokens_config.get('cjk_tokens_per_char', 0.7),
+                           tokens_config.get('other_tokens_per_char', 0.3),
+                           tokens_config.get('calibration_smoothing', 0.1))
+
+
+def pack_texts(texts, budget, truncate_last=True, min_truncated_tokens=50):
+    """
+    texts按分数从高到低排列，依次放入直到用完token预算。
+    放不下的第一段在剩余预算不少于min_truncated_tokens时截断后放入，之后的段落丢弃。
+    返回 (放入的文本列表, 使用的token数, 是否截断)
+    """
+    packed = []
+    used = 0
+    for text in texts:
+        tokens = estimator.estimate(text)
+        if used + tokens <= budget:
+            packed.append(text)
+            used += tokens
+            continue
+        remaining = budget - used
+        if truncate_last and remaining >= min_truncated_tokens:
+            truncated = estimator.truncate(text, remaining)
+            packed.append(truncated)
+            used += estimator.estimate(truncated)
+            return packed, used, True
+        break
+    return packed, used, False
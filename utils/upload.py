@@ -0,0 +1,20 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def create_upload_session(pool_size, retries=0):
+    """上传OSS用的requests.Session，按host复用keep-alive连接，连接池大小与上传并发一致"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def put_file(session, file_path, url, headers, timeout=None, buffer_size=1024 * 1024):
+    """
+    从文件句柄流式PUT，不把文件读进内存。
+    requests按fstat得到Content-Length，不会改用chunked编码，预签名URL可以正常校验。
+    """
+    with open(file_path, 'rb', buffering=buffer_size) as file:
+        return session.put(url, data=file, headers=headers, timeout=timeout)
@@ -0,0 +1,31 @@
+import argparse
+import signal
+import threading
+from utils.log import log
+from utils.config import config
+from data.database import connect_db
+from services.jobs import create_worker
+from services.reconciler import Reconciler
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=None, help='同时执行的入库任务数，默认取job_queue.concurrency')
+    args = parser.parse_args()
+
+    connect_db()
+    worker = create_worker(args.concurrency)
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    worker.start()
+    # 百炼入库任务状态由worker进程后台同步，task_status只读数据库
+    reconciler = None
+    if config.get('reconciler', {}).get('enabled', True):
+        reconciler = Reconciler()
+        reconciler.start()
+    log.info('needle worker started.')
+    stopped.wait()
+    if reconciler is not None:
+        reconciler.stop()
+    worker.stop(config.get('job_queue', {}).get('shutdown_timeout', 30))
+    log.info('needle worker stopped.')